@@ -0,0 +1,209 @@
+"""
+Analytics Module
+Authentication statistics answered from incrementally maintained rollup tables
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from database import FingerprintDatabase
+
+# Match-percentage buckets: [0, 1), [1, 2), ..., [99, 100) and exactly 100
+HISTOGRAM_BUCKETS = 101
+
+
+def hour_key(value) -> Optional[str]:
+    """
+    Normalize a time to the rollup hour key ('YYYY-MM-DD HH:00:00', UTC)
+
+    Args:
+        value: datetime (naive values are taken as UTC), string understood by
+            datetime.fromisoformat, or None
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.strftime('%Y-%m-%d %H:00:00')
+
+
+def percentile_from_histogram(counts, q: float) -> Optional[float]:
+    """
+    Estimate a percentile from 1-point bucket counts
+
+    Values are assumed uniform inside a bucket, so estimates are within one
+    percentage point of the exact percentile.
+
+    Args:
+        counts: HISTOGRAM_BUCKETS counts
+        q: Percentile in [0, 100]
+
+    Returns:
+        Estimated match percentage, or None for an empty histogram
+    """
+    total = sum(counts)
+    if not total:
+        return None
+    target = q / 100 * total
+    cumulative = 0
+    for bucket, count in enumerate(counts):
+        if count and cumulative + count >= target:
+            if bucket == HISTOGRAM_BUCKETS - 1:
+                return 100.0
+            return bucket + max(target - cumulative, 0) / count
+        cumulative += count
+    return 100.0
+
+
+class AuthAnalytics:
+    """Success rates, volumes and score distributions over auth_logs"""
+
+    def __init__(self, db: FingerprintDatabase = None):
+        """
+        Initialize analytics
+
+        Args:
+            db: Database whose rollups are queried (defaults to the standard file)
+        """
+        self.db = db or FingerprintDatabase()
+
+    def summary(self, start=None, end=None) -> dict:
+        """
+        Attempt totals over [start, end)
+
+        Args:
+            start: Range start (see hour_key); None for the beginning
+            end: Range end, exclusive; None for now
+
+        Returns:
+            Dictionary with attempts, successes, failures, success_rate and
+            mean_match_percentage
+        """
+        attempts, successes, scored, score_sum = self.db.get_auth_rollup_totals(
+            hour_key(start), hour_key(end))
+        return {
+            'attempts': attempts,
+            'successes': successes,
+            'failures': attempts - successes,
+            'success_rate': successes / attempts if attempts else None,
+            'mean_match_percentage': score_sum / scored if scored else None
+        }
+
+    def hourly(self, start=None, end=None) -> list:
+        """
+        Attempt volume per hour over [start, end)
+
+        Returns:
+            List of dictionaries with hour, attempts, successes and
+            success_rate (hours without attempts are omitted)
+        """
+        return [{'hour': hour, 'attempts': attempts, 'successes': successes,
+                 'success_rate': successes / attempts if attempts else None}
+                for hour, attempts, successes, _, _
+                in self.db.get_hourly_auth_rollups(hour_key(start), hour_key(end))]
+
+    def histogram(self, start=None, end=None, user_id: int = None) -> list:
+        """
+        Match-percentage histogram
+
+        Args:
+            start: Range start (all-user histograms only)
+            end: Range end, exclusive (all-user histograms only)
+            user_id: Histogram of one user over all time instead
+
+        Returns:
+            HISTOGRAM_BUCKETS counts; bucket b covers [b, b + 1)
+        """
+        counts = [0] * HISTOGRAM_BUCKETS
+        for bucket, count in self.db.get_auth_score_histogram(hour_key(start), hour_key(end),
+                                                               user_id):
+            counts[bucket] = count
+        return counts
+
+    def percentiles(self, qs=(50, 90, 95, 99), start=None, end=None,
+                    user_id: int = None) -> dict:
+        """
+        Match-percentage percentiles estimated from the histogram
+
+        Returns:
+            Dictionary mapping 'p<q>' to the estimate (None without data)
+        """
+        counts = self.histogram(start, end, user_id)
+        return {f'p{q:g}': percentile_from_histogram(counts, q) for q in qs}
+
+    def user_summary(self, user_id: int) -> dict:
+        """
+        Lifetime totals and percentiles for one user
+
+        Returns:
+            Dictionary like summary() plus last_attempt and percentiles
+        """
+        row = self.db.get_user_auth_rollup(user_id)
+        attempts, successes, scored, score_sum, last_attempt = row or (0, 0, 0, 0.0, None)
+        return {
+            'user_id': user_id,
+            'attempts': attempts,
+            'successes': successes,
+            'failures': attempts - successes,
+            'success_rate': successes / attempts if attempts else None,
+            'mean_match_percentage': score_sum / scored if scored else None,
+            'last_attempt': last_attempt,
+            'percentiles': self.percentiles(user_id=user_id)
+        }
+
+    def top_failing_users(self, limit: int = 10) -> list:
+        """Users with the most failed attempts, most first"""
+        return [{'user_id': user_id, 'username': username, 'attempts': attempts,
+                 'failures': attempts - successes, 'last_attempt': last_attempt}
+                for user_id, username, attempts, successes, last_attempt
+                in self.db.get_users_by_auth_failures(limit)]
+
+    def dashboard(self, hours: int = 24) -> dict:
+        """Summary, hourly volume and percentiles for the last few hours"""
+        start = datetime.now(timezone.utc) - timedelta(hours=hours - 1)
+        return {
+            'since': hour_key(start),
+            'summary': self.summary(start),
+            'percentiles': self.percentiles(start=start),
+            'hourly': self.hourly(start)
+        }
+
+    def backfill(self, batch_size: int = 50000) -> dict:
+        """
+        Fold logs written before the rollups existed into them
+
+        Returns:
+            Dictionary with rows counted and the final backfill state
+        """
+        counted = self.db.backfill_auth_rollups(batch_size)
+        through, done = self.db.get_auth_rollup_state()
+        return {'rows_counted': counted, 'backfill_through': through, 'backfilled_to': done}
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Authentication analytics")
+    parser.add_argument("--db", default="fingerprint_db.sqlite", help="database file")
+    parser.add_argument("--backfill", action="store_true",
+                        help="count logs written before the rollups existed")
+    parser.add_argument("--hours", type=int, default=24, help="dashboard window in hours")
+    parser.add_argument("--user-id", type=int, default=None, help="show one user instead")
+    parser.add_argument("--top-failing", type=int, default=0, metavar="N",
+                        help="also list the N users with the most failures")
+    args = parser.parse_args()
+
+    analytics = AuthAnalytics(FingerprintDatabase(args.db))
+    report = {}
+    if args.backfill:
+        report['backfill'] = analytics.backfill()
+    if args.user_id is not None:
+        report['user'] = analytics.user_summary(args.user_id)
+    else:
+        report['dashboard'] = analytics.dashboard(args.hours)
+    if args.top_failing:
+        report['top_failing_users'] = analytics.top_failing_users(args.top_failing)
+    print(json.dumps(report, indent=2))
+    analytics.db.close()
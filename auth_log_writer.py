@@ -0,0 +1,159 @@
+"""
+Authentication Log Writer
+Background sink that batches auth_logs inserts off the request path
+"""
+
+import atexit
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class AuthLogWriter:
+    """Queues authentication events and writes them in batched transactions"""
+
+    def __init__(self, db, batch_size: int = 256, flush_interval: float = 0.05,
+                 max_queue: int = 10000, put_timeout: float = 1.0):
+        """
+        Initialize and start the writer thread
+
+        Args:
+            db: FingerprintDatabase that receives the log rows
+            batch_size: Maximum rows written per transaction
+            flush_interval: Seconds a partial batch may wait before writing
+            max_queue: Maximum queued events; producers block when it is full
+            put_timeout: Seconds a producer blocks before writing synchronously
+        """
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._flush_now = threading.Event()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._producers = 0
+        self.events_written = 0
+        self.batches_written = 0
+        self.events_dropped = 0
+        self._thread = threading.Thread(target=self._run, name='auth-log-writer',
+                                        daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def log(self, user_id: int, success: bool, match_percentage: float = None):
+        """
+        Queue an authentication event
+
+        The attempt time is captured now, not when the row is written. When
+        the queue is full the caller blocks (back-pressure); if it is still
+        full after put_timeout the event is written synchronously instead.
+        Events logged after close() are written synchronously as well.
+        """
+        attempt_time = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        event = (user_id, attempt_time, bool(success), match_percentage)
+        with self._condition:
+            closed = self._closed
+            if not closed:
+                self._producers += 1
+        if closed:
+            self.db.log_authentications([event])
+            return
+        try:
+            self._queue.put(event, timeout=self.put_timeout)
+        except queue.Full:
+            self.db.log_authentications([event])
+        finally:
+            with self._condition:
+                self._producers -= 1
+                if not self._producers:
+                    self._condition.notify_all()
+
+    def flush(self):
+        """Block until every queued event has been written"""
+        if self._closed:
+            return
+        self._flush_now.set()
+        self._queue.join()
+
+    def close(self):
+        """Flush pending events and stop the writer thread"""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            # Producers that got past the closed check enqueue before _STOP,
+            # so the writer sees every queued event
+            while self._producers:
+                self._condition.wait()
+        self._queue.put(_STOP)
+        self._thread.join()
+        atexit.unregister(self.close)
+
+    def stats(self) -> dict:
+        """Get writer throughput counters"""
+        return {
+            'queued': self._queue.qsize(),
+            'events_written': self.events_written,
+            'batches_written': self.batches_written,
+            'events_dropped': self.events_dropped
+        }
+
+    def _run(self):
+        """Collect events into batches bounded by size and age"""
+        stopping = False
+        while not stopping:
+            event = self._queue.get()
+            if event is _STOP:
+                self._queue.task_done()
+                break
+            batch = [event]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if self._flush_now.is_set():
+                    remaining = 0
+                try:
+                    if remaining > 0:
+                        event = self._queue.get(timeout=remaining)
+                    else:
+                        event = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if event is _STOP:
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                batch.append(event)
+            self._write(batch)
+            for _ in batch:
+                self._queue.task_done()
+            if self._queue.empty():
+                self._flush_now.clear()
+
+    def _write(self, batch):
+        """
+        Write one batch, retrying once
+
+        If the retry fails too, the events are written one at a time so a
+        single bad event is dropped on its own instead of with the batch.
+        """
+        for attempt in range(2):
+            try:
+                self.db.log_authentications(batch)
+                self.events_written += len(batch)
+                self.batches_written += 1
+                return
+            except Exception:
+                if attempt and len(batch) == 1:
+                    self.events_dropped += 1
+                    logger.exception('Dropped an authentication log event: %r', batch[0])
+                    return
+        for event in batch:
+            self._write([event])
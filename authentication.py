@@ -3,47 +3,88 @@ Authentication Module
 Handles fingerprint-based authentication and verification
 """
 
+import os
+import threading
+import time
+import numpy as np
+from auth_log_writer import AuthLogWriter
+from centroid_verification import CentroidVerifier
 from database import FingerprintDatabase
 from fingerprint_processor import FingerprintProcessor
+from fusion import ScoreFusion
+from gallery_cache import GalleryCache
+from gallery_snapshot import GallerySnapshot
+from identification import IVFIndex
+from metrics import metrics
+from records import AuthHistory, AuthRecord, AuthResult
 from datetime import datetime
 
 class AuthenticationManager:
     """Manages fingerprint-based authentication"""
     
-    def __init__(self):
+    def __init__(self, db: FingerprintDatabase = None):
         """Initialize authentication manager"""
-        self.db = FingerprintDatabase()
+        self.db = db or FingerprintDatabase()
         self.processor = FingerprintProcessor()
+        self.gallery = GalleryCache(self.db, self.processor)
+        self.log_writer = AuthLogWriter(self.db)
+        self.batcher = None
+        self.sharded = None
+        self.centroid_verifier = None
+        self.fusion = ScoreFusion()
+        self.index_path = os.path.splitext(self.db.db_path)[0] + '_index.npz'
+        self.index_quantization = None
+        self.snapshot_path = os.path.splitext(self.db.db_path)[0] + '_gallery.fpgs'
+        self._index = None
+        self._index_stale = False
+        self._index_check = False
+        self._index_lock = threading.Lock()
+        self.db.add_change_listener(self._mark_index_stale)
     
     def authenticate_user(self, username: str, 
-                         fingerprint_sample: str = None) -> dict:
+                         fingerprint_sample: str = None) -> AuthResult:
         """
         Authenticate user using fingerprint
         
+        Several fingers or captures can be presented at once as a list of
+        samples. They are scored against the user's templates in one matrix
+        product and fused with the rule set by enable_fusion.
+        
         Args:
             username: Username to authenticate
-            fingerprint_sample: Fingerprint sample (auto-generated if None)
+            fingerprint_sample: Fingerprint sample, or a list of samples
+                (auto-generated if None)
             
         Returns:
-            Dictionary with authentication result
+            AuthResult (readable like the former result dict); multi-sample
+            results also carry the per-probe scores, and the genuine
+            probability under the trained fusion rule. match_percentage is
+            None when centroid verification decided from a bound.
         """
+        started = time.perf_counter()
+        fused = isinstance(fingerprint_sample, (list, tuple))
+        if fused and not fingerprint_sample:
+            raise ValueError("At least one fingerprint sample is required")
+        
         # Get user ID
-        user_id = self.db.get_user_by_username(username)
+        with metrics.timer('auth_stage_seconds', stage='user_lookup'):
+            user_id = self.gallery.get_user_id(username)
         if not user_id:
-            return {
-                'success': False,
-                'message': 'User not found',
-                'match_percentage': 0.0
-            }
+            metrics.inc('auth_requests_total', result='unknown_user')
+            return AuthResult(False, 'User not found', 0.0)
         
-        # Get stored fingerprints
-        stored_fingerprints = self.db.get_user_fingerprints(user_id)
-        if not stored_fingerprints:
-            return {
-                'success': False,
-                'message': 'No fingerprints enrolled for this user',
-                'match_percentage': 0.0
-            }
+        # Get stored templates as one pre-normalized matrix, or just the
+        # centroid when centroid verification is enabled
+        with metrics.timer('auth_stage_seconds', stage='template_fetch'):
+            if self.centroid_verifier is not None and not fused:
+                user_centroid = self.gallery.get_centroid(user_id)
+                enrolled = user_centroid is not None
+            else:
+                template_matrix = self.gallery.get_templates(user_id)
+                enrolled = len(template_matrix) > 0
+        if not enrolled:
+            metrics.inc('auth_requests_total', result='no_templates')
+            return AuthResult(False, 'No fingerprints enrolled for this user', 0.0)
         
         # Generate live fingerprint sample if not provided
         if fingerprint_sample is None:
@@ -53,55 +94,257 @@ class AuthenticationManager:
             )
         
         # Extract features from live sample
-        live_features = self.processor.extract_features(fingerprint_sample)
+        with metrics.timer('auth_stage_seconds', stage='decode'):
+            if fused:
+                live_features = np.stack([self.processor.extract_features(sample)
+                                          for sample in fingerprint_sample])
+            else:
+                live_features = self.processor.extract_features(fingerprint_sample)
         
-        # Extract features from stored templates
-        stored_features_list = [
-            self.processor.extract_features(fp[1]) 
-            for fp in stored_fingerprints
-        ]
+        # Match fingerprints with a single matrix-vector product, or together
+        # with concurrent requests when micro-batching is enabled
+        probe_scores = score_bound = probability = None
+        with metrics.timer('auth_stage_seconds', stage='match'):
+            if fused:
+                is_match, match_percentage, probe_scores, probability = \
+                    self.processor.match_fingerprints_fused(live_features, template_matrix,
+                                                            self.fusion)
+                probe_scores = [round(float(score), 2) for score in probe_scores]
+            elif self.centroid_verifier is not None:
+                is_match, match_percentage, score_bound = self.centroid_verifier.verify(
+                    live_features, user_centroid,
+                    lambda: self.gallery.get_templates(user_id)
+                )
+            elif self.batcher is not None:
+                is_match, match_percentage = self.batcher.match(live_features,
+                                                                template_matrix)
+            else:
+                is_match, match_percentage = self.processor.match_fingerprint_batch(
+                    live_features, 
+                    template_matrix
+                )
+        
+        # Queue authentication attempt for the background log writer
+        with metrics.timer('auth_stage_seconds', stage='log_write'):
+            # A centroid bound decided without computing the best score; the
+            # attempt is logged with a NULL match_percentage
+            self.log_writer.log(user_id, is_match, match_percentage)
         
-        # Match fingerprints
-        is_match, match_percentage = self.processor.match_fingerprint(
-            live_features, 
-            stored_features_list
-        )
+        result = 'granted' if is_match else 'denied'
+        metrics.inc('auth_requests_total', result=result)
+        metrics.observe('auth_seconds', time.perf_counter() - started, result=result)
         
-        # Log authentication attempt
-        self.db.log_authentication(user_id, is_match, match_percentage)
+        return AuthResult(is_match, 'Access Granted' if is_match else 'Access Denied',
+                          None if match_percentage is None else round(match_percentage, 2),
+                          username, datetime.now().isoformat(), probe_scores,
+                          None if score_bound is None else round(score_bound, 2),
+                          None if probability is None else round(probability, 4))
+    
+    def identify(self, fingerprint_sample: str = None, top_k: int = 5) -> dict:
+        """
+        Identify a user by searching the whole enrolled population (1:N)
+        
+        Args:
+            fingerprint_sample: Fingerprint sample (auto-generated if None)
+            top_k: Number of candidate users to return
+            
+        Returns:
+            Dictionary with the best candidates and identification result
+        """
+        # Generate live fingerprint sample if not provided
+        if fingerprint_sample is None:
+            fingerprint_id = f"identify_{datetime.now().timestamp()}"
+            _, fingerprint_sample = self.processor.generate_fingerprint_template(
+                fingerprint_id
+            )
+        
+        live_features = self.processor.extract_features(fingerprint_sample)
+        with metrics.timer('identify_seconds'):
+            if self.sharded is not None:
+                matches = self.sharded.search(live_features, top_k)
+            else:
+                # The lock only covers catching up; updates build a new index
+                # and swap it in, so searches run concurrently on their own
+                matches = self.get_index().search(live_features, top_k)
+        usernames = self.db.get_usernames(user_id for user_id, _ in matches)
+        
+        candidates = [
+            {
+                'user_id': user_id,
+                'username': usernames.get(user_id),
+                'match_percentage': round(score * 100, 2),
+                'is_match': score >= self.processor.match_threshold
+            }
+            for user_id, score in matches
+        ]
+        identified = bool(candidates) and candidates[0]['is_match']
         
         return {
-            'success': is_match,
-            'message': 'Access Granted' if is_match else 'Access Denied',
-            'match_percentage': round(match_percentage, 2),
-            'username': username,
+            'success': identified,
+            'message': (f"Identified {candidates[0]['username']}" if identified
+                        else 'No matching user found'),
+            'candidates': candidates,
             'timestamp': datetime.now().isoformat()
         }
     
+    def get_index(self) -> IVFIndex:
+        """Load, build or catch up the identification index"""
+        with self._index_lock:
+            return self._current_index()
+    
+    def _current_index(self) -> IVFIndex:
+        """
+        Return an up-to-date index; caller must hold _index_lock
+        
+        The published index is never modified: catching up works on a copy
+        that then replaces it, so callers may search it without the lock.
+        """
+        if self._index is None:
+            if os.path.exists(self.index_path):
+                try:
+                    # Rejected when saved from another database of the same name
+                    self._index = IVFIndex.load(self.index_path, self.db)
+                    self._index.set_rescore_source(self.db, self.processor)
+                except (OSError, ValueError, KeyError):
+                    self._index = None
+            if self._index is None and os.path.exists(self.snapshot_path):
+                try:
+                    self._index = IVFIndex.build_from_snapshot(
+                        GallerySnapshot(self.snapshot_path), self.db, self.processor,
+                        quantization=self.index_quantization
+                    )
+                except (OSError, ValueError):
+                    self._index = None
+            if self._index is None:
+                self._index = IVFIndex.build_from_database(
+                    self.db, self.processor, quantization=self.index_quantization
+                )
+                self._index.save(self.index_path)
+            else:
+                # Rows may have been imported below the saved watermark
+                self._index.sync(self.db, self.processor, check_watermark=True)
+        elif self._index_stale:
+            check, self._index_stale, self._index_check = self._index_check, False, False
+            index = self._index.copy()
+            index.sync(self.db, self.processor, check_watermark=check)
+            self._index = index
+        return self._index
+    
+    def save_index(self):
+        """Persist the identification index so restarts skip rebuilding it"""
+        with self._index_lock:
+            if self._index is not None:
+                # Saving merges pending templates, so save a copy and publish it
+                index = self._index.copy()
+                index.save(self.index_path)
+                self._index = index
+    
+    def _mark_index_stale(self, user_id):
+        """
+        Change listener: new templates must be added before the next search
+        
+        Bulk changes (user_id None, e.g. imports) may add rows below the
+        index watermark, so the next sync also checks for those.
+        """
+        if user_id is None:
+            self._index_check = True
+        self._index_stale = True
+    
+    def enable_micro_batching(self, max_batch: int = 64, max_wait_ms: float = 2.0):
+        """
+        Score concurrent authentications together in small batches
+        
+        Args:
+            max_batch: Requests scored in one matrix multiplication at most
+            max_wait_ms: Longest a request waits for its batch to fill
+        """
+        # Imported on first use to keep startup cheap
+        from micro_batching import VerificationBatcher
+        
+        if self.batcher is not None:
+            self.batcher.close()
+        self.batcher = VerificationBatcher(self.processor, max_batch, max_wait_ms)
+    
+    def enable_centroid_verification(self):
+        """
+        Decide clear accepts and rejects from the user's centroid alone
+        
+        Decisions equal the full template scan's. When a bound decided,
+        the best score is never computed: the result's match_percentage is
+        None with the bound in score_bound, and the attempt is logged with
+        a NULL match_percentage. Verifier statistics report the dot
+        products saved.
+        """
+        self.centroid_verifier = CentroidVerifier(self.processor)
+    
+    def enable_fusion(self, rule: str = 'max', weights=None, model=None):
+        """
+        Set how multi-sample verifications fuse their per-probe scores
+        
+        Args:
+            rule: 'max', 'mean', 'weighted' or 'trained' (see fusion.FUSION_RULES)
+            weights: Per-probe weights for the weighted rule
+            model: TrainedFusion from fusion.train_fusion for the trained rule
+        """
+        self.fusion = ScoreFusion(rule, self.processor.match_threshold, weights, model)
+    
+    def enable_sharded_identification(self, shards: int = None):
+        """
+        Answer identify() with an exact search sharded across worker processes
+        
+        Args:
+            shards: Worker processes (defaults to the CPU count)
+        """
+        # Imported on first use: pulls in multiprocessing and shared memory
+        from sharded_identification import ShardedIdentifier
+        
+        if self.sharded is not None:
+            self.sharded.close()
+        snapshot = None
+        if os.path.exists(self.snapshot_path):
+            snapshot = GallerySnapshot(self.snapshot_path)
+        self.sharded = ShardedIdentifier(self.db, self.processor, shards).start(snapshot)
+    
+    def close(self):
+        """Flush queued authentication logs and persist the index"""
+        if self.batcher is not None:
+            self.batcher.close()
+        if self.sharded is not None:
+            self.sharded.close()
+        self.log_writer.close()
+        self.save_index()
+    
     def get_authentication_history(self, username: str, limit: int = 10) -> list:
-        """Get authentication history for a user"""
+        """Get authentication history for a user as a list of AuthRecord"""
         user_id = self.db.get_user_by_username(username)
         if not user_id:
             return []
         
-        conn = __import__('sqlite3').connect(self.db.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT attempt_time, success, match_percentage 
-            FROM auth_logs 
-            WHERE user_id = ? 
-            ORDER BY attempt_time DESC 
-            LIMIT ?
-        ''', (user_id, limit))
+        # Make sure queued attempts are visible before reading
+        self.log_writer.flush()
+        history = self.db.get_authentication_history(user_id, limit)
         
-        history = cursor.fetchall()
-        conn.close()
+        return [AuthRecord(h[0], bool(h[1]), h[2]) for h in history]
+    
+    def get_authentication_history_columns(self, username: str = None,
+                                           limit: int = None) -> AuthHistory:
+        """
+        Get authentication history as numpy columns for bulk reads
         
-        return [
-            {
-                'timestamp': h[0],
-                'success': bool(h[1]),
-                'match_percentage': h[2]
-            }
-            for h in history
-        ]
+        Args:
+            username: Only this user's attempts (all users when None)
+            limit: Most recent attempts to return (all when None)
+            
+        Returns:
+            AuthHistory, most recent attempt first (empty for unknown users)
+        """
+        user_id = None
+        if username is not None:
+            user_id = self.db.get_user_by_username(username)
+            if not user_id:
+                user_id = -1
+        self.log_writer.flush()
+        user_ids, seconds, success, match_percentage = \
+            self.db.get_authentication_history_columns(user_id, limit)
+        return AuthHistory(user_ids, seconds.astype('datetime64[s]'), success,
+                           match_percentage)
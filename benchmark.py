@@ -0,0 +1,538 @@
+"""
+Benchmark Suite
+Reproducible throughput/latency benchmarks for enrollment, verification
+and identification against synthetic galleries
+"""
+
+import argparse
+import gc
+import hashlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from analytics import AuthAnalytics
+from calibration import calibrate
+from centroid_verification import differential_check, scores_consistent, synthetic_users
+from data_transfer import export_database, import_database
+from database import FingerprintDatabase
+from fingerprint_processor import FingerprintProcessor
+from gallery_snapshot import GallerySnapshot, write_snapshot
+from identification import _load_rows
+from matcher import normalize_templates
+from metrics import metrics
+from records import AuthRecord
+from sharded_identification import ShardedIdentifier
+from template_codec import encode_template
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DEFAULT_SIZES = (1_000, 100_000, 1_000_000)
+SAMPLES_PER_USER = 3
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MiB"""
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def measure(name: str, operation, iterations: int, gallery_size: int = 0,
+            warmup: int = 10, batch: int = 1) -> dict:
+    """
+    Time an operation call by call
+
+    Args:
+        name: Benchmark name
+        operation: Callable taking the iteration number
+        iterations: Timed calls
+        gallery_size: Templates in the gallery under test
+        warmup: Untimed calls made first
+        batch: Logical operations performed per call
+
+    Returns:
+        Result dictionary with ops/sec, latency percentiles and peak RSS
+    """
+    for i in range(warmup):
+        operation(i)
+    gc.collect()
+    latencies = np.empty(iterations)
+    start = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        operation(warmup + i)
+        latencies[i] = time.perf_counter() - t0
+    elapsed = time.perf_counter() - start
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {
+        'name': name,
+        'gallery_size': gallery_size,
+        'iterations': iterations,
+        'ops_per_sec': iterations * batch / elapsed if elapsed else 0.0,
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99),
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def measure_startup(name: str, statement: str, runs: int = 5) -> dict:
+    """
+    Time a statement in fresh interpreters, the way an entry point starts
+
+    Returns:
+        Result dictionary with the median seconds spent in the statement and
+        the median process wall time including interpreter startup
+    """
+    code = f'import time\n_start = time.perf_counter()\n{statement}\nprint(time.perf_counter() - _start)'
+    inner, outer = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', code], cwd=PACKAGE_DIR,
+                                capture_output=True, text=True, check=True).stdout
+        outer.append(time.perf_counter() - start)
+        inner.append(float(output.split()[-1]))
+    return {'name': name, 'runs': runs, 'seconds': float(np.median(inner)),
+            'process_seconds': float(np.median(outer))}
+
+
+def allocated_bytes(factory, count: int = 100_000) -> float:
+    """Bytes allocated per object when factory(i) builds count objects"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        objects = [factory(i) for i in range(count)]
+        allocated = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del objects
+    return allocated / count
+
+
+def measure_concurrent(name: str, operation, total: int, threads: int,
+                       gallery_size: int = 0) -> dict:
+    """
+    Time an operation issued from many threads at once
+
+    Returns:
+        Result dictionary with aggregate ops/sec and per-call latency percentiles
+    """
+    def timed(i):
+        t0 = time.perf_counter()
+        operation(i)
+        return time.perf_counter() - t0
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(operation, range(threads)))
+        gc.collect()
+        start = time.perf_counter()
+        latencies = np.array(list(executor.map(timed, range(total))))
+        elapsed = time.perf_counter() - start
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {
+        'name': name,
+        'gallery_size': gallery_size,
+        'iterations': total,
+        'threads': threads,
+        'ops_per_sec': total / elapsed if elapsed else 0.0,
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99),
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def check_centroid_verification(auth, attempts, expected):
+    """
+    Assert that centroid verification agrees with exhaustive results
+
+    Args:
+        auth: AuthenticationManager with centroid verification enabled
+        attempts: (username, sample) pairs
+        expected: authenticate_user results for attempts without it
+
+    Raises:
+        AssertionError: On a differing decision, a differing exact score or
+            a bound on the wrong side of the exhaustive score
+    """
+    for (name, sample), exhaustive in zip(attempts, expected):
+        result = auth.authenticate_user(name, sample)
+        assert result['success'] == exhaustive['success'], (name, result, exhaustive)
+        assert scores_consistent(result['success'], result.get('match_percentage'),
+                                 result.get('score_bound'), exhaustive['match_percentage'],
+                                 tolerance=0.01), (name, result, exhaustive)
+
+
+def build_gallery(db: FingerprintDatabase, size: int, seed: int = 0,
+                  chunk_users: int = 10_000) -> int:
+    """
+    Fill a database with synthetic users holding SAMPLES_PER_USER templates each
+
+    Returns:
+        Number of users created
+    """
+    rng = np.random.default_rng(seed)
+    users = max(1, size // SAMPLES_PER_USER)
+    for first in range(0, users, chunk_users):
+        count = min(chunk_users, users - first)
+        vectors = rng.standard_normal((count, SAMPLES_PER_USER, 128), dtype=np.float32)
+        records = []
+        for offset in range(count):
+            user = first + offset
+            templates = []
+            for vector in vectors[offset]:
+                blob = encode_template(vector)
+                templates.append((hashlib.sha256(blob).hexdigest(), blob))
+            records.append((user, f'bench_user_{user}', f'bench_user_{user}@example.com',
+                            templates))
+        db.bulk_enroll(records)
+    return users
+
+
+def run_suite(sizes, iterations: int = 1000, workdir: str = None) -> dict:
+    """Run every benchmark for each gallery size"""
+    from authentication import AuthenticationManager
+    from enrollment import EnrollmentManager
+
+    processor = FingerprintProcessor()
+    rng = np.random.default_rng(42)
+    results = []
+
+    # Gallery-independent kernels
+    a, b = rng.standard_normal((2, 128))
+    results.append(measure('calculate_similarity',
+                           lambda i: processor.calculate_similarity(a, b),
+                           iterations * 10))
+    per_user = list(rng.standard_normal((SAMPLES_PER_USER, 128)))
+    results.append(measure('match_fingerprint',
+                           lambda i: processor.match_fingerprint(a, per_user),
+                           iterations * 10))
+
+    results.append(measure('generate_templates_x1000',
+                           lambda i: processor.generate_templates(
+                               f'bench_generate_{i}_{j}' for j in range(1000)),
+                           max(10, iterations // 100), batch=1000))
+
+    # History records: per-row dicts versus slotted records
+    stamp = '2024-01-01 00:00:00'
+    for name, factory in (
+            ('auth_history_dicts', lambda i: {'timestamp': stamp, 'success': bool(i & 1),
+                                              'match_percentage': i / 7}),
+            ('auth_history_records', lambda i: AuthRecord(stamp, bool(i & 1), i / 7))):
+        result = measure(name + '_x1000',
+                         lambda i: [factory(j) for j in range(1000)],
+                         max(10, iterations // 10), batch=1000)
+        result['bytes_per_record'] = allocated_bytes(factory)
+        results.append(result)
+
+    # Entry point startup in fresh interpreters
+    tmp = tempfile.mkdtemp(dir=workdir, prefix='fp_bench_')
+    try:
+        startup_db = os.path.join(tmp, 'startup.sqlite')
+        FingerprintDatabase(startup_db).close()
+        for name, statement in (
+                ('startup_import_database', 'import database'),
+                ('startup_open_database', 'from database import FingerprintDatabase\n'
+                                          f'FingerprintDatabase({startup_db!r}).close()'),
+                ('startup_import_gui_app', 'import gui_app'),
+                ('startup_import_verification_service', 'import verification_service'),
+                ('startup_import_bulk_enrollment', 'import bulk_enrollment')):
+            try:
+                results.append(measure_startup(name, statement))
+            except subprocess.CalledProcessError:  # e.g. no tkinter
+                pass
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    for size in sizes:
+        tmp = tempfile.mkdtemp(dir=workdir, prefix='fp_bench_')
+        try:
+            db = FingerprintDatabase(os.path.join(tmp, 'bench.sqlite'))
+            start = time.perf_counter()
+            users = build_gallery(db, size)
+            results.append({'name': 'build_gallery', 'gallery_size': size,
+                            'seconds': time.perf_counter() - start,
+                            'peak_rss_mb': peak_rss_mb()})
+
+            # Cold start: map a snapshot (measured first so its peak RSS is
+            # not masked) versus decoding every row from SQLite
+            snapshot_path = os.path.join(tmp, 'bench.fpgs')
+            start = time.perf_counter()
+            write_snapshot(db, processor, snapshot_path)
+            results.append({'name': 'write_gallery_snapshot', 'gallery_size': size,
+                            'seconds': time.perf_counter() - start,
+                            'peak_rss_mb': peak_rss_mb()})
+            start = time.perf_counter()
+            snapshot = GallerySnapshot(snapshot_path)
+            float(snapshot.matrix.sum())
+            results.append({'name': 'cold_start_snapshot', 'gallery_size': size,
+                            'seconds': time.perf_counter() - start,
+                            'peak_rss_mb': peak_rss_mb()})
+            del snapshot
+            start = time.perf_counter()
+            _load_rows(db, processor, 0)
+            results.append({'name': 'cold_start_sqlite', 'gallery_size': size,
+                            'seconds': time.perf_counter() - start,
+                            'peak_rss_mb': peak_rss_mb()})
+
+            # Streaming export and import through gzip JSONL
+            export_dir = os.path.join(tmp, 'export')
+            start = time.perf_counter()
+            export_database(db, export_dir)
+            results.append({'name': 'export_database', 'gallery_size': size,
+                            'seconds': time.perf_counter() - start,
+                            'peak_rss_mb': peak_rss_mb()})
+            replica = FingerprintDatabase(os.path.join(tmp, 'replica.sqlite'))
+            start = time.perf_counter()
+            import_database(replica, export_dir)
+            results.append({'name': 'import_database', 'gallery_size': size,
+                            'seconds': time.perf_counter() - start,
+                            'peak_rss_mb': peak_rss_mb()})
+            replica.close()
+
+            # All-pairs threshold calibration over at most 20k templates
+            _, owners, templates = GallerySnapshot(snapshot_path).rows()
+            calibration = calibrate(templates[:20_000], owners[:20_000])
+            results.append({'name': 'calibrate_all_pairs', 'gallery_size': size,
+                            'templates': calibration['templates'],
+                            'seconds': calibration['seconds'],
+                            'pairs_per_second': calibration['pairs_per_second'],
+                            'peak_rss_mb': peak_rss_mb()})
+            del owners, templates
+
+            gallery = normalize_templates(rng.standard_normal((size, 128), dtype=np.float32))
+            probe = rng.standard_normal(128)
+            scan_iterations = max(10, min(iterations, 10_000_000 // size))
+            results.append(measure('match_fingerprint_batch_full_gallery',
+                                   lambda i: processor.match_fingerprint_batch(probe, gallery),
+                                   scan_iterations, size))
+            del gallery
+
+            auth = AuthenticationManager(db)
+            names = [f'bench_user_{u}' for u in rng.integers(0, users, iterations + 10)]
+            samples = [encode_template(row) for row in
+                       processor.generate_templates(f'bench_probe_{i}' for i in range(64))[1]]
+            results.append(measure('authenticate_user',
+                                   lambda i: auth.authenticate_user(names[i], samples[i % 64]),
+                                   iterations, size))
+
+            # Three fingers per attempt fused from one (3, N) score matrix
+            auth.enable_fusion('mean')
+            results.append(measure('authenticate_user_fused_x3',
+                                   lambda i: auth.authenticate_user(
+                                       names[i], [samples[(i + k) % 64] for k in range(3)]),
+                                   iterations, size))
+            auth.enable_fusion()
+
+            metrics.enable()
+            results.append(measure('authenticate_user_metrics_enabled',
+                                   lambda i: auth.authenticate_user(names[i], samples[i % 64]),
+                                   iterations, size))
+            metrics.disable()
+            metrics.reset()
+
+            # Centroid early-exit verification: decisions must equal the
+            # exhaustive scan; report dot products per verification
+            check_users = [auth.gallery.get_templates(auth.gallery.get_user_id(f'bench_user_{u}'))
+                           for u in rng.choice(users, min(users, 200), replace=False)]
+            results.append(dict(name='centroid_verification_check', gallery_size=size,
+                                **differential_check(check_users)))
+            results.append(dict(name='centroid_verification_check_clustered',
+                                gallery_size=size,
+                                **differential_check(synthetic_users(min(users, 200)))))
+            for report in results[-2:]:
+                assert not (report['decision_mismatches'] or report['score_mismatches']), report
+            check = [(names[i], samples[i % 64]) for i in range(min(200, iterations))]
+            expected = [auth.authenticate_user(name, sample) for name, sample in check]
+            auth.enable_centroid_verification()
+            check_centroid_verification(auth, check, expected)
+            for name in set(names):
+                auth.gallery.get_centroid(auth.gallery.get_user_id(name))
+            results.append(measure('authenticate_user_centroid',
+                                   lambda i: auth.authenticate_user(names[i], samples[i % 64]),
+                                   iterations, size))
+            results[-1]['verifier'] = auth.centroid_verifier.stats()
+            auth.centroid_verifier = None
+
+            # The same comparison on users whose samples cluster around one
+            # finger, where the centroid bounds can decide early
+            clustered_db = FingerprintDatabase(os.path.join(tmp, 'clustered.sqlite'))
+            clustered_users = synthetic_users(min(users, 200), SAMPLES_PER_USER, seed=1)
+            clustered_db.bulk_enroll(
+                (user, f'clustered_{user}', f'clustered_{user}@example.com',
+                 [(hashlib.sha256(encode_template(row)).hexdigest(), row) for row in matrix])
+                for user, matrix in enumerate(clustered_users))
+            owners = rng.integers(0, len(clustered_users), iterations + 10)
+            sources = [clustered_users[owner if i % 2 else (owner + 1) % len(clustered_users)][0]
+                       for i, owner in enumerate(owners)]
+            attempts = [(f'clustered_{owner}',
+                         encode_template(source + 0.6 * rng.standard_normal(128) / np.sqrt(128)))
+                        for owner, source in zip(owners, sources)]
+            clustered_auth = AuthenticationManager(clustered_db)
+            results.append(measure('authenticate_user_clustered',
+                                   lambda i: clustered_auth.authenticate_user(*attempts[i]),
+                                   iterations, len(clustered_users) * SAMPLES_PER_USER))
+            expected = [clustered_auth.authenticate_user(*attempt) for attempt in attempts[:200]]
+            clustered_auth.enable_centroid_verification()
+            check_centroid_verification(clustered_auth, attempts[:200], expected)
+            results.append(measure('authenticate_user_centroid_clustered',
+                                   lambda i: clustered_auth.authenticate_user(*attempts[i]),
+                                   iterations, len(clustered_users) * SAMPLES_PER_USER))
+            results[-1]['verifier'] = clustered_auth.centroid_verifier.stats()
+            clustered_auth.close()
+            clustered_db.close()
+
+            # Concurrent verification with and without micro-batching
+            verify = lambda i: auth.authenticate_user(names[i % len(names)], samples[i % 64])
+            results.append(measure_concurrent('authenticate_user_concurrent', verify,
+                                              iterations, 16, size))
+            auth.enable_micro_batching(max_batch=64, max_wait_ms=2.0)
+            result = measure_concurrent('authenticate_user_concurrent_batched', verify,
+                                        iterations, 16, size)
+            result['batching'] = auth.batcher.metrics()
+            results.append(result)
+            auth.batcher.close()
+            auth.batcher = None
+
+            start = time.perf_counter()
+            auth.get_index()
+            results.append({'name': 'build_identification_index', 'gallery_size': size,
+                            'seconds': time.perf_counter() - start,
+                            'peak_rss_mb': peak_rss_mb()})
+            results.append(measure('identify',
+                                   lambda i: auth.identify(samples[i % 64]),
+                                   max(10, iterations // 10), size))
+
+            # Exact search sharded across one worker process per core
+            probes = rng.standard_normal((32, 128))
+            with ShardedIdentifier(db, processor) as sharded:
+                result = measure('identify_sharded_exact_x32',
+                                 lambda i: sharded.search_many(probes),
+                                 max(10, iterations // 100), size, warmup=2, batch=32)
+                result['shards'] = sharded.shard_count
+                results.append(result)
+            auth.close()
+
+            # Log writes through the rollup triggers, and analytics queries
+            # answered from the rollups
+            events = [(int(u) + 1, time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()), bool(u % 2),
+                       float(u % 101)) for u in rng.integers(0, users, 500)]
+            results.append(measure('log_authentications_x500',
+                                   lambda i: db.log_authentications(events),
+                                   max(10, iterations // 10), size, batch=500))
+            start = time.perf_counter()
+            history = db.get_authentication_history_columns()
+            attempts = len(history[0])
+            results.append({'name': 'auth_history_columns', 'gallery_size': size,
+                            'attempts': attempts, 'seconds': time.perf_counter() - start,
+                            'bytes_per_attempt': sum(column.nbytes for column in history)
+                            / max(attempts, 1),
+                            'peak_rss_mb': peak_rss_mb()})
+            del history
+            analytics = AuthAnalytics(db)
+            results.append(measure('analytics_dashboard', lambda i: analytics.dashboard(),
+                                   max(10, iterations // 10), size))
+            results.append(measure('analytics_percentiles', lambda i: analytics.percentiles(),
+                                   iterations, size))
+
+            enroll = EnrollmentManager(db)
+            results.append(measure('enroll_user',
+                                   lambda i: enroll.enroll_user(f'bench_new_{i}',
+                                                                f'bench_new_{i}@example.com'),
+                                   max(10, iterations // 10), size))
+            db.close()
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'iterations': iterations,
+            'sizes': list(sizes)
+        },
+        'results': results
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float = 0.10) -> list:
+    """
+    Compare a report against a stored baseline
+
+    A benchmark regresses when ops/sec drops, or p95 latency rises, by more
+    than the tolerance fraction.
+
+    Returns:
+        List of regression descriptions (empty when none)
+    """
+    previous = {(r['name'], r.get('gallery_size', 0)): r for r in baseline['results']}
+    regressions = []
+    for result in report['results']:
+        old = previous.get((result['name'], result.get('gallery_size', 0)))
+        if not old:
+            continue
+        label = f"{result['name']}[{result.get('gallery_size', 0)}]"
+        if 'ops_per_sec' in result and 'ops_per_sec' in old:
+            if result['ops_per_sec'] < old['ops_per_sec'] * (1 - tolerance):
+                regressions.append(f"{label}: ops/sec {old['ops_per_sec']:.1f} -> "
+                                   f"{result['ops_per_sec']:.1f}")
+            if result['p95_ms'] > old['p95_ms'] * (1 + tolerance):
+                regressions.append(f"{label}: p95 {old['p95_ms']:.3f} ms -> "
+                                   f"{result['p95_ms']:.3f} ms")
+        elif 'seconds' in result and 'seconds' in old:
+            if result['seconds'] > old['seconds'] * (1 + tolerance):
+                regressions.append(f"{label}: {old['seconds']:.2f} s -> "
+                                   f"{result['seconds']:.2f} s")
+    return regressions
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Fingerprint engine benchmarks")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES),
+                        help="comma-separated gallery sizes in templates")
+    parser.add_argument("--iterations", type=int, default=1000, help="timed calls per benchmark")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--compare", metavar="BASELINE", help="baseline JSON report")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="allowed fractional slowdown before flagging a regression")
+    parser.add_argument("--workdir", default=None, help="directory for temporary databases")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    report = run_suite(sizes, args.iterations, args.workdir)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
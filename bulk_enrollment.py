@@ -0,0 +1,228 @@
+"""
+Bulk Enrollment Module
+Enrolls users from CSV/JSONL files with multi-core template generation
+"""
+
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from database import FingerprintDatabase
+from fingerprint_processor import FingerprintProcessor
+from template_codec import encode_template
+
+_worker_processor = None
+
+
+def _generate_templates(job):
+    """
+    Process-pool worker: build encoded templates for one user
+
+    Args:
+        job: Tuple of (username, samples, timestamp)
+
+    Returns:
+        List of (template_hash, binary_template)
+    """
+    global _worker_processor
+    if _worker_processor is None:
+        _worker_processor = FingerprintProcessor()
+    username, samples, timestamp = job
+    template_hashes, feature_vectors = _worker_processor.generate_templates(
+        f"{username}_sample_{i+1}_{timestamp}" for i in range(samples)
+    )
+    return [(template_hash, encode_template(feature_vector))
+            for template_hash, feature_vector in zip(template_hashes, feature_vectors)]
+
+
+def read_records(path: str):
+    """
+    Read enrollment records from a CSV (with a header) or JSONL file
+
+    Each record needs username and email; samples is optional.
+
+    Yields:
+        Tuples of (row_number, record_dict); row numbers start at 1
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith(('.jsonl', '.ndjson')):
+            for row_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield row_number, json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield row_number, {'_error': f'Invalid JSON: {e}'}
+        else:
+            for row_number, row in enumerate(csv.DictReader(f), 1):
+                yield row_number, row
+
+
+class BulkEnrollment:
+    """Enrolls large user lists in chunked transactions"""
+
+    def __init__(self, db: FingerprintDatabase = None, workers: int = None,
+                 chunk_size: int = 1000, default_samples: int = 3):
+        """
+        Initialize bulk enrollment
+
+        Args:
+            db: Target database (defaults to the standard database file)
+            workers: Template generation processes (defaults to CPU count)
+            chunk_size: Users written per transaction
+            default_samples: Samples per user when a record doesn't set one
+        """
+        self.db = db or FingerprintDatabase()
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.default_samples = default_samples
+
+    def run(self, input_path: str, checkpoint_path: str = None,
+            failures_path: str = None) -> dict:
+        """
+        Enroll every record in a file, resuming from a checkpoint if present
+
+        The checkpoint records the last row whose chunk was committed. After a
+        crash, rerunning the same command continues from there; rows of a
+        chunk committed just before the crash are reported as skipped.
+
+        Args:
+            input_path: CSV or JSONL file of users
+            checkpoint_path: Progress file (defaults to <input>.progress)
+            failures_path: Optional JSONL file receiving per-row failures
+
+        Returns:
+            Dictionary with enrollment counts
+        """
+        checkpoint_path = checkpoint_path or input_path + '.progress'
+        rows_done = self._load_checkpoint(checkpoint_path, input_path)
+        summary = {'enrolled': 0, 'skipped': 0, 'failed': 0,
+                   'resumed_after_row': rows_done}
+        failures = open(failures_path, 'a', encoding='utf-8') if failures_path else None
+        timestamp = datetime.now().timestamp()
+
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                pending = None
+                for chunk in self._chunks(input_path, rows_done):
+                    valid = [r for r in chunk if r[3] is None]
+                    jobs = [(username, samples, timestamp)
+                            for _, username, _, _, samples in valid]
+                    future = executor.map(_generate_templates, jobs,
+                                          chunksize=max(1, len(jobs) // (self.workers * 4)))
+                    # Write the previous chunk while this one is generated
+                    if pending:
+                        self._write_chunk(*pending, summary, failures, checkpoint_path,
+                                          input_path)
+                    pending = (chunk, valid, future)
+                if pending:
+                    self._write_chunk(*pending, summary, failures, checkpoint_path,
+                                      input_path)
+        finally:
+            if failures:
+                failures.close()
+
+        return summary
+
+    def _chunks(self, input_path, rows_done):
+        """Yield lists of validated (row, username, email, error, samples) records"""
+        chunk = []
+        for row_number, record in read_records(input_path):
+            if row_number <= rows_done:
+                continue
+            chunk.append(self._validate(row_number, record))
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _validate(self, row_number, record):
+        """Normalize one record, returning an error message if it is unusable"""
+        if not isinstance(record, dict):
+            return (row_number, None, None,
+                    f'Expected a JSON object, got {type(record).__name__}', 0)
+        if '_error' in record:
+            return row_number, None, None, record['_error'], 0
+        username = record.get('username') or ''
+        email = record.get('email') or ''
+        if not isinstance(username, str) or not isinstance(email, str):
+            return row_number, None, None, 'Username and email must be strings', 0
+        username, email = username.strip(), email.strip()
+        if not username or not email:
+            return row_number, username, email, 'Missing username or email', 0
+        samples = record.get('samples') or self.default_samples
+        if isinstance(samples, bool) or (isinstance(samples, float)
+                                         and not samples.is_integer()):
+            return row_number, username, email, 'Invalid samples value', 0
+        try:
+            samples = int(samples)
+        except (TypeError, ValueError):
+            return row_number, username, email, 'Invalid samples value', 0
+        if samples < 1:
+            return row_number, username, email, 'Invalid samples value', 0
+        return row_number, username, email, None, samples
+
+    def _write_chunk(self, chunk, valid, templates, summary, failures,
+                     checkpoint_path, input_path):
+        """Commit one chunk, record its failures and advance the checkpoint"""
+        records = [(row_number, username, email, user_templates)
+                   for (row_number, username, email, _, _), user_templates
+                   in zip(valid, templates)]
+        results = self.db.bulk_enroll(records)
+        results += [(row_number, 'failed', None, error)
+                    for row_number, _, _, error, _ in chunk if error is not None]
+
+        for row_number, status, user_id, message in results:
+            summary[status] += 1
+            if status == 'failed' and failures:
+                failures.write(json.dumps({'row': row_number, 'error': message}) + '\n')
+        if failures:
+            failures.flush()
+        self._save_checkpoint(checkpoint_path, input_path, chunk[-1][0])
+
+    @staticmethod
+    def _load_checkpoint(checkpoint_path, input_path):
+        """Return the last committed row for this input file"""
+        try:
+            with open(checkpoint_path, encoding='utf-8') as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        if checkpoint.get('input') != os.path.abspath(input_path):
+            return 0
+        return int(checkpoint.get('rows_done', 0))
+
+    @staticmethod
+    def _save_checkpoint(checkpoint_path, input_path, rows_done):
+        """Atomically record progress"""
+        tmp_path = checkpoint_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'input': os.path.abspath(input_path), 'rows_done': rows_done}, f)
+        os.replace(tmp_path, checkpoint_path)
+
+
+def main():
+    """Command-line entry point"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Bulk-enroll users from CSV or JSONL")
+    parser.add_argument("input", help="CSV (username,email[,samples]) or JSONL file")
+    parser.add_argument("--db", default="fingerprint_db.sqlite", help="database file")
+    parser.add_argument("--workers", type=int, default=None, help="generator processes")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="users per transaction")
+    parser.add_argument("--samples", type=int, default=3, help="default samples per user")
+    parser.add_argument("--checkpoint", default=None, help="progress file")
+    parser.add_argument("--failures", default=None, help="JSONL file for per-row failures")
+    args = parser.parse_args()
+
+    bulk = BulkEnrollment(FingerprintDatabase(args.db), workers=args.workers,
+                          chunk_size=args.chunk_size, default_samples=args.samples)
+    summary = bulk.run(args.input, args.checkpoint, args.failures)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Threshold Calibration Module
+All-pairs genuine/impostor score distributions with FAR/FRR/EER curves
+"""
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from identification import _load_rows
+from matcher import cosine_to_score
+from sharded_identification import _single_threaded_blas
+
+# Score histogram resolution: thresholds are evaluated at multiples of 1/bins
+DEFAULT_BINS = 10_000
+# Templates per side of a scored block; a block holds BLOCK_ROWS**2 scores
+BLOCK_ROWS = 2048
+DEFAULT_FAR_TARGETS = (1e-2, 1e-3, 1e-4, 1e-5, 1e-6)
+
+_worker_arrays = None
+
+
+def _init_worker(matrix_path, user_ids_path):
+    """Process-pool initializer: memory-map the shared template matrix"""
+    global _worker_arrays
+    _worker_arrays = (np.load(matrix_path, mmap_mode='r'),
+                      np.load(user_ids_path, mmap_mode='r'))
+
+
+def _score_block(task):
+    """Process-pool worker: histogram one block pair"""
+    matrix, user_ids = _worker_arrays
+    return block_histogram(matrix, user_ids, *task)
+
+
+def block_histogram(matrix, user_ids, row_start: int, col_start: int,
+                    block_rows: int = BLOCK_ROWS, bins: int = DEFAULT_BINS):
+    """
+    Histogram the scores of one block of template pairs
+
+    Diagonal blocks (row_start == col_start) only count pairs above the
+    diagonal, so every unordered pair of distinct templates is counted once
+    over the upper-triangular set of blocks.
+
+    Args:
+        matrix: (N, D) pre-normalized template matrix
+        user_ids: Owner of each row
+        row_start: First row of the block
+        col_start: First column of the block
+        block_rows: Block side length
+        bins: Histogram bins over [0, 1]
+
+    Returns:
+        Tuple of (genuine_counts, impostor_counts), each of length bins
+    """
+    rows = np.asarray(matrix[row_start:row_start + block_rows])
+    cols = np.asarray(matrix[col_start:col_start + block_rows])
+    index = (cosine_to_score(rows @ cols.T, rows, cols) * bins).astype(np.int32)
+    np.minimum(index, bins - 1, out=index)
+    genuine = (np.asarray(user_ids[row_start:row_start + block_rows])[:, None]
+               == np.asarray(user_ids[col_start:col_start + block_rows])[None, :])
+    np.add(index, bins, out=index, where=genuine)
+    if row_start == col_start:
+        # Self-pairs and the mirrored lower triangle go to a discarded bin
+        index[np.tri(len(rows), len(cols), dtype=bool)] = 2 * bins
+    counts = np.bincount(index.ravel(), minlength=2 * bins + 1)
+    return counts[bins:2 * bins], counts[:bins]
+
+
+def score_histograms(matrix: np.ndarray, user_ids: np.ndarray, bins: int = DEFAULT_BINS,
+                     block_rows: int = BLOCK_ROWS, workers: int = None):
+    """
+    Genuine and impostor score histograms over every pair of templates
+
+    The pair matrix is never materialized: it is scored in
+    block_rows x block_rows tiles, each reduced to a histogram at once, so
+    memory stays bounded by one tile per worker. Tiles are spread over a
+    process pool whose workers memory-map a single copy of the templates.
+
+    Args:
+        matrix: (N, D) pre-normalized template matrix
+        user_ids: Owner of each row; pairs with equal owners are genuine
+        bins: Histogram bins over [0, 1]
+        block_rows: Tile side length
+        workers: Worker processes (defaults to the CPU count; 1 runs inline)
+
+    Returns:
+        Tuple of (genuine_counts, impostor_counts) int64 arrays
+    """
+    count = len(matrix)
+    tasks = [(row_start, col_start, block_rows, bins)
+             for row_start in range(0, count, block_rows)
+             for col_start in range(row_start, count, block_rows)]
+    genuine = np.zeros(bins, dtype=np.int64)
+    impostor = np.zeros(bins, dtype=np.int64)
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    if workers <= 1:
+        for task in tasks:
+            block_genuine, block_impostor = block_histogram(matrix, user_ids, *task)
+            genuine += block_genuine
+            impostor += block_impostor
+        return genuine, impostor
+
+    tmp = tempfile.mkdtemp(prefix='fp_calibration_')
+    try:
+        matrix_path = os.path.join(tmp, 'matrix.npy')
+        user_ids_path = os.path.join(tmp, 'user_ids.npy')
+        np.save(matrix_path, np.ascontiguousarray(matrix))
+        np.save(user_ids_path, np.asarray(user_ids))
+        with _single_threaded_blas(), ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker, initargs=(matrix_path, user_ids_path)) as executor:
+            chunksize = max(1, len(tasks) // (workers * 8))
+            for block_genuine, block_impostor in executor.map(_score_block, tasks,
+                                                              chunksize=chunksize):
+                genuine += block_genuine
+                impostor += block_impostor
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return genuine, impostor
+
+
+def error_curves(genuine: np.ndarray, impostor: np.ndarray):
+    """
+    FAR and FRR at every histogram bin edge
+
+    A pair is accepted when its score is >= the threshold, as in
+    FingerprintProcessor.match_fingerprint.
+
+    Returns:
+        Tuple of (thresholds, far, frr) arrays of length bins + 1
+    """
+    bins = len(genuine)
+    thresholds = np.arange(bins + 1) / bins
+    impostor_below = np.concatenate([[0], np.cumsum(impostor)])
+    genuine_below = np.concatenate([[0], np.cumsum(genuine)])
+    far = (impostor_below[-1] - impostor_below) / max(impostor_below[-1], 1)
+    frr = genuine_below / max(genuine_below[-1], 1)
+    return thresholds, far, frr
+
+
+def recommend_thresholds(thresholds, far, frr, impostor_pairs: int,
+                         targets=DEFAULT_FAR_TARGETS) -> list:
+    """
+    Lowest threshold meeting each FAR target
+
+    A target is marked unreliable when there are fewer than 3 / target
+    impostor pairs (rule of three), i.e. too few to observe that rate.
+
+    Returns:
+        List of dictionaries with target_far, threshold, far, frr and reliable
+    """
+    recommendations = []
+    for target in targets:
+        # far is non-increasing, so the first index at or below target is lowest
+        index = int(np.argmax(far <= target))
+        recommendations.append({
+            'target_far': target,
+            'threshold': float(thresholds[index]),
+            'far': float(far[index]),
+            'frr': float(frr[index]),
+            'reliable': impostor_pairs >= 3 / target
+        })
+    return recommendations
+
+
+def calibrate(matrix: np.ndarray, user_ids: np.ndarray, current_threshold: float = 0.85,
+              bins: int = DEFAULT_BINS, block_rows: int = BLOCK_ROWS, workers: int = None,
+              curve_step: float = 0.01, targets=DEFAULT_FAR_TARGETS) -> dict:
+    """
+    Score every template pair and summarize the error rates
+
+    Args:
+        matrix: (N, D) pre-normalized template matrix
+        user_ids: Owner of each row
+        current_threshold: Threshold whose error rates are reported
+        bins: Histogram bins over [0, 1]
+        block_rows: Tile side length
+        workers: Worker processes
+        curve_step: Threshold spacing of the reported curve
+        targets: FAR targets to recommend thresholds for
+
+    Returns:
+        Report dictionary with pair counts, EER (None unless there are both
+        genuine and impostor pairs), error rates at the current threshold,
+        recommendations and a FAR/FRR curve; the raw histograms are under
+        'genuine_histogram' and 'impostor_histogram'
+    """
+    start = time.perf_counter()
+    genuine, impostor = score_histograms(matrix, user_ids, bins, block_rows, workers)
+    seconds = time.perf_counter() - start
+    thresholds, far, frr = error_curves(genuine, impostor)
+    genuine_pairs, impostor_pairs = int(genuine.sum()), int(impostor.sum())
+
+    eer = eer_threshold = None
+    if genuine_pairs and impostor_pairs:
+        eer_index = int(np.argmin(np.abs(far - frr)))
+        eer = float((far[eer_index] + frr[eer_index]) / 2)
+        eer_threshold = float(thresholds[eer_index])
+    current_index = min(int(np.ceil(current_threshold * bins - 1e-9)), bins)
+    step = max(1, int(round(curve_step * bins)))
+    return {
+        'templates': len(matrix),
+        'users': len(np.unique(user_ids)),
+        'genuine_pairs': genuine_pairs,
+        'impostor_pairs': impostor_pairs,
+        'seconds': seconds,
+        'pairs_per_second': (genuine_pairs + impostor_pairs) / seconds if seconds else 0.0,
+        'eer': eer,
+        'eer_threshold': eer_threshold,
+        'current': {'threshold': current_threshold, 'far': float(far[current_index]),
+                    'frr': float(frr[current_index])},
+        'recommendations': recommend_thresholds(thresholds, far, frr, impostor_pairs,
+                                                targets),
+        'curve': [{'threshold': float(thresholds[i]), 'far': float(far[i]),
+                   'frr': float(frr[i])} for i in range(0, bins + 1, step)],
+        'genuine_histogram': genuine,
+        'impostor_histogram': impostor
+    }
+
+
+def write_curve_csv(report: dict, path: str):
+    """Write the full-resolution FAR/FRR curve and histograms as CSV"""
+    genuine, impostor = report['genuine_histogram'], report['impostor_histogram']
+    thresholds, far, frr = error_curves(genuine, impostor)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('threshold,far,frr,genuine_in_bin,impostor_in_bin\n')
+        for i, threshold in enumerate(thresholds):
+            in_bin = (genuine[i], impostor[i]) if i < len(genuine) else (0, 0)
+            f.write(f'{threshold:.6f},{far[i]:.9g},{frr[i]:.9g},{in_bin[0]},{in_bin[1]}\n')
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from database import FingerprintDatabase
+    from fingerprint_processor import FingerprintProcessor
+    from gallery_snapshot import GallerySnapshot
+
+    parser = argparse.ArgumentParser(description="Calibrate the match threshold")
+    parser.add_argument("--db", default="fingerprint_db.sqlite", help="database file")
+    parser.add_argument("--snapshot", default=None,
+                        help="read templates from a gallery snapshot instead")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes")
+    parser.add_argument("--block-rows", type=int, default=BLOCK_ROWS, help="tile side length")
+    parser.add_argument("--bins", type=int, default=DEFAULT_BINS, help="histogram bins")
+    parser.add_argument("--limit", type=int, default=None,
+                        help="calibrate on the first LIMIT templates only")
+    parser.add_argument("--curve-step", type=float, default=0.01,
+                        help="threshold spacing of the printed curve")
+    parser.add_argument("--curve-csv", default=None,
+                        help="write the full-resolution curve to this CSV file")
+    args = parser.parse_args()
+
+    processor = FingerprintProcessor()
+    if args.snapshot:
+        _, owners, templates = GallerySnapshot(args.snapshot).rows()
+    else:
+        database = FingerprintDatabase(args.db)
+        _, owners, templates = _load_rows(database, processor, 0)
+        database.close()
+    if args.limit:
+        owners, templates = owners[:args.limit], templates[:args.limit]
+    if len(templates) < 2:
+        raise SystemExit("Need at least two templates to calibrate")
+
+    result = calibrate(templates, owners, processor.match_threshold, args.bins,
+                       args.block_rows, args.workers, args.curve_step)
+    if args.curve_csv:
+        write_curve_csv(result, args.curve_csv)
+    del result['genuine_histogram'], result['impostor_histogram']
+    print(json.dumps(result, indent=2))
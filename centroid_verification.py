@@ -0,0 +1,279 @@
+"""
+Centroid Verification Module
+Early-exit 1:1 verification from a per-user centroid and similarity bounds
+"""
+
+import threading
+import numpy as np
+from typing import Optional, Tuple
+from matcher import cosine_to_score, normalize_probe
+
+# Margin (in score units) that keeps early decisions clear of float32
+# rounding differences between one dot product and the full matrix product
+BOUND_SLACK = 1e-5
+
+
+class UserCentroid:
+    """
+    Normalized mean template of a user plus distance bounds
+
+    For unit-length templates t_i, unit centroid c and a unit probe q,
+    |q.t_i - q.c| <= ||t_i - c||. With r_min and r_max the smallest and
+    largest of those distances, the best cosine over all templates lies in
+    [q.c - r_min, q.c + r_max]. The representative is the template nearest
+    the centroid, the one most likely to clear the threshold for a genuine
+    probe.
+    """
+
+    __slots__ = ('centroid', 'representative', 'r_min', 'r_max', 'template_count')
+
+    def __init__(self, centroid: np.ndarray, representative: np.ndarray,
+                 r_min: float, r_max: float, template_count: int):
+        """Wrap precomputed values; use from_templates to compute them"""
+        self.centroid = centroid
+        self.representative = representative
+        self.r_min = r_min
+        self.r_max = r_max
+        self.template_count = template_count
+
+    @classmethod
+    def from_templates(cls, template_matrix: np.ndarray) -> 'UserCentroid':
+        """
+        Compute the centroid of a pre-normalized template matrix
+
+        Args:
+            template_matrix: (N, D) matrix from normalize_templates, N >= 1
+        """
+        centroid = normalize_probe(template_matrix.mean(axis=0))
+        radii = np.linalg.norm(template_matrix - centroid, axis=1)
+        nearest = int(np.argmin(radii))
+        # Round the bounds outwards so float32 error can't make them too tight
+        return cls(centroid, template_matrix[nearest].copy(),
+                   float(radii[nearest]) * (1 - 1e-4),
+                   float(radii.max()) * (1 + 1e-4) + 1e-6, len(template_matrix))
+
+
+class CentroidVerifier:
+    """
+    Decides most verifications from one or two dot products
+
+    The probe is scored against the user's representative template first; a
+    clear match there is an accept. Otherwise one dot product with the
+    centroid bounds every template, and a probe that cannot reach the
+    threshold is rejected. (The centroid's lower bound never accepts here:
+    q.rep >= q.c - r_min, so it is below a representative that failed.)
+    Only probes in the ambiguous band fall back to the full per-template
+    scan, so decisions always equal the exhaustive path's. Scores do not: an
+    early decision only knows a bound on the best template score, which
+    verify() reports separately from exact scores.
+    """
+
+    def __init__(self, matcher, max_radius: float = 1.0):
+        """
+        Initialize verifier
+
+        Args:
+            matcher: Object providing match_threshold (e.g. FingerprintProcessor)
+            max_radius: Users whose templates lie further than this from
+                their centroid (r_max) go straight to the full scan; their
+                bounds are too loose to decide anything, so checking them
+                would only add work. Decisions are exact either way.
+        """
+        self.matcher = matcher
+        self.max_radius = max_radius
+        self._lock = threading.Lock()
+        self.verifications = 0
+        self.dot_products = 0
+        self.early_accepts = 0
+        self.early_rejects = 0
+        self.full_scans = 0
+
+    def verify(self, live_features: np.ndarray, user_centroid: UserCentroid,
+               fetch_templates) -> Tuple[bool, Optional[float], Optional[float]]:
+        """
+        Verify a probe against one user
+
+        Args:
+            live_features: Raw feature vector of the probe
+            user_centroid: Precomputed centroid of the claimed user
+            fetch_templates: Callable returning the user's pre-normalized
+                template matrix; only called in the ambiguous band
+
+        Returns:
+            Tuple of (match_success, best_percentage, bound_percentage).
+            best_percentage is the exact best template score when the scan
+            ran, else None; bound_percentage is then the bound that decided
+            (a lower bound on the best score for accepts, an upper bound for
+            rejects), else None.
+        """
+        threshold = self.matcher.match_threshold
+        probe = normalize_probe(live_features)
+        checked = user_centroid.r_max <= self.max_radius
+        if checked:
+            representative = _score(float(user_centroid.representative @ probe))
+            # A zero probe or representative scores 0.0, not the 0.5 of a
+            # zero cosine; the scan below handles zero probes
+            if (representative >= threshold + BOUND_SLACK
+                    and user_centroid.representative.any() and probe.any()):
+                return self._record(True, None, representative * 100, 1, 'early_accepts')
+
+            upper = _score(float(user_centroid.centroid @ probe) + user_centroid.r_max)
+            if upper < threshold - BOUND_SLACK:
+                return self._record(False, None, upper * 100, 2, 'early_rejects')
+
+        template_matrix = fetch_templates()
+        best = float(cosine_to_score(template_matrix @ probe, template_matrix, probe).max())
+        return self._record(best >= threshold, best * 100, None,
+                            2 * checked + len(template_matrix), 'full_scans')
+
+    def _record(self, decision, best, bound, dots, outcome):
+        """Count a verification and build the verify() result"""
+        with self._lock:
+            self.verifications += 1
+            self.dot_products += dots
+            setattr(self, outcome, getattr(self, outcome) + 1)
+        return decision, best, bound
+
+    def stats(self) -> dict:
+        """Get decision counts and the average dot products per verification"""
+        with self._lock:
+            count = self.verifications
+            return {
+                'verifications': count,
+                'early_accepts': self.early_accepts,
+                'early_rejects': self.early_rejects,
+                'full_scans': self.full_scans,
+                'mean_dot_products': self.dot_products / count if count else 0.0
+            }
+
+
+def _score(cosine: float) -> float:
+    """Score of a single cosine between nonzero vectors, clipped to [0, 1]"""
+    return min(max((cosine + 1.0) / 2.0, 0.0), 1.0)
+
+
+def scores_consistent(decision: bool, exact, bound, best: float,
+                      tolerance: float = 1e-3) -> bool:
+    """
+    Check a verify() result against the exhaustive best match percentage
+
+    An exact score must equal it; a bound must lie on the correct side of it
+    (at most the best for accepts, at least the best for rejects).
+    """
+    if exact is not None:
+        return abs(exact - best) <= tolerance
+    return bound <= best + tolerance if decision else bound >= best - tolerance
+
+
+def synthetic_users(count: int, samples: int = 5, spread: float = 0.35,
+                    dimension: int = 128, seed: int = 0) -> list:
+    """
+    Template matrices for users whose samples cluster around one finger
+
+    Enrolled samples of a real finger are noisy captures of the same
+    pattern; spread is the per-sample noise relative to the unit pattern.
+    """
+    from matcher import normalize_templates
+
+    rng = np.random.default_rng(seed)
+    fingers = normalize_templates(rng.standard_normal((count, dimension)))
+    noise = rng.standard_normal((count, samples, dimension)) * spread / np.sqrt(dimension)
+    return [normalize_templates(finger + finger_noise)
+            for finger, finger_noise in zip(fingers, noise)]
+
+
+def differential_check(template_matrices, probes_per_user: int = 4, noise: float = 0.6,
+                       threshold: float = 0.85, seed: int = 0) -> dict:
+    """
+    Compare centroid verification with the exhaustive scan
+
+    Each user gets genuine probes (a template plus noise) and impostor probes
+    (another user's template plus noise).
+
+    Args:
+        template_matrices: Pre-normalized (N, D) matrix per user
+        probes_per_user: Genuine and impostor probes per user, each
+        noise: Standard deviation of the noise relative to a unit template
+        threshold: Match threshold
+        seed: Random seed
+
+    Returns:
+        Dictionary with decision mismatches, score mismatches (an exact score
+        that differs from the exhaustive best, or a bound on the wrong side
+        of it), exhaustive and centroid dot products per verification, and
+        decision counts
+    """
+    from types import SimpleNamespace
+    from matcher import BatchMatcher
+
+    template_matrices = [matrix for matrix in template_matrices if len(matrix)]
+    rng = np.random.default_rng(seed)
+    exhaustive = BatchMatcher(threshold)
+    verifier = CentroidVerifier(SimpleNamespace(match_threshold=threshold))
+    centroids = [UserCentroid.from_templates(matrix) for matrix in template_matrices]
+    dimension = template_matrices[0].shape[1]
+    mismatches = score_mismatches = exhaustive_dots = checked = 0
+    for user, matrix in enumerate(template_matrices):
+        others = rng.integers(0, len(template_matrices), probes_per_user)
+        sources = ([matrix[rng.integers(len(matrix))] for _ in range(probes_per_user)]
+                   + [template_matrices[other][0] for other in others])
+        for source in sources:
+            probe = source + noise * rng.standard_normal(dimension) / np.sqrt(dimension)
+            expected, best = exhaustive.best_match(probe, matrix)
+            actual, exact, bound = verifier.verify(probe, centroids[user], lambda: matrix)
+            mismatches += expected != actual
+            score_mismatches += not scores_consistent(actual, exact, bound, best)
+            exhaustive_dots += len(matrix)
+            checked += 1
+    report = verifier.stats()
+    report.update({
+        'users': len(template_matrices),
+        'decision_mismatches': int(mismatches),
+        'score_mismatches': int(score_mismatches),
+        'exhaustive_mean_dot_products': exhaustive_dots / max(checked, 1)
+    })
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from database import FingerprintDatabase
+    from fingerprint_processor import FingerprintProcessor
+    from gallery_cache import GalleryCache
+
+    parser = argparse.ArgumentParser(description="Centroid verification tools")
+    parser.add_argument("--db", default="fingerprint_db.sqlite", help="database file")
+    parser.add_argument("--backfill", action="store_true",
+                        help="store centroids for users that lack a current one")
+    parser.add_argument("--check", type=int, default=0, metavar="USERS",
+                        help="differential check against the exhaustive scan")
+    parser.add_argument("--synthetic", type=int, default=0, metavar="USERS",
+                        help="differential check on clustered synthetic users instead")
+    parser.add_argument("--noise", type=float, default=0.6)
+    args = parser.parse_args()
+
+    reports = []
+    if args.synthetic:
+        reports.append(differential_check(synthetic_users(args.synthetic), noise=args.noise))
+        print(json.dumps(reports[-1], indent=2))
+
+    database = FingerprintDatabase(args.db)
+    cache = GalleryCache(database, FingerprintProcessor())
+    if args.backfill:
+        stored = 0
+        for user_id in database.get_users_without_centroids():
+            if cache.get_centroid(user_id) is not None:
+                stored += 1
+        print(json.dumps({'centroids_stored': stored}))
+    if args.check:
+        user_ids = [user_id for user_id, *_ in database.get_users_with_fingerprint_counts(
+            0, args.check)]
+        matrices = [cache.get_templates(user_id) for user_id in user_ids]
+        matrices = [matrix for matrix in matrices if len(matrix)]
+        if matrices:
+            reports.append(differential_check(matrices, noise=args.noise))
+            print(json.dumps(reports[-1], indent=2))
+    database.close()
+    if any(report['decision_mismatches'] or report['score_mismatches'] for report in reports):
+        raise SystemExit("Centroid verification disagrees with the exhaustive scan")
@@ -0,0 +1,259 @@
+"""
+Data Transfer Module
+Streaming export and idempotent parallel import of users, templates and auth logs
+(archived auth logs included)
+"""
+
+import base64
+import gzip
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from database import FingerprintDatabase, transfer_columns
+
+FORMAT_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+MAX_REPORTED_CONFLICTS = 100
+
+
+def table_path(directory: str, table: str) -> str:
+    """Path of a table's data file inside an export directory"""
+    return os.path.join(directory, f'{table}.jsonl.gz')
+
+
+def _encode_value(value):
+    """JSON-safe form of a column value; blobs become {"b64": ...}"""
+    if isinstance(value, bytes):
+        return {'b64': base64.b64encode(value).decode('ascii')}
+    return value
+
+
+def _decode_value(value):
+    """Inverse of _encode_value"""
+    if isinstance(value, dict):
+        return base64.b64decode(value['b64'])
+    return value
+
+
+def export_database(db: FingerprintDatabase, directory: str, batch_size: int = 5000,
+                    compresslevel: int = 6) -> dict:
+    """
+    Export every transfer table and auth_logs archive table as gzip-compressed JSONL
+
+    Rows are streamed from a single read transaction and written as they
+    arrive, so memory use does not grow with table size. Each line is a JSON
+    array in the manifest's column order. The manifest is written last: a
+    directory without one holds an incomplete export.
+
+    Args:
+        db: Source database
+        directory: Output directory (created if missing)
+        batch_size: Rows fetched per cursor round trip
+        compresslevel: gzip level, 1 (fastest) to 9 (smallest)
+
+    Returns:
+        The manifest dictionary
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    started = time.time()
+    schema_version = db.schema_version()
+    counts = {}
+    outputs = {}
+    try:
+        for table, rows in db.stream_tables(batch_size=batch_size):
+            if table not in outputs:
+                outputs[table] = gzip.open(table_path(directory, table) + '.tmp', 'wt',
+                                           encoding='utf-8', compresslevel=compresslevel)
+                counts[table] = 0
+            outputs[table].write(''.join(
+                json.dumps([_encode_value(value) for value in row],
+                           separators=(',', ':')) + '\n'
+                for row in rows
+            ))
+            counts[table] += len(rows)
+    finally:
+        for output in outputs.values():
+            output.close()
+    for table in outputs:
+        os.replace(table_path(directory, table) + '.tmp', table_path(directory, table))
+
+    manifest = {
+        'format': FORMAT_VERSION,
+        'schema_version': schema_version,
+        'exported_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(started)),
+        'seconds': time.time() - started,
+        'tables': {table: {'columns': list(transfer_columns(table)), 'rows': count}
+                   for table, count in counts.items()}
+    }
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+    return manifest
+
+
+def read_manifest(directory: str) -> dict:
+    """
+    Load and validate an export manifest
+
+    Raises:
+        ValueError: If the export is incomplete or in an unsupported format
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        raise ValueError(f"No manifest in {directory}; the export is incomplete") from None
+    if manifest.get('format') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported export format: {manifest.get('format')}")
+    for table, info in manifest['tables'].items():
+        columns = transfer_columns(table)
+        if columns is None:
+            raise ValueError(f"Unexpected table in export: {table}")
+        if tuple(info['columns']) != columns:
+            raise ValueError(f"Unexpected columns for table {table}: {info['columns']}")
+    return manifest
+
+
+def read_batches(directory: str, table: str, batch_size: int = 5000):
+    """
+    Stream decoded rows from a table's data file
+
+    Yields:
+        Lists of row tuples in transfer_columns column order
+    """
+    batch = []
+    with gzip.open(table_path(directory, table), 'rt', encoding='utf-8') as f:
+        for line in f:
+            batch.append(tuple(_decode_value(value) for value in json.loads(line)))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def import_database(db: FingerprintDatabase, directory: str, workers: int = None,
+                    batch_size: int = 5000) -> dict:
+    """
+    Import an export directory, keeping the original primary keys
+
+    Inserts skip rows whose key already exists, so an interrupted import can
+    simply be rerun, and several importers may feed the same database. Users
+    go first; an exported user whose ID or username/email belongs to a
+    different user here is a conflict, and that user's templates and logs
+    are skipped rather than attached to the wrong person. The remaining
+    tables, auth_logs archive tables included, are then imported
+    concurrently, one batch per transaction. A skipped template or log is
+    only already present if the local row with its ID is identical;
+    otherwise it is reported as a conflict.
+
+    Args:
+        db: Target database
+        directory: Directory written by export_database
+        workers: Tables imported concurrently (defaults to one per table,
+            at most one per pooled connection)
+        batch_size: Rows per transaction
+
+    Returns:
+        Per-table dictionary of rows read, inserted, already present,
+        conflicting and skipped because of a user conflict, with up to
+        MAX_REPORTED_CONFLICTS conflicting IDs per table
+    """
+    manifest = read_manifest(directory)
+    tables = list(manifest['tables'])
+    summary = {}
+    conflicts = set()
+    if 'users' in tables:
+        summary['users'] = _import_users(db, directory, batch_size, conflicts)
+        tables.remove('users')
+
+    workers = workers or min(len(tables), db.pool.max_connections)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {table: executor.submit(_import_table, db, directory, table,
+                                          batch_size, conflicts)
+                   for table in tables}
+        for table, future in futures.items():
+            summary[table] = future.result()
+    return summary
+
+
+def _import_users(db, directory, batch_size, conflicts):
+    """Import users, adding conflicting exported user IDs to conflicts"""
+    result = {'rows': 0, 'inserted': 0, 'already_present': 0, 'conflicts': 0}
+    for rows in read_batches(directory, 'users', batch_size):
+        inserted = db.import_rows('users', rows)
+        result['rows'] += len(rows)
+        result['inserted'] += inserted
+        if inserted == len(rows):
+            continue
+        identities = db.get_user_identities(row[0] for row in rows)
+        for user_id, username, email, _ in rows:
+            if identities.get(user_id) != (username, email):
+                conflicts.add(user_id)
+    result['conflicts'] = len(conflicts)
+    result['already_present'] = result['rows'] - result['inserted'] - result['conflicts']
+    return result
+
+
+def _import_table(db, directory, table, batch_size, conflicts):
+    """
+    Import one table, skipping rows that belong to conflicting users
+
+    Rows the insert ignored are compared with the local row holding their
+    ID; a different row there is a conflict.
+    """
+    user_column = transfer_columns(table).index('user_id')
+    result = {'rows': 0, 'inserted': 0, 'already_present': 0, 'conflicts': 0,
+              'skipped_conflicts': 0, 'conflicting_ids': []}
+    for rows in read_batches(directory, table, batch_size):
+        result['rows'] += len(rows)
+        if conflicts:
+            kept = [row for row in rows if row[user_column] not in conflicts]
+            result['skipped_conflicts'] += len(rows) - len(kept)
+            rows = kept
+        if not rows:
+            continue
+        inserted = db.import_rows(table, rows)
+        result['inserted'] += inserted
+        if inserted == len(rows):
+            continue
+        local = db.get_transfer_rows(table, (row[0] for row in rows))
+        clashing = [row[0] for row in rows if local.get(row[0]) != row]
+        result['conflicts'] += len(clashing)
+        room = MAX_REPORTED_CONFLICTS - len(result['conflicting_ids'])
+        result['conflicting_ids'].extend(clashing[:max(room, 0)])
+    result['already_present'] = (result['rows'] - result['inserted'] - result['conflicts']
+                                 - result['skipped_conflicts'])
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export or import enrollment data and auth logs")
+    parser.add_argument("--db", default="fingerprint_db.sqlite", help="database file")
+    parser.add_argument("--export", metavar="DIR", help="write an export to DIR")
+    parser.add_argument("--import", dest="import_dir", metavar="DIR",
+                        help="import the export in DIR")
+    parser.add_argument("--batch-size", type=int, default=5000, help="rows per batch")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="tables imported concurrently")
+    parser.add_argument("--compress-level", type=int, default=6, help="gzip level 1-9")
+    args = parser.parse_args()
+
+    if not (args.export or args.import_dir):
+        parser.print_help()
+    database = FingerprintDatabase(args.db)
+    if args.export:
+        print(json.dumps(export_database(database, args.export, args.batch_size,
+                                         args.compress_level), indent=2))
+    if args.import_dir:
+        print(json.dumps(import_database(database, args.import_dir, args.workers,
+                                         args.batch_size), indent=2))
+    database.close()
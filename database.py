@@ -5,21 +5,346 @@ Handles SQLite database operations for fingerprint templates storage
 
 import sqlite3
 import os
+import queue
+import re
+import threading
+import weakref
+from contextlib import contextmanager
 from pathlib import Path
+from metrics import metrics
+
+# Change listeners shared by every FingerprintDatabase on the same file
+_change_listeners = {}
+
+# Ordered schema migrations. PRAGMA user_version stores how many have been
+# applied; append new entries, never reorder or edit applied ones.
+SCHEMA_MIGRATIONS = [
+    ('auth_logs user/time index', [
+        '''CREATE INDEX IF NOT EXISTS idx_auth_logs_user_time
+           ON auth_logs (user_id, attempt_time DESC)'''
+    ]),
+    ('fingerprints user index', [
+        '''CREATE INDEX IF NOT EXISTS idx_fingerprints_user
+           ON fingerprints (user_id)'''
+    ]),
+    ('auth_logs time index for retention', [
+        '''CREATE INDEX IF NOT EXISTS idx_auth_logs_time
+           ON auth_logs (attempt_time)'''
+    ]),
+    ('per-user template centroids', [
+        '''CREATE TABLE IF NOT EXISTS user_centroids (
+               user_id INTEGER PRIMARY KEY,
+               centroid BLOB NOT NULL,
+               representative BLOB NOT NULL,
+               r_min REAL NOT NULL,
+               r_max REAL NOT NULL,
+               template_count INTEGER NOT NULL,
+               FOREIGN KEY (user_id) REFERENCES users(user_id)
+           )'''
+    ]),
+    ('auth log rollups', [
+        '''CREATE TABLE IF NOT EXISTS auth_rollup_hourly (
+               hour TEXT PRIMARY KEY,
+               attempts INTEGER NOT NULL,
+               successes INTEGER NOT NULL,
+               scored INTEGER NOT NULL,
+               score_sum REAL NOT NULL
+           )''',
+        '''CREATE TABLE IF NOT EXISTS auth_rollup_user (
+               user_id INTEGER PRIMARY KEY,
+               attempts INTEGER NOT NULL,
+               successes INTEGER NOT NULL,
+               scored INTEGER NOT NULL,
+               score_sum REAL NOT NULL,
+               last_attempt TIMESTAMP
+           )''',
+        '''CREATE TABLE IF NOT EXISTS auth_rollup_hourly_scores (
+               hour TEXT NOT NULL,
+               bucket INTEGER NOT NULL,
+               count INTEGER NOT NULL,
+               PRIMARY KEY (hour, bucket)
+           ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS auth_rollup_scores (
+               bucket INTEGER PRIMARY KEY,
+               count INTEGER NOT NULL
+           )''',
+        '''CREATE TABLE IF NOT EXISTS auth_rollup_user_scores (
+               user_id INTEGER NOT NULL,
+               bucket INTEGER NOT NULL,
+               count INTEGER NOT NULL,
+               PRIMARY KEY (user_id, bucket)
+           ) WITHOUT ROWID''',
+        # Logs up to backfill_through predate the triggers and are counted
+        # by backfill_auth_rollups, which advances backfilled_to
+        '''CREATE TABLE IF NOT EXISTS auth_rollup_state (
+               id INTEGER PRIMARY KEY CHECK (id = 1),
+               backfill_through INTEGER NOT NULL,
+               backfilled_to INTEGER NOT NULL
+           )''',
+        '''INSERT OR IGNORE INTO auth_rollup_state (id, backfill_through, backfilled_to)
+           SELECT 1, COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'auth_logs'), 0), 0''',
+        '''CREATE TRIGGER IF NOT EXISTS auth_logs_rollup AFTER INSERT ON auth_logs
+           BEGIN
+               INSERT INTO auth_rollup_hourly (hour, attempts, successes, scored, score_sum)
+               VALUES (strftime('%Y-%m-%d %H:00:00', NEW.attempt_time), 1, NEW.success != 0,
+                       NEW.match_percentage IS NOT NULL, COALESCE(NEW.match_percentage, 0))
+               ON CONFLICT (hour) DO UPDATE SET
+                   attempts = attempts + 1,
+                   successes = successes + excluded.successes,
+                   scored = scored + excluded.scored,
+                   score_sum = score_sum + excluded.score_sum;
+               INSERT INTO auth_rollup_user
+                   (user_id, attempts, successes, scored, score_sum, last_attempt)
+               VALUES (NEW.user_id, 1, NEW.success != 0, NEW.match_percentage IS NOT NULL,
+                       COALESCE(NEW.match_percentage, 0), NEW.attempt_time)
+               ON CONFLICT (user_id) DO UPDATE SET
+                   attempts = attempts + 1,
+                   successes = successes + excluded.successes,
+                   scored = scored + excluded.scored,
+                   score_sum = score_sum + excluded.score_sum,
+                   last_attempt = MAX(last_attempt, excluded.last_attempt);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS auth_logs_rollup_scores AFTER INSERT ON auth_logs
+           WHEN NEW.match_percentage IS NOT NULL
+           BEGIN
+               INSERT INTO auth_rollup_hourly_scores (hour, bucket, count)
+               VALUES (strftime('%Y-%m-%d %H:00:00', NEW.attempt_time),
+                       MIN(MAX(CAST(NEW.match_percentage AS INTEGER), 0), 100), 1)
+               ON CONFLICT (hour, bucket) DO UPDATE SET count = count + 1;
+               INSERT INTO auth_rollup_scores (bucket, count)
+               VALUES (MIN(MAX(CAST(NEW.match_percentage AS INTEGER), 0), 100), 1)
+               ON CONFLICT (bucket) DO UPDATE SET count = count + 1;
+               INSERT INTO auth_rollup_user_scores (user_id, bucket, count)
+               VALUES (NEW.user_id, MIN(MAX(CAST(NEW.match_percentage AS INTEGER), 0), 100), 1)
+               ON CONFLICT (user_id, bucket) DO UPDATE SET count = count + 1;
+           END'''
+    ]),
+    # A random token created once per database file. Files derived from the
+    # database record it, so they are never reused next to a different one.
+    ('database identity', [
+        '''CREATE TABLE IF NOT EXISTS db_identity (
+               id INTEGER PRIMARY KEY CHECK (id = 1),
+               token TEXT NOT NULL
+           )''',
+        '''INSERT OR IGNORE INTO db_identity (id, token)
+           VALUES (1, lower(hex(randomblob(16))))'''
+    ]),
+]
+
+# Statements folding a "source" CTE of log rows into the rollup tables
+# (the backfill counterpart of the auth_logs_rollup triggers)
+ROLLUP_BACKFILL_STATEMENTS = [
+    '''INSERT INTO auth_rollup_hourly (hour, attempts, successes, scored, score_sum)
+       SELECT strftime('%Y-%m-%d %H:00:00', attempt_time), COUNT(*), SUM(success != 0),
+              COUNT(match_percentage), COALESCE(SUM(match_percentage), 0)
+       FROM source WHERE true GROUP BY 1
+       ON CONFLICT (hour) DO UPDATE SET
+           attempts = attempts + excluded.attempts,
+           successes = successes + excluded.successes,
+           scored = scored + excluded.scored,
+           score_sum = score_sum + excluded.score_sum''',
+    '''INSERT INTO auth_rollup_user (user_id, attempts, successes, scored, score_sum, last_attempt)
+       SELECT user_id, COUNT(*), SUM(success != 0), COUNT(match_percentage),
+              COALESCE(SUM(match_percentage), 0), MAX(attempt_time)
+       FROM source WHERE true GROUP BY 1
+       ON CONFLICT (user_id) DO UPDATE SET
+           attempts = attempts + excluded.attempts,
+           successes = successes + excluded.successes,
+           scored = scored + excluded.scored,
+           score_sum = score_sum + excluded.score_sum,
+           last_attempt = MAX(last_attempt, excluded.last_attempt)''',
+    '''INSERT INTO auth_rollup_hourly_scores (hour, bucket, count)
+       SELECT strftime('%Y-%m-%d %H:00:00', attempt_time),
+              MIN(MAX(CAST(match_percentage AS INTEGER), 0), 100), COUNT(*)
+       FROM source WHERE match_percentage IS NOT NULL GROUP BY 1, 2
+       ON CONFLICT (hour, bucket) DO UPDATE SET count = count + excluded.count''',
+    '''INSERT INTO auth_rollup_scores (bucket, count)
+       SELECT MIN(MAX(CAST(match_percentage AS INTEGER), 0), 100), COUNT(*)
+       FROM source WHERE match_percentage IS NOT NULL GROUP BY 1
+       ON CONFLICT (bucket) DO UPDATE SET count = count + excluded.count''',
+    '''INSERT INTO auth_rollup_user_scores (user_id, bucket, count)
+       SELECT user_id, MIN(MAX(CAST(match_percentage AS INTEGER), 0), 100), COUNT(*)
+       FROM source WHERE match_percentage IS NOT NULL GROUP BY 1, 2
+       ON CONFLICT (user_id, bucket) DO UPDATE SET count = count + excluded.count'''
+]
+
+ARCHIVE_TABLE_PREFIX = 'auth_logs_archive_'
+ARCHIVE_TABLE_PATTERN = re.compile(ARCHIVE_TABLE_PREFIX + r'\d{4}_\d{2}')
+
+# Tables copied by export/import, with their columns in insert order; the
+# auth_logs archive tables are copied too, with the auth_logs columns
+TRANSFER_TABLES = {
+    'users': ('user_id', 'username', 'email', 'created_at'),
+    'fingerprints': ('fingerprint_id', 'user_id', 'template_hash', 'feature_vector',
+                     'enrollment_date'),
+    'auth_logs': ('log_id', 'user_id', 'attempt_time', 'success', 'match_percentage')
+}
+
+
+def transfer_columns(table):
+    """Columns of a transfer or archive table in insert order, None for other names"""
+    if table in TRANSFER_TABLES:
+        return TRANSFER_TABLES[table]
+    if ARCHIVE_TABLE_PATTERN.fullmatch(table):
+        return TRANSFER_TABLES['auth_logs']
+    return None
+
+
+class ConnectionPool:
+    """Thread-safe pool of persistent SQLite connections in WAL mode"""
+    
+    def __init__(self, db_path, max_connections=8, timeout=30.0,
+                 cache_size_kib=16384, cached_statements=256):
+        """
+        Initialize connection pool
+        
+        Args:
+            db_path: SQLite database file
+            max_connections: Upper bound on open connections
+            timeout: Seconds to wait for a free connection or a database lock
+            cache_size_kib: Page cache per connection in KiB
+            cached_statements: Prepared statements cached per connection
+        """
+        self.db_path = db_path
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.cache_size_kib = cache_size_kib
+        self.cached_statements = cached_statements
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+        self._connections = []
+    
+    def _open(self):
+        """Open and tune a new connection"""
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout,
+                               check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size=-{int(self.cache_size_kib)}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute(f'PRAGMA busy_timeout={int(self.timeout * 1000)}')
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+    
+    def acquire(self):
+        """Take a connection from the pool, opening one if needed"""
+        with metrics.timer('db_connection_wait_seconds'):
+            if not self._slots.acquire(timeout=self.timeout):
+                metrics.inc('db_connection_timeouts_total')
+                raise sqlite3.OperationalError('Timed out waiting for a database connection')
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            try:
+                metrics.inc('db_connections_opened_total')
+                return self._open()
+            except Exception:
+                self._slots.release()
+                raise
+    
+    def release(self, conn):
+        """Return a connection to the pool"""
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+        self._slots.release()
+    
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for reads"""
+        conn = self.acquire()
+        try:
+            with metrics.timer('db_connection_hold_seconds', kind='read'):
+                yield conn
+        finally:
+            self.release(conn)
+    
+    @contextmanager
+    def transaction(self):
+        """Borrow a connection and commit on success, roll back on error"""
+        conn = self.acquire()
+        try:
+            with metrics.timer('db_connection_hold_seconds', kind='transaction'):
+                yield conn
+                conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self.release(conn)
+    
+    def close(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._connections.remove(conn)
+            conn.close()
+
 
 class FingerprintDatabase:
     """Manages fingerprint template storage and retrieval"""
     
-    def __init__(self, db_path="fingerprint_db.sqlite"):
-        """Initialize database connection"""
+    def __init__(self, db_path="fingerprint_db.sqlite", max_connections=8):
+        """Initialize database connection pool"""
         self.db_path = db_path
+        self.pool = ConnectionPool(db_path, max_connections=max_connections)
         self.init_database()
     
+    def close(self):
+        """Close pooled connections"""
+        self.pool.close()
+    
     def init_database(self):
-        """Create database tables if they don't exist"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """
+        Create database tables if they don't exist and apply migrations
         
+        A database already at the current schema version is left alone, so
+        opening it costs one PRAGMA read instead of the DDL.
+        """
+        if self.schema_version() >= len(SCHEMA_MIGRATIONS):
+            return
+        with self.pool.transaction() as conn:
+            self._create_tables(conn.cursor())
+        self.migrate()
+    
+    def schema_version(self):
+        """Get the number of schema migrations applied to the database"""
+        with self.pool.connection() as conn:
+            return conn.execute('PRAGMA user_version').fetchone()[0]
+    
+    def migrate(self):
+        """
+        Apply pending schema migrations, each in its own transaction
+        
+        Returns:
+            List of migration names that were applied
+        """
+        applied = []
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                version = conn.execute('PRAGMA user_version').fetchone()[0]
+                for number, (name, statements) in enumerate(SCHEMA_MIGRATIONS[version:],
+                                                            version + 1):
+                    for statement in statements:
+                        conn.execute(statement)
+                    conn.execute(f'PRAGMA user_version = {number}')
+                    applied.append(name)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        return applied
+    
+    def _create_tables(self, cursor):
+        """Run base schema DDL on a cursor"""
         # Create users table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -53,72 +378,787 @@ class FingerprintDatabase:
                 FOREIGN KEY (user_id) REFERENCES users(user_id)
             )
         ''')
+    
+    def add_change_listener(self, callback):
+        """
+        Register a callback invoked with a user_id after that user's data changes
         
-        conn.commit()
-        conn.close()
+        A user_id of None means data for any user may have changed. Listeners
+        are shared by all database objects opened on the same file, so caches
+        held by one manager see writes made through another. Bound methods are
+        held weakly and drop out when their owner is collected.
+        """
+        key = os.path.abspath(self.db_path)
+        if hasattr(callback, '__self__'):
+            ref = weakref.WeakMethod(callback)
+        else:
+            ref = lambda: callback
+        _change_listeners.setdefault(key, []).append(ref)
+    
+    def _notify_change(self, user_id):
+        """Invoke change listeners for a user, pruning dead references"""
+        listeners = _change_listeners.get(os.path.abspath(self.db_path))
+        if not listeners:
+            return
+        for ref in list(listeners):
+            callback = ref()
+            if callback is None:
+                listeners.remove(ref)
+            else:
+                callback(user_id)
     
     def add_user(self, username, email):
         """Add new user to database"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('INSERT INTO users (username, email) VALUES (?, ?)', 
-                         (username, email))
-            conn.commit()
-            user_id = cursor.lastrowid
-            conn.close()
-            return user_id
+            with self.pool.transaction() as conn:
+                cursor = conn.execute('INSERT INTO users (username, email) VALUES (?, ?)', 
+                                      (username, email))
+                user_id = cursor.lastrowid
         except sqlite3.IntegrityError:
             return None
+        self._notify_change(user_id)
+        return user_id
     
     def store_fingerprint(self, user_id, template_hash, feature_vector):
-        """Store encrypted fingerprint template"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO fingerprints (user_id, template_hash, feature_vector)
-            VALUES (?, ?, ?)
-        ''', (user_id, template_hash, feature_vector))
-        conn.commit()
-        conn.close()
+        """Store encrypted fingerprint template as a binary float32 blob"""
+        # The codec imports numpy, which readers of this module never need
+        from template_codec import encode_template, is_binary_template
+        if not is_binary_template(feature_vector):
+            feature_vector = encode_template(feature_vector)
+        with self.pool.transaction() as conn:
+            conn.execute('''
+                INSERT INTO fingerprints (user_id, template_hash, feature_vector)
+                VALUES (?, ?, ?)
+            ''', (user_id, template_hash, sqlite3.Binary(feature_vector)))
+        self._notify_change(user_id)
+    
+    def bulk_enroll(self, records):
+        """
+        Insert many users and their templates in a single transaction
+        
+        Each user is written under its own savepoint, so a duplicate username
+        or email rejects only that row. A row whose username and email are
+        already enrolled together is reported as skipped, which makes
+        replaying a batch after a crash harmless.
+        
+        Args:
+            records: Iterable of (row_number, username, email, templates) where
+                templates is a list of (template_hash, feature_vector)
+                
+        Returns:
+            List of (row_number, status, user_id, message) with status one of
+            'enrolled', 'skipped' or 'failed'
+        """
+        from template_codec import encode_template, is_binary_template
+        results = []
+        enrolled_ids = []
+        with self.pool.transaction() as conn:
+            # Open the outer transaction explicitly so savepoints nest inside it
+            conn.execute('BEGIN')
+            for row_number, username, email, templates in records:
+                conn.execute('SAVEPOINT enroll_row')
+                try:
+                    cursor = conn.execute('INSERT INTO users (username, email) VALUES (?, ?)',
+                                          (username, email))
+                    user_id = cursor.lastrowid
+                    conn.executemany('''
+                        INSERT INTO fingerprints (user_id, template_hash, feature_vector)
+                        VALUES (?, ?, ?)
+                    ''', [(user_id, template_hash,
+                           sqlite3.Binary(feature_vector if is_binary_template(feature_vector)
+                                          else encode_template(feature_vector)))
+                          for template_hash, feature_vector in templates])
+                except sqlite3.IntegrityError as e:
+                    conn.execute('ROLLBACK TO enroll_row')
+                    conn.execute('RELEASE enroll_row')
+                    existing = conn.execute(
+                        'SELECT user_id FROM users WHERE username = ? AND email = ?',
+                        (username, email)
+                    ).fetchone()
+                    if existing:
+                        results.append((row_number, 'skipped', existing[0],
+                                        'Already enrolled'))
+                    else:
+                        results.append((row_number, 'failed', None,
+                                        f'Duplicate username or email ({e})'))
+                    continue
+                conn.execute('RELEASE enroll_row')
+                enrolled_ids.append(user_id)
+                results.append((row_number, 'enrolled', user_id, None))
+        for user_id in enrolled_ids:
+            self._notify_change(user_id)
+        return results
     
     def get_user_fingerprints(self, user_id):
         """Retrieve all fingerprints for a user"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT template_hash, feature_vector FROM fingerprints
-            WHERE user_id = ?
-        ''', (user_id,))
-        fingerprints = cursor.fetchall()
-        conn.close()
-        return fingerprints
+        with self.pool.connection() as conn:
+            return conn.execute('''
+                SELECT template_hash, feature_vector FROM fingerprints
+                WHERE user_id = ?
+            ''', (user_id,)).fetchall()
+    
+    def store_user_centroid(self, user_id, centroid, representative, r_min, r_max,
+                            template_count):
+        """
+        Store a user's template centroid and distance bounds
+        
+        Args:
+            user_id: Owner of the templates
+            centroid: Unit-length centroid vector
+            representative: Template nearest the centroid
+            r_min: Distance of the representative from the centroid
+            r_max: Largest template distance from the centroid
+            template_count: Number of templates the centroid was computed from
+        """
+        from template_codec import encode_template
+        with self.pool.transaction() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO user_centroids
+                    (user_id, centroid, representative, r_min, r_max, template_count)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (user_id, sqlite3.Binary(encode_template(centroid)),
+                  sqlite3.Binary(encode_template(representative)), r_min, r_max,
+                  template_count))
+    
+    def get_user_centroid(self, user_id):
+        """
+        Get a user's centroid if it still covers all of their templates
+        
+        Returns:
+            Tuple of (centroid_blob, representative_blob, r_min, r_max,
+            template_count), or None when missing or stale (templates were
+            added since)
+        """
+        with self.pool.connection() as conn:
+            return conn.execute('''
+                SELECT c.centroid, c.representative, c.r_min, c.r_max, c.template_count
+                FROM user_centroids c
+                WHERE c.user_id = ? AND c.template_count =
+                    (SELECT COUNT(*) FROM fingerprints f WHERE f.user_id = c.user_id)
+            ''', (user_id,)).fetchone()
+    
+    def get_users_without_centroids(self):
+        """Get IDs of users with templates but no current centroid"""
+        with self.pool.connection() as conn:
+            return [row[0] for row in conn.execute('''
+                SELECT f.user_id FROM fingerprints f
+                LEFT JOIN user_centroids c ON c.user_id = f.user_id
+                GROUP BY f.user_id
+                HAVING MAX(c.template_count) IS NULL
+                    OR MAX(c.template_count) != COUNT(*)
+            ''')]
     
     def get_user_by_username(self, username):
         """Get user ID by username"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT user_id FROM users WHERE username = ?', (username,))
-        result = cursor.fetchone()
-        conn.close()
+        with self.pool.connection() as conn:
+            result = conn.execute('SELECT user_id FROM users WHERE username = ?',
+                                  (username,)).fetchone()
         return result[0] if result else None
     
     def log_authentication(self, user_id, success, match_percentage=None):
         """Log authentication attempt"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO auth_logs (user_id, success, match_percentage)
-            VALUES (?, ?, ?)
-        ''', (user_id, success, match_percentage))
-        conn.commit()
-        conn.close()
+        with self.pool.transaction() as conn:
+            conn.execute('''
+                INSERT INTO auth_logs (user_id, success, match_percentage)
+                VALUES (?, ?, ?)
+            ''', (user_id, success, match_percentage))
+    
+    def log_authentications(self, events):
+        """
+        Log a batch of authentication attempts in one transaction
+        
+        Args:
+            events: Iterable of (user_id, attempt_time, success, match_percentage)
+        """
+        with self.pool.transaction() as conn:
+            conn.executemany('''
+                INSERT INTO auth_logs (user_id, attempt_time, success, match_percentage)
+                VALUES (?, ?, ?, ?)
+            ''', events)
+    
+    def get_authentication_history(self, user_id, limit=10):
+        """Get the most recent authentication attempts for a user"""
+        with self.pool.connection() as conn:
+            return conn.execute('''
+                SELECT attempt_time, success, match_percentage 
+                FROM auth_logs 
+                WHERE user_id = ? 
+                ORDER BY attempt_time DESC 
+                LIMIT ?
+            ''', (user_id, limit)).fetchall()
+    
+    def get_authentication_history_columns(self, user_id=None, limit=None, batch_size=50000):
+        """
+        Read authentication attempts as numpy columns, most recent first
+        
+        Rows are converted to arrays one fetchmany batch at a time, so bulk
+        reads never hold a Python object per attempt.
+        
+        Args:
+            user_id: Only this user's attempts (all users when None)
+            limit: Most recent attempts to return (all when None)
+            batch_size: Rows converted per batch
+            
+        Returns:
+            Tuple of (user_ids int64, attempt times in epoch seconds int64,
+            success bool, match_percentage float64 with NaN where missing)
+        """
+        import numpy as np
+        where, params = ('WHERE user_id = ?', (user_id,)) if user_id is not None else ('', ())
+        batches = []
+        with self.pool.connection() as conn:
+            cursor = conn.execute(f'''
+                SELECT user_id, CAST(strftime('%s', attempt_time) AS INTEGER), success,
+                       match_percentage
+                FROM auth_logs {where}
+                ORDER BY attempt_time DESC
+                LIMIT ?
+            ''', params + (-1 if limit is None else limit,))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                batches.append(np.array(rows, dtype=np.float64))
+        table = np.concatenate(batches) if batches else np.zeros((0, 4))
+        return (table[:, 0].astype(np.int64), table[:, 1].astype(np.int64),
+                table[:, 2] != 0, np.ascontiguousarray(table[:, 3]))
     
     def get_all_users(self):
         """Get list of all registered users"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT user_id, username FROM users')
-        users = cursor.fetchall()
-        conn.close()
-        return users
+        with self.pool.connection() as conn:
+            return conn.execute('SELECT user_id, username FROM users').fetchall()
+    
+    def get_users_with_fingerprint_counts(self, after_user_id=0, limit=200):
+        """
+        Get one page of users with their fingerprint counts
+        
+        Uses keyset pagination: pass the last user_id of the previous page
+        as after_user_id. Counts come from the fingerprints(user_id) index
+        without reading any templates.
+        
+        Args:
+            after_user_id: Only users with a larger user_id are returned
+            limit: Page size
+            
+        Returns:
+            List of (user_id, username, email, created_at, fingerprint_count)
+        """
+        with self.pool.connection() as conn:
+            return conn.execute('''
+                SELECT u.user_id, u.username, u.email, u.created_at,
+                       (SELECT COUNT(*) FROM fingerprints f WHERE f.user_id = u.user_id)
+                FROM users u
+                WHERE u.user_id > ?
+                ORDER BY u.user_id
+                LIMIT ?
+            ''', (after_user_id, limit)).fetchall()
+    
+    def count_users(self):
+        """Get the number of registered users"""
+        with self.pool.connection() as conn:
+            return conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+    
+    def iter_fingerprints(self, after_id=0, batch_size=5000):
+        """
+        Stream fingerprint rows in fingerprint_id order
+        
+        Args:
+            after_id: Only rows with a larger fingerprint_id are returned
+            batch_size: Number of rows fetched per query
+            
+        Yields:
+            Lists of (fingerprint_id, user_id, feature_vector) tuples
+        """
+        while True:
+            with self.pool.connection() as conn:
+                rows = conn.execute('''
+                    SELECT fingerprint_id, user_id, feature_vector FROM fingerprints
+                    WHERE fingerprint_id > ?
+                    ORDER BY fingerprint_id
+                    LIMIT ?
+                ''', (after_id, batch_size)).fetchall()
+            if not rows:
+                break
+            yield rows
+            after_id = rows[-1][0]
+    
+    def count_fingerprints_through(self, fingerprint_id):
+        """Count fingerprints whose fingerprint_id is at most the given one"""
+        with self.pool.connection() as conn:
+            return conn.execute('SELECT COUNT(*) FROM fingerprints WHERE fingerprint_id <= ?',
+                                (fingerprint_id,)).fetchone()[0]
+    
+    def get_identity(self):
+        """
+        Get the random token identifying this database
+        
+        The identification index and gallery snapshot store it and are
+        rebuilt when it differs, e.g. next to a recreated database that
+        happens to hold the same number of rows.
+        
+        Returns:
+            32-character hex string
+        """
+        with self.pool.connection() as conn:
+            return conn.execute('SELECT token FROM db_identity').fetchone()[0]
+    
+    def get_last_fingerprint_id(self):
+        """Get the largest fingerprint_id (0 when there are no fingerprints)"""
+        with self.pool.connection() as conn:
+            return conn.execute('SELECT MAX(fingerprint_id) FROM fingerprints').fetchone()[0] or 0
+    
+    def get_fingerprint_counts(self, max_fingerprint_id=None):
+        """
+        Count fingerprints per user
+    
+        Args:
+            max_fingerprint_id: Only count rows up to this fingerprint_id
+    
+        Returns:
+            List of (user_id, count) tuples ordered by user_id
+        """
+        if max_fingerprint_id is None:
+            max_fingerprint_id = self.get_last_fingerprint_id()
+        with self.pool.connection() as conn:
+            return conn.execute('''
+                SELECT user_id, COUNT(*) FROM fingerprints
+                WHERE fingerprint_id <= ?
+                GROUP BY user_id
+                ORDER BY user_id
+            ''', (max_fingerprint_id,)).fetchall()
+    
+    def get_feature_vectors(self, fingerprint_ids):
+        """Map fingerprint IDs to their stored feature vectors"""
+        fingerprint_ids = [int(fingerprint_id) for fingerprint_id in fingerprint_ids]
+        vectors = {}
+        with self.pool.connection() as conn:
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(fingerprint_ids), 500):
+                chunk = fingerprint_ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                vectors.update(conn.execute(
+                    f'''SELECT fingerprint_id, feature_vector FROM fingerprints
+                        WHERE fingerprint_id IN ({placeholders})''',
+                    chunk
+                ).fetchall())
+        return vectors
+    
+    def get_usernames(self, user_ids):
+        """Map user IDs to usernames"""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        placeholders = ','.join('?' * len(user_ids))
+        with self.pool.connection() as conn:
+            return dict(conn.execute(
+                f'SELECT user_id, username FROM users WHERE user_id IN ({placeholders})',
+                user_ids
+            ).fetchall())
+    
+    def migrate_templates_to_binary(self, batch_size=1000):
+        """
+        Convert legacy JSON feature vectors to binary template blobs
+        
+        Rows are converted in batches, each committed on its own, so the
+        migration can be interrupted and resumed. Readers accept both
+        formats while it is in progress.
+        
+        Args:
+            batch_size: Number of rows converted per transaction
+            
+        Returns:
+            Number of templates converted
+        """
+        from template_codec import encode_template
+        converted = 0
+        last_id = 0
+        while True:
+            with self.pool.transaction() as conn:
+                rows = conn.execute('''
+                    SELECT fingerprint_id, feature_vector FROM fingerprints
+                    WHERE fingerprint_id > ? AND typeof(feature_vector) = 'text'
+                    ORDER BY fingerprint_id
+                    LIMIT ?
+                ''', (last_id, batch_size)).fetchall()
+                conn.executemany(
+                    'UPDATE fingerprints SET feature_vector = ? WHERE fingerprint_id = ?',
+                    [(sqlite3.Binary(encode_template(vector)), fingerprint_id)
+                     for fingerprint_id, vector in rows]
+                )
+            if not rows:
+                break
+            converted += len(rows)
+            last_id = rows[-1][0]
+        if converted:
+            self._notify_change(None)
+        return converted
+
+    
+    def archive_auth_logs(self, older_than_days=90):
+        """
+        Move old authentication logs into monthly archive tables
+        
+        Rows older than the cutoff are copied to auth_logs_archive_YYYY_MM
+        and deleted from auth_logs, one month per transaction, keeping the
+        hot table small.
+        
+        Args:
+            older_than_days: Age in days beyond which logs are archived
+            
+        Returns:
+            Dictionary mapping archive table name to rows moved
+        """
+        # Evaluate the cutoff once: 'now' is only fixed within one statement,
+        # and copy and delete must agree on which rows they cover
+        with self.pool.connection() as conn:
+            cutoff = conn.execute("SELECT datetime('now', ?)",
+                                  (f'-{int(older_than_days)} days',)).fetchone()[0]
+            months = [row[0] for row in conn.execute('''
+                SELECT DISTINCT strftime('%Y_%m', attempt_time) FROM auth_logs
+                WHERE attempt_time < ?
+            ''', (cutoff,))]
+        
+        moved = {}
+        for month in months:
+            table = ARCHIVE_TABLE_PREFIX + month
+            with self.pool.transaction() as conn:
+                self._create_archive_table(conn, table)
+                where = '''
+                    WHERE attempt_time < ?
+                    AND strftime('%Y_%m', attempt_time) = ?
+                '''
+                conn.execute(f'''
+                    INSERT OR IGNORE INTO {table}
+                    SELECT log_id, user_id, attempt_time, success, match_percentage
+                    FROM auth_logs {where}
+                ''', (cutoff, month))
+                # Only delete rows that are now in the archive
+                cursor = conn.execute(f'''
+                    DELETE FROM auth_logs {where}
+                    AND log_id IN (SELECT log_id FROM {table})
+                ''', (cutoff, month))
+                moved[table] = cursor.rowcount
+        return moved
+    
+    @staticmethod
+    def _create_archive_table(conn, table):
+        """Create an auth_logs archive table and its lookup index if missing"""
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                log_id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                attempt_time TIMESTAMP,
+                success BOOLEAN NOT NULL,
+                match_percentage REAL
+            )
+        ''')
+        conn.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_{table}_user_time
+            ON {table} (user_id, attempt_time DESC)
+        ''')
+    
+    def list_archive_tables(self):
+        """Get the names of auth log archive tables, oldest first"""
+        with self.pool.connection() as conn:
+            return [row[0] for row in conn.execute('''
+                SELECT name FROM sqlite_master
+                WHERE type = 'table' AND name LIKE ?
+                ORDER BY name
+            ''', (ARCHIVE_TABLE_PREFIX + '%',))]
+    
+    def backfill_auth_rollups(self, batch_size=50000):
+        """
+        Count logs written before the rollup triggers existed
+        
+        Logs up to the watermark recorded by the rollup migration, archived
+        ones included, are folded into the rollups one log_id range per
+        transaction. Progress is committed with the counts, so the backfill
+        can be interrupted and rerun without counting anything twice, and
+        short transactions keep it from blocking log writers.
+        
+        Args:
+            batch_size: Log IDs covered per transaction
+            
+        Returns:
+            Number of log rows counted
+        """
+        counted = 0
+        while True:
+            with self.pool.transaction() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                through, done = conn.execute(
+                    'SELECT backfill_through, backfilled_to FROM auth_rollup_state'
+                ).fetchone()
+                if done >= through:
+                    break
+                upper = min(done + batch_size, through)
+                tables = ['auth_logs'] + [row[0] for row in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ?",
+                    (ARCHIVE_TABLE_PREFIX + '%',)
+                )]
+                source = 'WITH source AS (' + ' UNION ALL '.join(
+                    f'''SELECT user_id, attempt_time, success, match_percentage FROM {table}
+                        WHERE log_id > :lower AND log_id <= :upper'''
+                    for table in tables
+                ) + ') '
+                params = {'lower': done, 'upper': upper}
+                counted += conn.execute(source + 'SELECT COUNT(*) FROM source',
+                                        params).fetchone()[0]
+                for statement in ROLLUP_BACKFILL_STATEMENTS:
+                    conn.execute(source + statement, params)
+                conn.execute('UPDATE auth_rollup_state SET backfilled_to = ?', (upper,))
+        return counted
+    
+    def get_auth_rollup_state(self):
+        """Get (backfill_through, backfilled_to) log IDs of the rollup backfill"""
+        with self.pool.connection() as conn:
+            return conn.execute(
+                'SELECT backfill_through, backfilled_to FROM auth_rollup_state'
+            ).fetchone()
+    
+    def get_auth_rollup_totals(self, start_hour=None, end_hour=None):
+        """
+        Sum the hourly rollups over [start_hour, end_hour)
+        
+        Hours are 'YYYY-MM-DD HH:00:00' strings in UTC; None leaves that end
+        of the range open.
+        
+        Returns:
+            Tuple of (attempts, successes, scored, score_sum)
+        """
+        with self.pool.connection() as conn:
+            return conn.execute('''
+                SELECT COALESCE(SUM(attempts), 0), COALESCE(SUM(successes), 0),
+                       COALESCE(SUM(scored), 0), COALESCE(SUM(score_sum), 0)
+                FROM auth_rollup_hourly WHERE hour >= ? AND hour < ?
+            ''', (start_hour or '', end_hour or '~')).fetchone()
+    
+    def get_hourly_auth_rollups(self, start_hour=None, end_hour=None):
+        """
+        Get hourly rollups over [start_hour, end_hour)
+        
+        Returns:
+            List of (hour, attempts, successes, scored, score_sum) in hour order
+        """
+        with self.pool.connection() as conn:
+            return conn.execute('''
+                SELECT hour, attempts, successes, scored, score_sum
+                FROM auth_rollup_hourly WHERE hour >= ? AND hour < ?
+                ORDER BY hour
+            ''', (start_hour or '', end_hour or '~')).fetchall()
+    
+    def get_auth_score_histogram(self, start_hour=None, end_hour=None, user_id=None):
+        """
+        Get match-percentage counts in 1-point buckets (100 is its own bucket)
+        
+        Args:
+            start_hour: Range start for all-user histograms
+            end_hour: Range end (exclusive) for all-user histograms
+            user_id: Histogram of one user over all time instead
+            
+        Returns:
+            List of (bucket, count) tuples for non-empty buckets
+        """
+        with self.pool.connection() as conn:
+            if user_id is not None:
+                return conn.execute('''
+                    SELECT bucket, count FROM auth_rollup_user_scores
+                    WHERE user_id = ? ORDER BY bucket
+                ''', (user_id,)).fetchall()
+            if start_hour is None and end_hour is None:
+                return conn.execute(
+                    'SELECT bucket, count FROM auth_rollup_scores ORDER BY bucket'
+                ).fetchall()
+            return conn.execute('''
+                SELECT bucket, SUM(count) FROM auth_rollup_hourly_scores
+                WHERE hour >= ? AND hour < ?
+                GROUP BY bucket ORDER BY bucket
+            ''', (start_hour or '', end_hour or '~')).fetchall()
+    
+    def get_user_auth_rollup(self, user_id):
+        """Get (attempts, successes, scored, score_sum, last_attempt) for a user"""
+        with self.pool.connection() as conn:
+            return conn.execute('''
+                SELECT attempts, successes, scored, score_sum, last_attempt
+                FROM auth_rollup_user WHERE user_id = ?
+            ''', (user_id,)).fetchone()
+    
+    def get_users_by_auth_failures(self, limit=10):
+        """
+        Get the users with the most failed attempts
+        
+        Returns:
+            List of (user_id, username, attempts, successes, last_attempt)
+        """
+        with self.pool.connection() as conn:
+            return conn.execute('''
+                SELECT r.user_id, u.username, r.attempts, r.successes, r.last_attempt
+                FROM auth_rollup_user r LEFT JOIN users u ON u.user_id = r.user_id
+                ORDER BY r.attempts - r.successes DESC
+                LIMIT ?
+            ''', (limit,)).fetchall()
+    
+    def stream_tables(self, tables=None, batch_size=5000):
+        """
+        Stream whole tables from one read transaction
+        
+        All tables are read from the same snapshot, so an export taken while
+        the database is in use is consistent. Rows are pulled with fetchmany,
+        keeping memory bounded by batch_size.
+        
+        Args:
+            tables: Names accepted by transfer_columns (defaults to every
+                TRANSFER_TABLES entry plus the auth_logs archive tables)
+            batch_size: Rows per yielded batch
+            
+        Yields:
+            Tuples of (table, rows) in primary key order; an empty table
+            yields one empty batch
+        """
+        with self.pool.connection() as conn:
+            conn.execute('BEGIN')
+            if tables is None:
+                # Listed inside the snapshot, so rows archived mid-export
+                # are read from exactly one table
+                tables = list(TRANSFER_TABLES) + [row[0] for row in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ? "
+                    "ORDER BY name", (ARCHIVE_TABLE_PREFIX + '%',)
+                ) if ARCHIVE_TABLE_PATTERN.fullmatch(row[0])]
+            for table in tables:
+                columns = transfer_columns(table)
+                cursor = conn.execute(
+                    f'SELECT {", ".join(columns)} FROM {table} ORDER BY {columns[0]}'
+                )
+                rows = cursor.fetchmany(batch_size)
+                yield table, rows
+                while rows:
+                    rows = cursor.fetchmany(batch_size)
+                    if rows:
+                        yield table, rows
+    
+    def import_rows(self, table, rows):
+        """
+        Insert exported rows, keeping their primary keys
+        
+        Rows whose key (or, for users, username/email) already exists are
+        ignored, so replaying an import is harmless. An ignored row may also
+        be a conflict with a different local row; compare against
+        get_transfer_rows to tell the two apart. Archive tables are created
+        when missing, and their new rows are counted into the auth rollups
+        the way the auth_logs triggers count imported logs.
+        
+        Args:
+            table: Name accepted by transfer_columns
+            rows: Tuples in transfer_columns column order
+            
+        Returns:
+            Number of rows inserted (rows written by triggers not included)
+        """
+        columns = transfer_columns(table)
+        if columns is None:
+            raise ValueError(f"Not a transfer table: {table}")
+        with self.pool.transaction() as conn:
+            if table in TRANSFER_TABLES:
+                inserted = conn.executemany(
+                    f'INSERT OR IGNORE INTO {table} ({", ".join(columns)}) '
+                    f'VALUES ({", ".join("?" * len(columns))})',
+                    rows
+                ).rowcount
+            else:
+                inserted = self._import_archive_rows(conn, table, rows)
+        if inserted and table in ('users', 'fingerprints'):
+            self._notify_change(None)
+        return inserted
+    
+    def _import_archive_rows(self, conn, table, rows):
+        """Insert new archive rows and fold them into the rollups"""
+        self._create_archive_table(conn, table)
+        conn.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS import_source (
+                log_id INTEGER PRIMARY KEY, user_id, attempt_time, success, match_percentage
+            )
+        ''')
+        conn.execute('DELETE FROM temp.import_source')
+        conn.executemany('INSERT OR IGNORE INTO temp.import_source VALUES (?, ?, ?, ?, ?)',
+                         rows)
+        conn.execute(f'''
+            DELETE FROM temp.import_source WHERE log_id IN (SELECT log_id FROM {table})
+        ''')
+        source = ('WITH source AS (SELECT user_id, attempt_time, success, match_percentage '
+                  'FROM temp.import_source) ')
+        for statement in ROLLUP_BACKFILL_STATEMENTS:
+            conn.execute(source + statement)
+        inserted = conn.execute(f'''
+            INSERT INTO {table} (log_id, user_id, attempt_time, success, match_percentage)
+            SELECT log_id, user_id, attempt_time, success, match_percentage
+            FROM temp.import_source
+        ''').rowcount
+        conn.execute('DELETE FROM temp.import_source')
+        return inserted
+    
+    def get_transfer_rows(self, table, keys):
+        """
+        Map primary keys of a transfer table to their rows
+        
+        Args:
+            table: Name accepted by transfer_columns
+            keys: Primary key values (the first column)
+            
+        Returns:
+            Dictionary of key -> tuple in transfer_columns column order
+        """
+        columns = transfer_columns(table)
+        keys = list(keys)
+        rows = {}
+        with self.pool.connection() as conn:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows.update((row[0], row) for row in conn.execute(
+                    f'SELECT {", ".join(columns)} FROM {table} '
+                    f'WHERE {columns[0]} IN ({placeholders})',
+                    chunk
+                ))
+        return rows
+    
+    def get_user_identities(self, user_ids):
+        """Map user IDs to (username, email) tuples"""
+        user_ids = list(user_ids)
+        identities = {}
+        with self.pool.connection() as conn:
+            for start in range(0, len(user_ids), 500):
+                chunk = user_ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = conn.execute(
+                    f'SELECT user_id, username, email FROM users WHERE user_id IN ({placeholders})',
+                    chunk
+                ).fetchall()
+                identities.update((user_id, (username, email))
+                                  for user_id, username, email in rows)
+        return identities
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fingerprint database maintenance")
+    parser.add_argument("--db", default="fingerprint_db.sqlite", help="database file")
+    parser.add_argument("--migrate-templates", action="store_true",
+                        help="convert JSON feature vectors to binary blobs")
+    parser.add_argument("--archive-logs", type=int, metavar="DAYS",
+                        help="move auth logs older than DAYS into monthly archive tables")
+    parser.add_argument("--schema-version", action="store_true",
+                        help="print the applied schema version")
+    args = parser.parse_args()
+
+    if not (args.migrate_templates or args.archive_logs is not None or args.schema_version):
+        parser.print_help()
+    db = FingerprintDatabase(args.db)
+    if args.schema_version:
+        print(f"Schema version {db.schema_version()} of {len(SCHEMA_MIGRATIONS)}")
+    if args.migrate_templates:
+        count = db.migrate_templates_to_binary()
+        print(f"Converted {count} templates to binary format")
+    if args.archive_logs is not None:
+        for table, count in db.archive_auth_logs(args.archive_logs).items():
+            print(f"Archived {count} logs into {table}")
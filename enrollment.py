@@ -3,20 +3,25 @@ Enrollment Module
 Handles fingerprint enrollment process for new users
 """
 
+import time
+from centroid_verification import UserCentroid
 from database import FingerprintDatabase
 from fingerprint_processor import FingerprintProcessor
+from matcher import normalize_templates
+from metrics import metrics
+from records import EnrollmentResult
 from datetime import datetime
 
 class EnrollmentManager:
     """Manages fingerprint enrollment process"""
     
-    def __init__(self):
+    def __init__(self, db: FingerprintDatabase = None):
         """Initialize enrollment manager"""
-        self.db = FingerprintDatabase()
+        self.db = db or FingerprintDatabase()
         self.processor = FingerprintProcessor()
     
     def enroll_user(self, username: str, email: str, 
-                   fingerprint_samples: int = 3) -> dict:
+                   fingerprint_samples: int = 3) -> EnrollmentResult:
         """
         Enroll new user with fingerprint templates
         
@@ -26,48 +31,54 @@ class EnrollmentManager:
             fingerprint_samples: Number of fingerprint samples to capture
             
         Returns:
-            Dictionary with enrollment status and details
+            EnrollmentResult (readable like the former result dict)
         """
+        started = time.perf_counter()
+        
         # Check if user already exists
-        existing_user = self.db.get_user_by_username(username)
+        with metrics.timer('enroll_stage_seconds', stage='existence_check'):
+            existing_user = self.db.get_user_by_username(username)
         if existing_user:
-            return {
-                'success': False,
-                'message': f'User {username} already exists',
-                'user_id': None
-            }
+            metrics.inc('enroll_requests_total', result='exists')
+            return EnrollmentResult(False, f'User {username} already exists')
         
         # Add user to database
-        user_id = self.db.add_user(username, email)
+        with metrics.timer('enroll_stage_seconds', stage='add_user'):
+            user_id = self.db.add_user(username, email)
         if not user_id:
-            return {
-                'success': False,
-                'message': 'Failed to create user',
-                'user_id': None
-            }
+            metrics.inc('enroll_requests_total', result='failed')
+            return EnrollmentResult(False, 'Failed to create user')
         
         # Capture and store fingerprint templates
         templates_stored = 0
-        for i in range(fingerprint_samples):
-            # Generate unique fingerprint ID for each sample
-            fingerprint_id = f"{username}_sample_{i+1}_{datetime.now().timestamp()}"
-            
-            # Generate template
-            template_hash, feature_vector = self.processor.generate_fingerprint_template(
-                fingerprint_id
+        # Generate a unique fingerprint ID and template for each sample
+        timestamp = datetime.now().timestamp()
+        with metrics.timer('enroll_stage_seconds', stage='generate'):
+            template_hashes, feature_vectors = self.processor.generate_templates(
+                f"{username}_sample_{i+1}_{timestamp}" for i in range(fingerprint_samples)
             )
+        with metrics.timer('enroll_stage_seconds', stage='store'):
+            for template_hash, feature_vector in zip(template_hashes, feature_vectors):
+                # Store in database
+                self.db.store_fingerprint(user_id, template_hash, feature_vector)
+                templates_stored += 1
             
-            # Store in database
-            self.db.store_fingerprint(user_id, template_hash, feature_vector)
-            templates_stored += 1
+            # Precompute the centroid used for early-exit verification
+            if templates_stored:
+                centroid = UserCentroid.from_templates(normalize_templates(feature_vectors))
+                self.db.store_user_centroid(user_id, centroid.centroid,
+                                            centroid.representative, centroid.r_min,
+                                            centroid.r_max, centroid.template_count)
         
-        return {
-            'success': True,
-            'message': f'User {username} enrolled successfully with {templates_stored} fingerprint samples',
-            'user_id': user_id,
-            'templates_stored': templates_stored,
-            'enrollment_time': datetime.now().isoformat()
-        }
+        metrics.inc('enroll_requests_total', result='enrolled')
+        metrics.inc('enroll_templates_total', templates_stored)
+        metrics.observe('enroll_seconds', time.perf_counter() - started)
+        
+        return EnrollmentResult(
+            True,
+            f'User {username} enrolled successfully with {templates_stored} fingerprint samples',
+            user_id, templates_stored, datetime.now().isoformat()
+        )
     
     def get_enrollment_status(self, username: str) -> dict:
         """Get enrollment status for a user"""
@@ -6,7 +6,18 @@ Simulates fingerprint feature extraction and matching using image processing
 import hashlib
 import json
 import numpy as np
-from typing import Tuple, List
+from typing import Optional, Tuple, List
+from matcher import BatchMatcher, normalize_templates
+from metrics import metrics
+from quantization import two_stage_best_match
+from template_codec import decode_template
+
+
+def template_seed(fingerprint_id: str) -> int:
+    """Stable 64-bit seed for a fingerprint ID (built-in hash() is salted per process)"""
+    digest = hashlib.blake2b(fingerprint_id.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
 
 class FingerprintProcessor:
     """Processes and matches fingerprint templates"""
@@ -15,6 +26,7 @@ class FingerprintProcessor:
         """Initialize fingerprint processor"""
         self.feature_dimension = 128  # Simulated feature vector dimension
         self.match_threshold = 0.85   # 85% match threshold for authentication
+        self.matcher = BatchMatcher(self.match_threshold)
     
     def generate_fingerprint_template(self, fingerprint_id: str) -> Tuple[str, str]:
         """
@@ -27,19 +39,36 @@ class FingerprintProcessor:
         Returns:
             Tuple of (template_hash, feature_vector_json)
         """
-        # Simulate feature extraction - create deterministic features based on ID
-        np.random.seed(hash(fingerprint_id) % (2**32))
-        feature_vector = np.random.randn(self.feature_dimension).tolist()
+        template_hashes, feature_vectors = self.generate_templates([fingerprint_id])
+        return template_hashes[0], json.dumps(feature_vectors[0].tolist())
+    
+    def generate_templates(self, fingerprint_ids) -> Tuple[List[str], np.ndarray]:
+        """
+        Simulate template generation for many fingerprints in one call
         
-        # Create hash of template for encryption simulation
-        template_str = json.dumps(feature_vector)
-        template_hash = hashlib.sha256(template_str.encode()).hexdigest()
+        Each template comes from its own numpy Generator seeded by a stable
+        digest of its ID, so output is reproducible across processes and
+        runs, independent of batch composition, and never touches the global
+        numpy random state.
         
-        return template_hash, json.dumps(feature_vector)
+        Args:
+            fingerprint_ids: Unique identifiers for the fingerprints
+            
+        Returns:
+            Tuple of (template_hashes, (N, feature_dimension) feature matrix);
+            each hash is the SHA-256 of the row's float64 buffer
+        """
+        fingerprint_ids = list(fingerprint_ids)
+        feature_vectors = np.empty((len(fingerprint_ids), self.feature_dimension))
+        for row, fingerprint_id in zip(feature_vectors, fingerprint_ids):
+            np.random.default_rng(template_seed(fingerprint_id)).standard_normal(out=row)
+        template_hashes = [hashlib.sha256(row).hexdigest() for row in feature_vectors]
+        return template_hashes, feature_vectors
     
-    def extract_features(self, fingerprint_data: str) -> np.ndarray:
-        """Extract feature vector from stored fingerprint data"""
-        return np.array(json.loads(fingerprint_data))
+    def extract_features(self, fingerprint_data) -> np.ndarray:
+        """Extract feature vector from stored binary or JSON fingerprint data"""
+        with metrics.timer('template_decode_seconds'):
+            return decode_template(fingerprint_data)
     
     def calculate_similarity(self, features1: np.ndarray, 
                             features2: np.ndarray) -> float:
@@ -81,22 +110,87 @@ class FingerprintProcessor:
         Returns:
             Tuple of (match_success, best_match_percentage)
         """
-        if not stored_features_list:
+        if len(stored_features_list) == 0:
             return False, 0.0
         
-        # Find best match among all stored templates
-        best_match = 0.0
-        for stored_features in stored_features_list:
-            similarity = self.calculate_similarity(live_features, stored_features)
-            best_match = max(best_match, similarity)
+        # Score all stored templates with a single matrix-vector product
+        return self.match_fingerprint_batch(
+            live_features, normalize_templates(stored_features_list)
+        )
+    
+    def match_fingerprint_batch(self, live_features: np.ndarray,
+                                template_matrix: np.ndarray) -> Tuple[bool, float]:
+        """
+        Match live fingerprint against a pre-normalized template matrix
         
-        # Convert to percentage
-        match_percentage = best_match * 100
+        Args:
+            live_features: Features from current fingerprint scan
+            template_matrix: (N, 128) float32 matrix from normalize_templates
+            
+        Returns:
+            Tuple of (match_success, best_match_percentage)
+        """
+        self.matcher.match_threshold = self.match_threshold
+        metrics.inc('templates_compared_total', len(template_matrix))
+        with metrics.timer('match_seconds', mode='single'):
+            return self.matcher.best_match(live_features, template_matrix)
+    
+    def match_fingerprints_batch(self, live_matrix: np.ndarray,
+                                 template_matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Match many live fingerprints against the same template matrix
         
-        # Determine if match is successful
-        is_match = best_match >= self.match_threshold
+        Args:
+            live_matrix: (M, 128) features from M fingerprint scans
+            template_matrix: (N, 128) float32 matrix from normalize_templates
+            
+        Returns:
+            Tuple of (match_success array, best_match_percentage array)
+        """
+        self.matcher.match_threshold = self.match_threshold
+        metrics.inc('templates_compared_total', len(live_matrix) * len(template_matrix))
+        with metrics.timer('match_seconds', mode='batch'):
+            return self.matcher.best_matches(live_matrix, template_matrix)
+    
+    def match_fingerprints_fused(self, live_matrix: np.ndarray, template_matrix: np.ndarray,
+                                 fusion) -> Tuple[bool, float, np.ndarray, Optional[float]]:
+        """
+        Match several fingers or captures of one user and fuse their scores
         
-        return is_match, match_percentage
+        Args:
+            live_matrix: (P, 128) features from P fingerprint scans
+            template_matrix: (N, 128) float32 matrix from normalize_templates
+            fusion: ScoreFusion holding the fusion rule
+            
+        Returns:
+            Tuple of (match_success, fused_match_percentage, per-probe best
+            match percentages, genuine probability for the trained rule)
+        """
+        fusion.match_threshold = self.match_threshold
+        metrics.inc('templates_compared_total', len(live_matrix) * len(template_matrix))
+        with metrics.timer('match_seconds', mode='fused'):
+            return fusion.match(live_matrix, template_matrix)
+    
+    def match_fingerprint_two_stage(self, live_features: np.ndarray, quantized,
+                                    full_templates) -> Tuple[bool, float]:
+        """
+        Match on compact template codes, rescoring candidates in full precision
+        
+        Only templates whose error bound lets them reach the best score are
+        rescored, so the result equals match_fingerprint_batch.
+        
+        Args:
+            live_features: Features from current fingerprint scan
+            quantized: QuantizedTemplates built with quantization.quantize
+            full_templates: Pre-normalized float32 matrix, or a callable
+                returning the full-precision rows for given row indices
+            
+        Returns:
+            Tuple of (match_success, best_match_percentage)
+        """
+        fetch_full = full_templates if callable(full_templates) else full_templates.__getitem__
+        _, best, _ = two_stage_best_match(live_features, quantized, fetch_full)
+        return best >= self.match_threshold, best * 100
     
     def encrypt_template(self, template: str) -> str:
         """
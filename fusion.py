@@ -0,0 +1,192 @@
+"""
+Score Fusion Module
+Multi-finger verification fusing per-probe scores from one score matrix
+"""
+
+import json
+import numpy as np
+from typing import Optional, Sequence, Tuple
+from matcher import cosine_to_score, normalize_templates
+
+FUSION_RULES = ('max', 'mean', 'weighted', 'trained')
+
+
+def probe_scores(live_matrix: np.ndarray, template_matrix: np.ndarray) -> np.ndarray:
+    """
+    Best score of each probe against one user's templates
+
+    All probes are scored in a single (P, N) matrix product.
+
+    Args:
+        live_matrix: (P, D) raw feature vectors, one per finger or capture
+        template_matrix: (N, D) matrix from normalize_templates
+
+    Returns:
+        (P,) float64 scores in [0, 1]
+    """
+    probes = normalize_templates(live_matrix)
+    if len(template_matrix) == 0:
+        return np.zeros(len(probes))
+    scores = cosine_to_score(probes @ template_matrix.T, probes, template_matrix)
+    return scores.max(axis=1).astype(np.float64)
+
+
+def fusion_features(scores) -> np.ndarray:
+    """
+    Fixed-length summary of per-probe scores used by the trained rule
+
+    Args:
+        scores: (P,) scores of one attempt, or (A, P) scores of A attempts
+
+    Returns:
+        (3,) or (A, 3) array of the max, mean and min score, so a model
+        applies to attempts with any number of probes
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    return np.stack([scores.max(axis=-1), scores.mean(axis=-1), scores.min(axis=-1)],
+                    axis=-1)
+
+
+class TrainedFusion:
+    """Logistic regression over fusion_features, fitted by train_fusion"""
+
+    __slots__ = ('coefficients', 'intercept')
+
+    def __init__(self, coefficients: Sequence[float], intercept: float):
+        """Create a model from its fitted parameters"""
+        self.coefficients = np.asarray(coefficients, dtype=np.float64)
+        self.intercept = float(intercept)
+
+    def probability(self, scores) -> float:
+        """Probability that an attempt with these per-probe scores is genuine"""
+        logit = fusion_features(scores) @ self.coefficients + self.intercept
+        return float(1.0 / (1.0 + np.exp(-logit)))
+
+    def to_dict(self) -> dict:
+        """JSON-safe parameters"""
+        return {'coefficients': self.coefficients.tolist(), 'intercept': self.intercept}
+
+    @classmethod
+    def from_dict(cls, params: dict) -> 'TrainedFusion':
+        """Inverse of to_dict"""
+        return cls(params['coefficients'], params['intercept'])
+
+    def save(self, path: str):
+        """Write the parameters as JSON"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path: str) -> 'TrainedFusion':
+        """Read parameters written by save"""
+        with open(path, encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+
+def train_fusion(genuine, impostor, l2: float = 1e-3,
+                 iterations: int = 50) -> TrainedFusion:
+    """
+    Fit the trained fusion rule on labelled attempts
+
+    Newton's method on an L2-regularized logistic loss. The two classes are
+    weighted equally whatever their sizes, so a probability of 0.5 balances
+    false accepts against false rejects.
+
+    Args:
+        genuine: Per-probe scores of genuine attempts, one sequence each
+        impostor: Per-probe scores of impostor attempts, one sequence each
+        l2: Ridge penalty on the coefficients
+        iterations: Newton steps at most
+
+    Returns:
+        Fitted TrainedFusion
+    """
+    genuine = [fusion_features(scores) for scores in genuine]
+    impostor = [fusion_features(scores) for scores in impostor]
+    if not genuine or not impostor:
+        raise ValueError("Training needs both genuine and impostor attempts")
+    features = np.column_stack([np.vstack(genuine + impostor),
+                                np.ones(len(genuine) + len(impostor))])
+    labels = np.concatenate([np.ones(len(genuine)), np.zeros(len(impostor))])
+    weights = np.where(labels == 1, 0.5 / len(genuine), 0.5 / len(impostor))
+    ridge = np.diag([l2] * (features.shape[1] - 1) + [0.0])
+
+    params = np.zeros(features.shape[1])
+    for _ in range(iterations):
+        probability = 1.0 / (1.0 + np.exp(-(features @ params)))
+        gradient = features.T @ (weights * (probability - labels)) + ridge @ params
+        curvature = weights * probability * (1.0 - probability)
+        hessian = (features * curvature[:, None]).T @ features + ridge
+        step = np.linalg.solve(hessian + 1e-12 * np.eye(len(params)), gradient)
+        params -= step
+        if np.abs(step).max() < 1e-9:
+            break
+    return TrainedFusion(params[:-1], params[-1])
+
+
+class ScoreFusion:
+    """Fuses the scores of several probes into one verification decision"""
+
+    def __init__(self, rule: str = 'max', match_threshold: float = 0.85,
+                 weights: Sequence[float] = None, model: TrainedFusion = None):
+        """
+        Initialize score fusion
+
+        Args:
+            rule: One of FUSION_RULES
+            match_threshold: Fused score needed to accept (the trained rule
+                accepts at a genuine probability of 0.5 instead)
+            weights: Per-probe weights for the 'weighted' rule, in probe order;
+                non-negative with a positive sum
+            model: Fitted model for the 'trained' rule
+        """
+        if rule not in FUSION_RULES:
+            raise ValueError(f"Unknown fusion rule {rule!r}; use one of {FUSION_RULES}")
+        if rule == 'weighted' and not weights:
+            raise ValueError("The weighted rule needs per-probe weights")
+        if rule == 'weighted' and (min(weights) < 0 or sum(weights) <= 0):
+            raise ValueError("Fusion weights must be non-negative with a positive sum")
+        if rule == 'trained' and model is None:
+            raise ValueError("The trained rule needs a model from train_fusion")
+        self.rule = rule
+        self.match_threshold = match_threshold
+        self.weights = None if weights is None else np.asarray(weights, dtype=np.float64)
+        self.model = model
+
+    def fuse(self, scores: np.ndarray) -> float:
+        """
+        Fuse per-probe scores
+
+        Returns:
+            Fused score in [0, 1] (a genuine probability for the trained rule)
+        """
+        if self.rule == 'max':
+            return float(scores.max())
+        if self.rule == 'mean':
+            return float(scores.mean())
+        if self.rule == 'weighted':
+            if len(self.weights) != len(scores):
+                raise ValueError(f"Expected {len(self.weights)} probes for the weighted "
+                                 f"rule, got {len(scores)}")
+            return float(scores @ self.weights / self.weights.sum())
+        return self.model.probability(scores)
+
+    def match(self, live_matrix: np.ndarray, template_matrix: np.ndarray
+              ) -> Tuple[bool, float, np.ndarray, Optional[float]]:
+        """
+        Verify several probes against one user's templates
+
+        The trained rule decides on a genuine probability, which is not a
+        similarity; its match percentage is the best per-probe score and the
+        probability is returned separately.
+
+        Returns:
+            Tuple of (match_success, fused_match_percentage, per-probe best
+            match percentages, genuine probability or None for the other rules)
+        """
+        scores = probe_scores(live_matrix, template_matrix)
+        if self.rule == 'trained':
+            probability = self.fuse(scores)
+            return probability >= 0.5, float(scores.max()) * 100, scores * 100, probability
+        fused = self.fuse(scores)
+        return fused >= self.match_threshold, fused * 100, scores * 100, None
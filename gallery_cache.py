@@ -0,0 +1,173 @@
+"""
+Gallery Cache Module
+Resident per-user template blocks so repeat authentications skip SQLite
+"""
+
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Optional
+from centroid_verification import UserCentroid
+from matcher import normalize_templates
+from metrics import metrics
+
+
+class GalleryCache:
+    """LRU cache of pre-normalized template matrices keyed by user"""
+
+    def __init__(self, db, processor, max_users: int = 4096,
+                 max_templates: int = 200_000):
+        """
+        Initialize gallery cache
+
+        Args:
+            db: FingerprintDatabase used to load templates on a miss
+            processor: FingerprintProcessor used to decode stored templates
+            max_users: Maximum number of user blocks kept resident
+            max_templates: Maximum number of template rows kept resident
+        """
+        self.db = db
+        self.processor = processor
+        self.max_users = max_users
+        self.max_templates = max_templates
+        self._user_ids = OrderedDict()
+        self._blocks = OrderedDict()
+        self._centroids = OrderedDict()
+        self._template_count = 0
+        self._generation = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        db.add_change_listener(self.invalidate)
+
+    def get_user_id(self, username: str) -> Optional[int]:
+        """Resolve a username to its user_id, caching positive lookups"""
+        with self._lock:
+            user_id = self._user_ids.get(username)
+            if user_id is not None:
+                self._user_ids.move_to_end(username)
+                return user_id
+
+        user_id = self.db.get_user_by_username(username)
+        if user_id:
+            with self._lock:
+                self._user_ids[username] = user_id
+                while len(self._user_ids) > self.max_users:
+                    self._user_ids.popitem(last=False)
+        return user_id
+
+    def get_templates(self, user_id: int) -> np.ndarray:
+        """
+        Get the pre-normalized template matrix for a user
+
+        Returns:
+            (N, D) float32 matrix; empty when the user has no fingerprints
+        """
+        with self._lock:
+            block = self._blocks.get(user_id)
+            if block is not None:
+                self._blocks.move_to_end(user_id)
+                self.hits += 1
+                metrics.inc('gallery_cache_lookups_total', result='hit')
+                return block
+            self.misses += 1
+            metrics.inc('gallery_cache_lookups_total', result='miss')
+            generation = self._generation
+
+        stored_fingerprints = self.db.get_user_fingerprints(user_id)
+        block = normalize_templates([
+            self.processor.extract_features(fp[1])
+            for fp in stored_fingerprints
+        ])
+        if not stored_fingerprints:
+            block = np.zeros((0, self.processor.feature_dimension),
+                             dtype=block.dtype)
+        block.flags.writeable = False
+
+        with self._lock:
+            # A write landed while loading; serve this block but don't keep it
+            if generation != self._generation:
+                return block
+            previous = self._blocks.pop(user_id, None)
+            if previous is not None:
+                self._template_count -= len(previous)
+            self._blocks[user_id] = block
+            self._template_count += len(block)
+            self._evict()
+        return block
+
+    def get_centroid(self, user_id: int) -> Optional[UserCentroid]:
+        """
+        Get a user's centroid, loading it from the database or computing it
+
+        A centroid computed here (no current one stored) is written back so
+        other processes can skip the computation.
+
+        Returns:
+            UserCentroid, or None when the user has no fingerprints
+        """
+        with self._lock:
+            centroid = self._centroids.get(user_id)
+            if centroid is not None:
+                self._centroids.move_to_end(user_id)
+                return centroid
+            generation = self._generation
+
+        stored = self.db.get_user_centroid(user_id)
+        if stored is not None:
+            vector, representative, r_min, r_max, template_count = stored
+            centroid = UserCentroid(self.processor.extract_features(vector),
+                                    self.processor.extract_features(representative),
+                                    r_min, r_max, template_count)
+        else:
+            block = self.get_templates(user_id)
+            if len(block) == 0:
+                return None
+            centroid = UserCentroid.from_templates(block)
+            self.db.store_user_centroid(user_id, centroid.centroid, centroid.representative,
+                                        centroid.r_min, centroid.r_max,
+                                        centroid.template_count)
+
+        with self._lock:
+            if generation == self._generation:
+                self._centroids[user_id] = centroid
+                while len(self._centroids) > self.max_users:
+                    self._centroids.popitem(last=False)
+        return centroid
+
+    def invalidate(self, user_id: Optional[int] = None):
+        """Drop cached templates for one user, or everything when user_id is None"""
+        with self._lock:
+            self._generation += 1
+            if user_id is None:
+                self._blocks.clear()
+                self._centroids.clear()
+                self._template_count = 0
+                return
+            self._centroids.pop(user_id, None)
+            block = self._blocks.pop(user_id, None)
+            if block is not None:
+                self._template_count -= len(block)
+
+    def _evict(self):
+        """Evict least recently used blocks until within size bounds"""
+        while self._blocks and (len(self._blocks) > self.max_users
+                                or self._template_count > self.max_templates):
+            _, block = self._blocks.popitem(last=False)
+            self._template_count -= len(block)
+            self.evictions += 1
+            metrics.inc('gallery_cache_evictions_total')
+
+    def stats(self) -> dict:
+        """Get cache occupancy and hit statistics"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'users': len(self._blocks),
+                'templates': self._template_count,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,322 @@
+"""
+Gallery Snapshot Module
+Memory-mapped on-disk template gallery with an incremental tail log
+"""
+
+import os
+import struct
+import numpy as np
+from typing import Tuple
+from matcher import TEMPLATE_DTYPE, normalize_templates
+
+SNAPSHOT_MAGIC = b'FPGSNAP\x00'
+TAIL_MAGIC = b'FPGTAIL\x00'
+SNAPSHOT_VERSION = 2
+
+# magic, version, dimension, reserved, templates, users, last_fingerprint_id,
+# matrix offset, identity of the source database
+_SNAPSHOT_HEADER = struct.Struct('<8sHHIQQqQ16s')
+# magic, version, dimension, reserved, snapshot last_fingerprint_id
+_TAIL_HEADER = struct.Struct('<8sHHIq')
+HEADER_BYTES = 64
+MATRIX_ALIGNMENT = 64
+
+USER_TABLE_DTYPE = np.dtype([('user_id', '<i8'), ('start', '<i8'), ('count', '<i8')])
+
+
+def tail_path_for(path: str) -> str:
+    """Path of the tail log belonging to a snapshot file"""
+    return path + '.tail'
+
+
+def _tail_dtype(dimension):
+    """Record layout of one tail log entry"""
+    return np.dtype([('fingerprint_id', '<i8'), ('user_id', '<i8'),
+                     ('vector', '<f4', (dimension,))])
+
+
+def _map(path, dtype, offset, shape, mode='r'):
+    """Memory-map an array, or return an empty one (mmap rejects zero length)"""
+    if int(np.prod(shape)) == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode=mode, offset=offset, shape=shape)
+
+
+def write_snapshot(db, processor, path: str) -> dict:
+    """
+    Export every fingerprint into a snapshot file and start an empty tail log
+
+    Layout: a fixed header, a user table of (user_id, start, count) sorted by
+    user_id, the fingerprint_id of every row, then a contiguous float32
+    matrix of pre-normalized templates grouped by user. Rows are streamed
+    from the database straight into a memory-mapped output file, so memory
+    use does not grow with gallery size.
+
+    Args:
+        db: FingerprintDatabase to export
+        processor: FingerprintProcessor used to decode stored templates
+        path: Snapshot file to write (replaced atomically)
+
+    Returns:
+        Dictionary with template, user and byte counts
+    """
+    dimension = processor.feature_dimension
+    last_fingerprint_id = db.get_last_fingerprint_id()
+    counts = np.array(db.get_fingerprint_counts(last_fingerprint_id),
+                      dtype=np.int64).reshape(-1, 2)
+    user_table = np.zeros(len(counts), dtype=USER_TABLE_DTYPE)
+    user_table['user_id'] = counts[:, 0]
+    user_table['count'] = counts[:, 1]
+    user_table['start'] = np.cumsum(counts[:, 1]) - counts[:, 1]
+    templates = int(counts[:, 1].sum())
+
+    ids_offset = HEADER_BYTES + user_table.nbytes
+    matrix_offset = ids_offset + templates * 8
+    matrix_offset += -matrix_offset % MATRIX_ALIGNMENT
+    size = matrix_offset + templates * dimension * np.dtype(TEMPLATE_DTYPE).itemsize
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        header = _SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, dimension, 0,
+                                       templates, len(user_table), last_fingerprint_id,
+                                       matrix_offset, bytes.fromhex(db.get_identity()))
+        f.write(header.ljust(HEADER_BYTES, b'\x00'))
+        f.write(user_table.tobytes())
+        f.truncate(size)
+
+    fingerprint_ids = _map(tmp_path, '<i8', ids_offset, (templates,), 'r+')
+    matrix = _map(tmp_path, TEMPLATE_DTYPE, matrix_offset, (templates, dimension), 'r+')
+    next_row = user_table['start'].copy()
+    for rows in db.iter_fingerprints():
+        rows = [row for row in rows if row[0] <= last_fingerprint_id]
+        if not rows:
+            break
+        users = np.searchsorted(user_table['user_id'], [row[1] for row in rows])
+        vectors = normalize_templates([processor.extract_features(row[2]) for row in rows])
+        positions = np.empty(len(rows), dtype=np.int64)
+        for i, user in enumerate(users):
+            positions[i] = next_row[user]
+            next_row[user] += 1
+        fingerprint_ids[positions] = [row[0] for row in rows]
+        matrix[positions] = vectors
+    for array in (fingerprint_ids, matrix):
+        if isinstance(array, np.memmap):
+            array.flush()
+    del fingerprint_ids, matrix
+
+    os.replace(tmp_path, path)
+    _reset_tail(tail_path_for(path), dimension, last_fingerprint_id)
+    return {'templates': templates, 'users': len(user_table),
+            'last_fingerprint_id': last_fingerprint_id, 'bytes': size}
+
+
+def _reset_tail(path, dimension, base_fingerprint_id):
+    """Replace a tail log with an empty one tied to a snapshot"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        header = _TAIL_HEADER.pack(TAIL_MAGIC, SNAPSHOT_VERSION, dimension, 0,
+                                   base_fingerprint_id)
+        f.write(header.ljust(HEADER_BYTES, b'\x00'))
+    os.replace(tmp_path, path)
+
+
+class GallerySnapshot:
+    """
+    Read-only view of a snapshot file plus its tail log
+
+    The matrix is opened with np.memmap, so pages are loaded on demand and
+    shared between every process mapping the same file through the OS page
+    cache. Enrollments made after the snapshot are appended to the tail log
+    by sync() and read back by refresh_tail(); the snapshot only needs
+    rewriting (write_snapshot) once the tail grows large.
+    """
+
+    def __init__(self, path: str):
+        """
+        Open a snapshot
+
+        Args:
+            path: File written by write_snapshot
+        """
+        self.path = path
+        self.tail_path = tail_path_for(path)
+        with open(path, 'rb') as f:
+            header = f.read(_SNAPSHOT_HEADER.size)
+        if len(header) < _SNAPSHOT_HEADER.size:
+            raise ValueError(f"Truncated gallery snapshot: {path}")
+        (magic, version, self.dimension, _, templates, users,
+         self.last_fingerprint_id, matrix_offset, identity) = _SNAPSHOT_HEADER.unpack(header)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"Not a gallery snapshot: {path}")
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported gallery snapshot version: {version}")
+        self.db_identity = identity.hex()
+
+        self.users = _map(path, USER_TABLE_DTYPE, HEADER_BYTES, (users,))
+        self.fingerprint_ids = _map(path, '<i8', HEADER_BYTES + self.users.nbytes,
+                                    (templates,))
+        self.matrix = _map(path, TEMPLATE_DTYPE, matrix_offset, (templates, self.dimension))
+        self._tail_dtype = _tail_dtype(self.dimension)
+        self._tail = np.zeros(0, dtype=self._tail_dtype)
+        self.refresh_tail()
+
+    def __len__(self):
+        return len(self.fingerprint_ids) + len(self._tail)
+
+    @property
+    def tail_last_fingerprint_id(self) -> int:
+        """Newest fingerprint_id covered by the snapshot and tail"""
+        if len(self._tail):
+            return int(self._tail['fingerprint_id'][-1])
+        return self.last_fingerprint_id
+
+    def refresh_tail(self) -> int:
+        """
+        Read tail records appended since the last refresh
+
+        Returns:
+            Number of new records
+        """
+        try:
+            with open(self.tail_path, 'rb') as f:
+                header = f.read(HEADER_BYTES)
+                if len(header) < _TAIL_HEADER.size:
+                    return 0
+                magic, _, dimension, _, base = _TAIL_HEADER.unpack_from(header)
+                if (magic != TAIL_MAGIC or dimension != self.dimension
+                        or base != self.last_fingerprint_id):
+                    # Tail belongs to a different snapshot
+                    return 0
+                f.seek(HEADER_BYTES + len(self._tail) * self._tail_dtype.itemsize)
+                # A record cut short by a crashed writer is ignored
+                data = f.read()
+        except FileNotFoundError:
+            return 0
+        count = len(data) // self._tail_dtype.itemsize
+        if count:
+            records = np.frombuffer(data, dtype=self._tail_dtype, count=count)
+            self._tail = np.concatenate([self._tail, records])
+        return count
+
+    def check_source(self, db):
+        """
+        Make sure the snapshot was written from this database
+
+        Raises:
+            ValueError: If the database identity differs, e.g. a stale
+                snapshot left next to a recreated database
+        """
+        if self.db_identity != db.get_identity():
+            raise ValueError(f"Snapshot {self.path} was written from a different database")
+
+    def sync(self, db, processor) -> int:
+        """
+        Append fingerprints enrolled after the snapshot to the tail log
+
+        Only one process should sync a given snapshot at a time.
+
+        Returns:
+            Number of templates appended
+        """
+        self.check_source(db)
+        self.refresh_tail()
+        if not os.path.exists(self.tail_path):
+            _reset_tail(self.tail_path, self.dimension, self.last_fingerprint_id)
+        appended = 0
+        with open(self.tail_path, 'r+b') as f:
+            header = f.read(_TAIL_HEADER.size)
+            if _TAIL_HEADER.unpack(header)[4] != self.last_fingerprint_id:
+                raise ValueError(f"Snapshot was rewritten; reopen {self.path}")
+            # Drop any partial record left by a crashed writer before appending
+            f.truncate(HEADER_BYTES + len(self._tail) * self._tail_dtype.itemsize)
+            f.seek(0, os.SEEK_END)
+            for rows in db.iter_fingerprints(after_id=self.tail_last_fingerprint_id):
+                records = np.zeros(len(rows), dtype=self._tail_dtype)
+                records['fingerprint_id'] = [row[0] for row in rows]
+                records['user_id'] = [row[1] for row in rows]
+                records['vector'] = normalize_templates(
+                    [processor.extract_features(row[2]) for row in rows]
+                )
+                f.write(records.tobytes())
+                f.flush()
+                self._tail = np.concatenate([self._tail, records])
+                appended += len(records)
+        return appended
+
+    def get_templates(self, user_id: int) -> np.ndarray:
+        """
+        Get the pre-normalized templates of one user
+
+        Returns:
+            (N, D) float32 matrix; a read-only view into the mapped file when
+            the user has no tail records
+        """
+        position = np.searchsorted(self.users['user_id'], user_id)
+        block = self.matrix[:0]
+        if position < len(self.users) and self.users['user_id'][position] == user_id:
+            start, count = int(self.users['start'][position]), int(self.users['count'][position])
+            block = self.matrix[start:start + count]
+        if len(self._tail):
+            extra = self._tail['vector'][self._tail['user_id'] == user_id]
+            if len(extra):
+                return np.concatenate([block, extra])
+        return block
+
+    def rows(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Get every template as (fingerprint_ids, user_ids, matrix)
+
+        The matrix is the mapped array itself unless tail records must be
+        appended to it.
+        """
+        user_ids = np.repeat(self.users['user_id'], self.users['count'])
+        if not len(self._tail):
+            return np.asarray(self.fingerprint_ids), user_ids, self.matrix
+        return (np.concatenate([self.fingerprint_ids, self._tail['fingerprint_id']]),
+                np.concatenate([user_ids, self._tail['user_id']]),
+                np.concatenate([self.matrix, self._tail['vector']]))
+
+    def stats(self) -> dict:
+        """Get snapshot and tail sizes"""
+        return {
+            'templates': len(self.fingerprint_ids),
+            'users': len(self.users),
+            'tail_templates': len(self._tail),
+            'last_fingerprint_id': self.last_fingerprint_id,
+            'tail_last_fingerprint_id': self.tail_last_fingerprint_id,
+            'tail_fraction': len(self._tail) / max(len(self.fingerprint_ids), 1)
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import time
+    from database import FingerprintDatabase
+    from fingerprint_processor import FingerprintProcessor
+
+    parser = argparse.ArgumentParser(description="Write or update a gallery snapshot")
+    parser.add_argument("--db", default="fingerprint_db.sqlite", help="database file")
+    parser.add_argument("--snapshot", default="fingerprint_db_gallery.fpgs",
+                        help="snapshot file")
+    parser.add_argument("--sync", action="store_true",
+                        help="append new enrollments to the tail log instead of rewriting")
+    parser.add_argument("--compact-fraction", type=float, default=0.1,
+                        help="with --sync, rewrite once the tail exceeds this fraction")
+    args = parser.parse_args()
+
+    database = FingerprintDatabase(args.db)
+    processor = FingerprintProcessor()
+    start = time.perf_counter()
+    if args.sync and os.path.exists(args.snapshot):
+        snapshot = GallerySnapshot(args.snapshot)
+        result = {'appended': snapshot.sync(database, processor)}
+        if snapshot.stats()['tail_fraction'] > args.compact_fraction:
+            del snapshot
+            result['rewritten'] = write_snapshot(database, processor, args.snapshot)
+    else:
+        result = write_snapshot(database, processor, args.snapshot)
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    result['snapshot'] = GallerySnapshot(args.snapshot).stats()
+    print(json.dumps(result, indent=2))
+    database.close()
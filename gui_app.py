@@ -6,10 +6,11 @@ Complete Tkinter-based interface for enrollment and authentication
 import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext
 import json
+import threading
 from datetime import datetime
-from enrollment import EnrollmentManager
-from authentication import AuthenticationManager
 from database import FingerprintDatabase
+from gui_worker import BackgroundTasks
+from records import AuthRecord
 
 class FingerprintAuthGUI:
     """Main GUI application for fingerprint authentication system"""
@@ -21,14 +22,47 @@ class FingerprintAuthGUI:
         self.root.geometry("900x700")
         self.root.configure(bg="#f0f0f0")
         
-        # Initialize managers
-        self.enrollment_mgr = EnrollmentManager()
-        self.auth_mgr = AuthenticationManager()
+        # One database handle shared by every manager; the managers (and
+        # numpy with them) load on first use on a worker thread, so neither
+        # startup nor the Tk thread pays for the matching engine
         self.db = FingerprintDatabase()
+        self._enrollment_mgr = None
+        self._auth_mgr = None
+        self._managers_lock = threading.Lock()
+        
+        # Run engine calls off the Tk main loop
+        self.tasks = BackgroundTasks(self.root, on_busy_change=self.update_status)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         
         # Create main interface
         self.create_main_interface()
     
+    @property
+    def enrollment_mgr(self):
+        """Enrollment manager, created on first use (read it on worker threads)"""
+        with self._managers_lock:
+            if self._enrollment_mgr is None:
+                from enrollment import EnrollmentManager
+                self._enrollment_mgr = EnrollmentManager(self.db)
+            return self._enrollment_mgr
+    
+    @property
+    def auth_mgr(self):
+        """Authentication manager, created on first use (read it on worker threads)"""
+        with self._managers_lock:
+            if self._auth_mgr is None:
+                from authentication import AuthenticationManager
+                self._auth_mgr = AuthenticationManager(self.db)
+            return self._auth_mgr
+    
+    def run_enrollment(self, username, email, samples):
+        """Enroll a user (runs on a worker thread, loading the manager there)"""
+        return self.enrollment_mgr.enroll_user(username, email, samples)
+    
+    def run_authentication(self, username):
+        """Authenticate a user (runs on a worker thread, loading the manager there)"""
+        return self.auth_mgr.authenticate_user(username)
+    
     def create_main_interface(self):
         """Create main tabbed interface"""
         # Header
@@ -44,6 +78,14 @@ class FingerprintAuthGUI:
         )
         title_label.pack(pady=10)
         
+        # Status bar with activity indicator
+        status_frame = tk.Frame(self.root, bg="#f0f0f0")
+        status_frame.pack(fill=tk.X, side=tk.BOTTOM, padx=10, pady=(0, 5))
+        self.status_label = tk.Label(status_frame, text="Ready", bg="#f0f0f0", anchor=tk.W)
+        self.status_label.pack(side=tk.LEFT)
+        self.progress = ttk.Progressbar(status_frame, mode="indeterminate", length=150)
+        self.progress.pack(side=tk.RIGHT)
+        
         # Create notebook for tabs
         self.notebook = ttk.Notebook(self.root)
         self.notebook.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -91,7 +133,7 @@ class FingerprintAuthGUI:
         self.enroll_samples.pack(anchor=tk.W, pady=5)
         
         # Enroll button
-        enroll_btn = tk.Button(
+        self.enroll_btn = tk.Button(
             frame,
             text="Enroll User",
             command=self.perform_enrollment,
@@ -100,7 +142,7 @@ class FingerprintAuthGUI:
             font=("Arial", 12, "bold"),
             width=20
         )
-        enroll_btn.pack(pady=20)
+        self.enroll_btn.pack(pady=20)
         
         # Result display
         tk.Label(frame, text="Enrollment Result:", font=("Arial", 10, "bold")).pack(anchor=tk.W, pady=5)
@@ -122,7 +164,7 @@ class FingerprintAuthGUI:
         self.auth_username.pack(anchor=tk.W, pady=5)
         
         # Authenticate button
-        auth_btn = tk.Button(
+        self.auth_btn = tk.Button(
             frame,
             text="Authenticate with Fingerprint",
             command=self.perform_authentication,
@@ -131,7 +173,7 @@ class FingerprintAuthGUI:
             font=("Arial", 12, "bold"),
             width=20
         )
-        auth_btn.pack(pady=20)
+        self.auth_btn.pack(pady=20)
         
         # Result display
         tk.Label(frame, text="Authentication Result:", font=("Arial", 10, "bold")).pack(anchor=tk.W, pady=5)
@@ -158,9 +200,35 @@ class FingerprintAuthGUI:
         )
         refresh_btn.pack(pady=10)
         
-        # Users display
-        self.users_display = scrolledtext.ScrolledText(frame, height=15, width=60)
-        self.users_display.pack(pady=10)
+        # Summary of loaded users
+        self.users_summary = tk.Label(frame, text="", anchor=tk.W)
+        self.users_summary.pack(fill=tk.X)
+        
+        # Users table, filled one page at a time as it is scrolled
+        table_frame = ttk.Frame(frame)
+        table_frame.pack(fill=tk.BOTH, expand=True, pady=10)
+        self.users_tree = ttk.Treeview(
+            table_frame,
+            columns=("user_id", "username", "fingerprints"),
+            show="headings",
+            height=15
+        )
+        self.users_tree.heading("user_id", text="User ID")
+        self.users_tree.heading("username", text="Username")
+        self.users_tree.heading("fingerprints", text="Fingerprints Stored")
+        self.users_tree.column("user_id", width=80, anchor=tk.CENTER)
+        self.users_tree.column("username", width=300)
+        self.users_tree.column("fingerprints", width=150, anchor=tk.CENTER)
+        self.users_scrollbar = ttk.Scrollbar(table_frame, orient=tk.VERTICAL,
+                                             command=self.users_tree.yview)
+        self.users_tree.configure(yscrollcommand=self.on_users_scroll)
+        self.users_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.users_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        self.users_page_size = 200
+        self.users_after_id = 0
+        self.users_has_more = False
+        self.users_total = 0
         
         # Initial load
         self.refresh_users_list()
@@ -204,10 +272,15 @@ class FingerprintAuthGUI:
             messagebox.showerror("Error", "Please enter username and email")
             return
         
-        # Perform enrollment
-        result = self.enrollment_mgr.enroll_user(username, email, samples)
-        
-        # Display result
+        # Perform enrollment in the background
+        self.tasks.submit(
+            'enroll', self.run_enrollment, username, email, samples,
+            on_success=lambda result: self.show_enrollment_result(username, result),
+            on_error=self.show_task_error, supersede=False
+        )
+    
+    def show_enrollment_result(self, username, result):
+        """Display enrollment result"""
         self.enroll_result.delete(1.0, tk.END)
         result_text = f"""
 Enrollment Status: {'SUCCESS' if result['success'] else 'FAILED'}
@@ -231,21 +304,33 @@ Enrollment Time: {result.get('enrollment_time', 'N/A')}
             messagebox.showerror("Error", "Please enter username")
             return
         
-        # Perform authentication
-        result = self.auth_mgr.authenticate_user(username)
-        
-        # Display result
+        # Perform authentication in the background
+        self.tasks.submit(
+            'authenticate', self.run_authentication, username,
+            on_success=self.show_authentication_result,
+            on_error=self.show_task_error, supersede=False
+        )
+    
+    def show_authentication_result(self, result):
+        """Display authentication result"""
         self.auth_result.delete(1.0, tk.END)
         status_color = "GREEN" if result['success'] else "RED"
+        if result.get('match_percentage') is not None:
+            match = f"{result['match_percentage']}%"
+        elif 'score_bound' in result:
+            # Decided from a centroid bound on the best score
+            match = f"{'>=' if result['success'] else '<'} {result['score_bound']}%"
+        else:
+            match = 'N/A'
         result_text = f"""
 {'='*50}
 AUTHENTICATION RESULT
 {'='*50}
 
 Status: {result['message']} ({status_color})
-Username: {result['username']}
-Match Percentage: {result['match_percentage']}%
-Timestamp: {result['timestamp']}
+Username: {result.get('username', 'N/A')}
+Match Percentage: {match}
+Timestamp: {result.get('timestamp', 'N/A')}
 
 {'='*50}
         """
@@ -253,31 +338,61 @@ Timestamp: {result['timestamp']}
         
         # Show message box
         if result['success']:
-            messagebox.showinfo("Success", f"Access Granted!\nMatch: {result['match_percentage']}%")
+            messagebox.showinfo("Success", f"Access Granted!\nMatch: {match}")
         else:
-            messagebox.showerror("Failed", f"Access Denied!\nMatch: {result['match_percentage']}%")
+            messagebox.showerror("Failed", f"Access Denied!\nMatch: {match}")
     
     def refresh_users_list(self):
         """Refresh and display registered users"""
-        users = self.db.get_all_users()
-        
-        self.users_display.delete(1.0, tk.END)
-        
-        if not users:
-            self.users_display.insert(tk.END, "No registered users found.")
+        self.users_tree.delete(*self.users_tree.get_children())
+        self.users_after_id = 0
+        self.users_has_more = True
+        self.load_next_users_page()
+    
+    def load_next_users_page(self):
+        """Fetch the next page of users in the background"""
+        if not self.users_has_more:
             return
+        self.tasks.submit('users', self.fetch_users_page, self.users_after_id,
+                          on_success=self.append_users_page,
+                          on_error=self.show_task_error)
+    
+    def fetch_users_page(self, after_user_id):
+        """Read one page of users with fingerprint counts (runs on a worker thread)"""
+        total = self.db.count_users() if after_user_id == 0 else None
+        rows = self.db.get_users_with_fingerprint_counts(after_user_id, self.users_page_size)
+        return after_user_id, total, rows
+    
+    def append_users_page(self, page):
+        """Add a fetched page of users to the table"""
+        after_user_id, total, rows = page
+        if after_user_id != self.users_after_id:
+            return
+        if total is not None:
+            self.users_total = total
+        for user_id, username, _, _, fingerprint_count in rows:
+            self.users_tree.insert("", tk.END, values=(user_id, username, fingerprint_count))
+        if rows:
+            self.users_after_id = rows[-1][0]
+        self.users_has_more = len(rows) == self.users_page_size
+        
+        loaded = len(self.users_tree.get_children())
+        if not self.users_total:
+            self.users_summary.config(text="No registered users found.")
+        else:
+            self.users_summary.config(
+                text=f"Total Registered Users: {self.users_total} (showing {loaded})"
+            )
         
-        display_text = f"Total Registered Users: {len(users)}\n\n"
-        display_text += "="*50 + "\n"
-        
-        for user_id, username in users:
-            fingerprints = self.db.get_user_fingerprints(user_id)
-            display_text += f"User ID: {user_id}\n"
-            display_text += f"Username: {username}\n"
-            display_text += f"Fingerprints Stored: {len(fingerprints)}\n"
-            display_text += "-"*50 + "\n"
-        
-        self.users_display.insert(tk.END, display_text)
+        # Keep loading while the table isn't scrollable yet
+        if self.users_has_more and self.users_tree.yview()[1] >= 1.0:
+            self.load_next_users_page()
+    
+    def on_users_scroll(self, first, last):
+        """Update the scrollbar and load more users near the end of the table"""
+        self.users_scrollbar.set(first, last)
+        if float(last) > 0.95:
+            self.load_next_users_page()
     
     def view_auth_history(self):
         """View authentication history for user"""
@@ -287,8 +402,26 @@ Timestamp: {result['timestamp']}
             messagebox.showerror("Error", "Please enter username")
             return
         
-        history = self.auth_mgr.get_authentication_history(username)
-        
+        self.tasks.submit(
+            'history', self.fetch_auth_history, username,
+            on_success=lambda history: self.show_auth_history(username, history),
+            on_error=self.show_task_error
+        )
+    
+    def fetch_auth_history(self, username, limit=10):
+        """Read a user's recent attempts (runs on a worker thread)"""
+        if self._auth_mgr is not None:
+            # Flushes attempts still queued by the authentication manager
+            return self._auth_mgr.get_authentication_history(username, limit)
+        user_id = self.db.get_user_by_username(username)
+        if not user_id:
+            return []
+        return [AuthRecord(attempt_time, bool(success), match_percentage)
+                for attempt_time, success, match_percentage
+                in self.db.get_authentication_history(user_id, limit)]
+    
+    def show_auth_history(self, username, history):
+        """Display authentication history"""
         self.history_display.delete(1.0, tk.END)
         
         if not history:
@@ -304,11 +437,36 @@ Timestamp: {result['timestamp']}
             display_text += f"Attempt {i}:\n"
             display_text += f"  Time: {record['timestamp']}\n"
             display_text += f"  Status: {status}\n"
-            display_text += f"  Match %: {record['match_percentage']}%\n"
+            score = record['match_percentage']
+            display_text += f"  Match %: {'N/A' if score is None else f'{score}%'}\n"
             display_text += "-"*60 + "\n"
         
         self.history_display.insert(tk.END, display_text)
 
+    def show_task_error(self, error):
+        """Report a failed background task"""
+        messagebox.showerror("Error", f"Operation failed: {error}")
+    
+    def update_status(self, busy_keys):
+        """Show progress while background tasks are running"""
+        # Enrollment and authentication have side effects: one at a time
+        for key, button in (('enroll', self.enroll_btn), ('authenticate', self.auth_btn)):
+            button.config(state=tk.DISABLED if key in busy_keys else tk.NORMAL)
+        if busy_keys:
+            self.status_label.config(text=f"Working: {', '.join(busy_keys)}...")
+            self.progress.start(10)
+        else:
+            self.status_label.config(text="Ready")
+            self.progress.stop()
+    
+    def on_close(self):
+        """Finish background work and flush logs before exiting"""
+        self.tasks.shutdown()
+        if self._auth_mgr is not None:
+            self._auth_mgr.close()
+        self.db.close()
+        self.root.destroy()
+
 def main():
     """Main entry point"""
     root = tk.Tk()
@@ -0,0 +1,129 @@
+"""
+GUI Background Worker
+Runs blocking engine calls off the Tk main loop and posts results back
+"""
+
+import queue
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BackgroundTasks:
+    """
+    Dispatches work to a thread pool and delivers results on the Tk thread
+
+    Tasks are grouped by key (e.g. "enroll"). Submitting a key with the same
+    arguments as the task already running for it is coalesced into that task.
+    For read-only keys, submitting different arguments supersedes it and the
+    superseded result is discarded when it arrives. Keys with side effects
+    (supersede=False) reject new submissions while one runs instead, since
+    a running task can't be cancelled and its outcome must still be shown.
+    """
+
+    def __init__(self, root, max_workers: int = 2, poll_ms: int = 30,
+                 on_busy_change=None):
+        """
+        Initialize background task runner
+
+        Args:
+            root: Tk root whose event loop receives results
+            max_workers: Worker threads
+            poll_ms: Interval for draining finished tasks
+            on_busy_change: Callback(busy_keys) invoked on the Tk thread
+                whenever the set of running task keys changes
+        """
+        self.root = root
+        self.poll_ms = poll_ms
+        self.on_busy_change = on_busy_change
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='gui-worker')
+        self._results = queue.Queue()
+        self._active = {}
+        self._generation = {}
+        self._closed = False
+        self.root.after(self.poll_ms, self._drain)
+
+    def submit(self, key, func, *args, on_success=None, on_error=None,
+               supersede: bool = True) -> bool:
+        """
+        Run func(*args) in the background
+
+        Args:
+            key: Task group; only the latest task per key delivers a result
+            func: Blocking callable
+            on_success: Callback(result) run on the Tk thread
+            on_error: Callback(exception) run on the Tk thread
+            supersede: Whether this call may replace a running task of the
+                same key; pass False for calls with side effects
+
+        Returns:
+            False if the call was coalesced into an identical running task
+            or rejected because a non-superseding task is running
+        """
+        if self._closed:
+            return False
+        active = self._active.get(key)
+        if active is not None and (active[1] == args or not supersede):
+            return False
+        if active is not None:
+            active[0].cancel()
+
+        generation = self._generation.get(key, 0) + 1
+        self._generation[key] = generation
+        future = self._executor.submit(func, *args)
+        self._active[key] = (future, args)
+        future.add_done_callback(
+            lambda f: self._results.put((key, generation, f, on_success, on_error))
+        )
+        self._notify_busy()
+        return True
+
+    def is_busy(self, key=None) -> bool:
+        """Check whether a task (or any task) is running"""
+        return bool(self._active) if key is None else key in self._active
+
+    def shutdown(self):
+        """Stop accepting tasks and wait for running ones to finish"""
+        self._closed = True
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _drain(self):
+        """
+        Deliver finished results on the Tk thread
+
+        A callback that raises is reported through Tk's callback exception
+        handler; draining, the busy update and the next poll still happen.
+        """
+        changed = False
+        try:
+            while True:
+                try:
+                    key, generation, future, on_success, on_error = \
+                        self._results.get_nowait()
+                except queue.Empty:
+                    break
+                if self._generation.get(key) != generation or future.cancelled():
+                    continue
+                self._active.pop(key, None)
+                changed = True
+                try:
+                    error = future.exception()
+                    if error is not None:
+                        if on_error:
+                            on_error(error)
+                    elif on_success:
+                        on_success(future.result())
+                except Exception:
+                    self.root.report_callback_exception(*sys.exc_info())
+        finally:
+            try:
+                if changed:
+                    self._notify_busy()
+            finally:
+                if not self._closed:
+                    self.root.after(self.poll_ms, self._drain)
+
+    def _notify_busy(self):
+        """Report the running task keys"""
+        if self.on_busy_change:
+            self.on_busy_change(sorted(self._active))
@@ -0,0 +1,514 @@
+"""
+Identification Module
+Approximate nearest-neighbour index for 1:N fingerprint identification
+"""
+
+import copy
+import os
+import time
+import numpy as np
+from typing import List, Tuple
+from matcher import TEMPLATE_DTYPE, cosine_to_score, normalize_probe, normalize_templates
+from quantization import QuantizedTemplates, candidate_rows, quantize
+
+
+class IVFIndex:
+    """
+    Inverted-file index over pre-normalized fingerprint templates
+
+    Templates are clustered with spherical k-means; a query only scans the
+    n_probe lists whose centroids are closest to it. New templates are kept
+    in a small pending buffer that is scanned exhaustively until it is merged
+    into the inverted lists.
+
+    With quantization enabled the lists hold int8/float16 codes instead of
+    float32 rows. Probed lists are scored on the codes, and only rows that
+    could still reach the top k are rescored in full precision through the
+    rescore source (see set_rescore_source).
+    """
+
+    INDEX_VERSION = 3
+
+    def __init__(self, n_lists: int = None, n_probe: int = 8,
+                 dimension: int = 128, merge_fraction: float = 0.1,
+                 quantization: str = None):
+        """
+        Initialize an empty index
+
+        Args:
+            n_lists: Number of inverted lists (defaults to sqrt of gallery size)
+            n_probe: Lists scanned per query; higher trades latency for recall
+            dimension: Feature vector dimension
+            merge_fraction: Pending rows (as a fraction of the index) that
+                trigger a merge into the inverted lists
+            quantization: None for float32 lists, or 'int8'/'float16' codes
+        """
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.dimension = dimension
+        self.merge_fraction = merge_fraction
+        self.quantization = quantization
+        self.quantized = None
+        self.rescore_source = None
+        self.db_identity = None
+        self.last_fingerprint_id = 0
+        self.centroids = np.zeros((0, dimension), dtype=TEMPLATE_DTYPE)
+        self.vectors = np.zeros((0, dimension), dtype=TEMPLATE_DTYPE)
+        self.user_ids = np.zeros(0, dtype=np.int64)
+        self.fingerprint_ids = np.zeros(0, dtype=np.int64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self._pending_vectors = []
+        self._pending_user_ids = []
+        self._pending_fingerprint_ids = []
+
+    def __len__(self):
+        return len(self.user_ids) + len(self._pending_vectors)
+
+    # ------------------------------------------------------------------
+    # Building and updating
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def build_from_database(cls, db, processor, **kwargs) -> 'IVFIndex':
+        """Build an index over every row in the fingerprints table"""
+        index = cls(dimension=processor.feature_dimension, **kwargs)
+        index.db_identity = db.get_identity()
+        fingerprint_ids, user_ids, vectors = _load_rows(db, processor, 0)
+        index.build(fingerprint_ids, user_ids, vectors)
+        index.set_rescore_source(db, processor)
+        return index
+
+    @classmethod
+    def build_from_snapshot(cls, snapshot, db, processor, **kwargs) -> 'IVFIndex':
+        """
+        Build an index from a GallerySnapshot, then catch up from the database
+
+        Cold starts read the memory-mapped matrix instead of decoding every
+        row from SQLite; only rows newer than the snapshot's tail are queried.
+        """
+        snapshot.check_source(db)
+        index = cls(dimension=snapshot.dimension, **kwargs)
+        index.db_identity = snapshot.db_identity
+        fingerprint_ids, user_ids, vectors = snapshot.rows()
+        index.build(fingerprint_ids, user_ids, vectors)
+        index.last_fingerprint_id = max(index.last_fingerprint_id,
+                                        snapshot.tail_last_fingerprint_id)
+        index.set_rescore_source(db, processor)
+        index.sync(db, processor, check_watermark=True)
+        return index
+
+    def set_rescore_source(self, db, processor):
+        """Fetch full-precision templates from the database for rescoring"""
+        def fetch(fingerprint_ids):
+            stored = db.get_feature_vectors(fingerprint_ids)
+            return normalize_templates([processor.extract_features(stored[fingerprint_id])
+                                        for fingerprint_id in fingerprint_ids])
+        self.rescore_source = fetch
+
+    def build(self, fingerprint_ids, user_ids, vectors, iterations: int = 10,
+              training_size: int = 50_000, seed: int = 0):
+        """
+        Train centroids and assign all templates to inverted lists
+
+        Args:
+            fingerprint_ids: Row IDs of the templates
+            user_ids: Owning user of each template
+            vectors: (N, D) raw or normalized feature vectors
+            iterations: k-means iterations
+            training_size: Maximum templates sampled for centroid training
+            seed: Seed for the training sample and initial centroids
+        """
+        vectors = normalize_templates(vectors).reshape(-1, self.dimension)
+        fingerprint_ids = np.asarray(fingerprint_ids, dtype=np.int64)
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        self._pending_vectors, self._pending_user_ids = [], []
+        self._pending_fingerprint_ids = []
+        if len(fingerprint_ids):
+            self.last_fingerprint_id = max(self.last_fingerprint_id,
+                                           int(fingerprint_ids.max()))
+
+        rng = np.random.default_rng(seed)
+        if len(vectors) > training_size:
+            sample = vectors[rng.choice(len(vectors), training_size, replace=False)]
+        else:
+            sample = vectors
+        n_lists = self.n_lists or int(np.sqrt(len(vectors)))
+        n_lists = max(1, min(n_lists, len(sample) or 1))
+        self.centroids = _spherical_kmeans(sample, n_lists, iterations, rng,
+                                           self.dimension)
+        self._assign(vectors, user_ids, fingerprint_ids)
+
+    def copy(self) -> 'IVFIndex':
+        """
+        Copy to update while searches keep using this index
+
+        Updates rebind arrays instead of writing into them, so the arrays
+        are shared; only the pending buffers, which add() appends to, are
+        duplicated.
+        """
+        clone = copy.copy(self)
+        clone._pending_vectors = list(self._pending_vectors)
+        clone._pending_user_ids = list(self._pending_user_ids)
+        clone._pending_fingerprint_ids = list(self._pending_fingerprint_ids)
+        return clone
+
+    def add(self, fingerprint_id: int, user_id: int, features: np.ndarray):
+        """Add one template; it is searchable immediately"""
+        self._pending_vectors.append(normalize_probe(features))
+        self._pending_user_ids.append(user_id)
+        self._pending_fingerprint_ids.append(fingerprint_id)
+        self.last_fingerprint_id = max(self.last_fingerprint_id, fingerprint_id)
+        if len(self._pending_vectors) > max(1024, self.merge_fraction * len(self.user_ids)):
+            self.merge_pending()
+
+    def sync(self, db, processor, check_watermark: bool = False) -> int:
+        """
+        Add templates enrolled since the index was last updated
+
+        Args:
+            db: Database to read new templates from
+            processor: Decodes stored templates
+            check_watermark: Also count the rows at or below
+                last_fingerprint_id and rebuild when they differ from the
+                index, e.g. after an import that kept its source IDs
+
+        Returns:
+            Number of templates added
+        """
+        if (check_watermark and len(self.centroids)
+                and db.count_fingerprints_through(self.last_fingerprint_id) != len(self)):
+            fingerprint_ids, user_ids, vectors = _load_rows(db, processor, 0)
+            self.build(fingerprint_ids, user_ids, vectors)
+            return len(fingerprint_ids)
+        fingerprint_ids, user_ids, vectors = _load_rows(
+            db, processor, self.last_fingerprint_id
+        )
+        if len(self.centroids) == 0:
+            if len(fingerprint_ids):
+                self.build(fingerprint_ids, user_ids, vectors)
+            return len(fingerprint_ids)
+        for fingerprint_id, user_id, vector in zip(fingerprint_ids, user_ids, vectors):
+            self.add(int(fingerprint_id), int(user_id), vector)
+        return len(fingerprint_ids)
+
+    def merge_pending(self):
+        """Fold pending templates into the inverted lists using current centroids"""
+        if not self._pending_vectors:
+            return
+        pending = np.stack(self._pending_vectors)
+        quantized = None
+        if self.quantized is not None:
+            # Assign with reconstructed rows but keep the original codes and
+            # residual bounds of already-indexed templates
+            quantized = QuantizedTemplates.concatenate(
+                [self.quantized, quantize(pending, self.quantization)]
+            )
+            vectors = np.concatenate([self.quantized.dequantize(), pending])
+        else:
+            vectors = np.concatenate([self.vectors, pending])
+        user_ids = np.concatenate([self.user_ids, self._pending_user_ids])
+        fingerprint_ids = np.concatenate([self.fingerprint_ids,
+                                          self._pending_fingerprint_ids])
+        self._pending_vectors, self._pending_user_ids = [], []
+        self._pending_fingerprint_ids = []
+        if len(self.centroids) == 0:
+            self.build(fingerprint_ids, user_ids, vectors)
+        else:
+            self._assign(vectors, user_ids, fingerprint_ids, quantized)
+
+    def _assign(self, vectors, user_ids, fingerprint_ids, quantized=None):
+        """Sort templates by nearest centroid so each list is contiguous"""
+        assignments = _nearest_centroid(vectors, self.centroids)
+        order = np.argsort(assignments, kind='stable')
+        if self.quantization:
+            if quantized is None:
+                quantized = quantize(vectors, self.quantization)
+            self.quantized = quantized.take(order)
+            self.vectors = np.zeros((0, self.dimension), dtype=TEMPLATE_DTYPE)
+        else:
+            self.vectors = np.ascontiguousarray(vectors[order])
+        self.user_ids = user_ids[order].astype(np.int64)
+        self.fingerprint_ids = fingerprint_ids[order].astype(np.int64)
+        counts = np.bincount(assignments, minlength=len(self.centroids))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    # ------------------------------------------------------------------
+    # Searching
+    # ------------------------------------------------------------------
+
+    def search(self, features: np.ndarray, top_k: int = 5,
+               n_probe: int = None) -> List[Tuple[int, float]]:
+        """
+        Find the users whose templates best match a probe
+
+        Args:
+            features: Raw feature vector of the probe
+            top_k: Number of candidate users returned
+            n_probe: Lists to scan (defaults to the index setting)
+
+        Returns:
+            List of (user_id, score) pairs, best first, scores in [0, 1]
+        """
+        probe = normalize_probe(features)
+        scores, user_ids = self._candidate_scores(probe, n_probe or self.n_probe, top_k)
+        return _top_users(scores, user_ids, top_k)
+
+    def search_exact(self, features: np.ndarray,
+                     top_k: int = 5) -> List[Tuple[int, float]]:
+        """Brute-force search over every template (baseline for recall)"""
+        return self.search(features, top_k, n_probe=len(self.centroids) or 1)
+
+    def _candidate_scores(self, probe, n_probe, top_k):
+        """Score the templates in the probed lists plus pending templates"""
+        spans = []
+        if len(self.centroids):
+            n_probe = min(n_probe, len(self.centroids))
+            coarse = self.centroids @ probe
+            if n_probe < len(coarse):
+                lists = np.argpartition(-coarse, n_probe - 1)[:n_probe]
+            else:
+                lists = np.arange(len(coarse))
+            spans = [(self.offsets[list_id], self.offsets[list_id + 1]) for list_id in lists]
+
+        if self.quantized is not None:
+            rows = (np.concatenate([np.arange(start, end) for start, end in spans])
+                    if spans else np.zeros(0, dtype=np.int64))
+            cosines, user_ids, scored_rows = self._rescore_quantized(probe, rows, top_k)
+        else:
+            cosines = np.concatenate([self.vectors[start:end] @ probe for start, end in spans]
+                                     or [np.zeros(0, dtype=TEMPLATE_DTYPE)])
+            user_ids = np.concatenate([self.user_ids[start:end] for start, end in spans]
+                                      or [np.zeros(0, dtype=np.int64)])
+            scored_rows = lambda: np.concatenate(
+                [self.vectors[start:end] for start, end in spans]
+                or [np.zeros((0, self.dimension), dtype=TEMPLATE_DTYPE)])
+
+        if self._pending_vectors:
+            pending = np.stack(self._pending_vectors)
+            cosines = np.concatenate([cosines, pending @ probe])
+            user_ids = np.concatenate([user_ids, np.asarray(self._pending_user_ids,
+                                                            dtype=np.int64)])
+            indexed_rows = scored_rows
+            scored_rows = lambda: np.concatenate([indexed_rows(), pending])
+        # Row vectors are only gathered if an exact zero cosine needs checking
+        return cosine_to_score(cosines.astype(TEMPLATE_DTYPE), scored_rows, probe), user_ids
+
+    def _rescore_quantized(self, probe, rows, top_k):
+        """
+        First pass on codes, then exact cosines for rows that could rank
+
+        Returns:
+            Tuple of (cosines, user_ids, row vectors or a callable
+            returning them); zero rows stay zero after quantization
+        """
+        if len(rows) == 0:
+            return (np.zeros(0, dtype=TEMPLATE_DTYPE), np.zeros(0, dtype=np.int64),
+                    np.zeros((0, self.dimension), dtype=TEMPLATE_DTYPE))
+        part = self.quantized.take(rows)
+        approximate = part.approximate_cosines(probe)
+        user_ids = self.user_ids[rows]
+        if self.rescore_source is None:
+            return approximate, user_ids, part.dequantize
+        keep = candidate_rows(approximate, part.residuals, top_k, user_ids)
+        full = self.rescore_source(self.fingerprint_ids[rows[keep]])
+        return full @ probe, user_ids[keep], full
+
+    def evaluate_recall(self, queries: np.ndarray, top_k: int = 5,
+                        n_probes=(1, 2, 4, 8, 16, 32)) -> List[dict]:
+        """
+        Measure recall and latency against the exact brute-force baseline
+
+        Args:
+            queries: (Q, D) raw probe vectors
+            top_k: Candidate list size compared with the baseline
+            n_probes: n_probe settings to evaluate
+
+        Returns:
+            One dict per setting with recall@k and mean latency in ms
+        """
+        queries = np.asarray(queries, dtype=TEMPLATE_DTYPE).reshape(-1, self.dimension)
+        start = time.perf_counter()
+        exact = [{user for user, _ in self.search_exact(q, top_k)} for q in queries]
+        exact_ms = (time.perf_counter() - start) * 1000 / max(len(queries), 1)
+
+        report = []
+        for n_probe in n_probes:
+            start = time.perf_counter()
+            results = [self.search(q, top_k, n_probe) for q in queries]
+            latency_ms = (time.perf_counter() - start) * 1000 / max(len(queries), 1)
+            hits = sum(len(expected & {user for user, _ in found})
+                       for expected, found in zip(exact, results))
+            total = sum(len(expected) for expected in exact)
+            report.append({
+                'n_probe': n_probe,
+                'recall_at_k': hits / total if total else 1.0,
+                'latency_ms': latency_ms,
+                'exact_latency_ms': exact_ms
+            })
+        return report
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def save(self, path: str):
+        """Write the index to disk (pending templates are merged first)"""
+        self.merge_pending()
+        arrays = {}
+        if self.quantized is not None:
+            arrays = {'codes': self.quantized.codes, 'scales': self.quantized.scales,
+                      'residuals': self.quantized.residuals}
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                version=np.int64(self.INDEX_VERSION),
+                n_probe=np.int64(self.n_probe),
+                quantization=np.str_(self.quantization or ''),
+                db_identity=np.str_(self.db_identity or ''),
+                last_fingerprint_id=np.int64(self.last_fingerprint_id),
+                centroids=self.centroids,
+                vectors=self.vectors,
+                user_ids=self.user_ids,
+                fingerprint_ids=self.fingerprint_ids,
+                offsets=self.offsets,
+                **arrays
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, db=None) -> 'IVFIndex':
+        """
+        Load an index written by save
+
+        Args:
+            path: File written by save
+            db: Database the index must have been built from, if given
+
+        Raises:
+            ValueError: On an unsupported version, or an index built from a
+                database other than db
+        """
+        with np.load(path) as data:
+            if int(data['version']) != cls.INDEX_VERSION:
+                raise ValueError(f"Unsupported index version: {int(data['version'])}")
+            db_identity = str(data['db_identity']) or None
+            if db is not None and db_identity != db.get_identity():
+                raise ValueError(f"Index {path} was built from a different database")
+            centroids = data['centroids']
+            quantization = str(data['quantization']) or None
+            index = cls(n_lists=len(centroids) or None, n_probe=int(data['n_probe']),
+                        dimension=centroids.shape[1], quantization=quantization)
+            index.db_identity = db_identity
+            index.last_fingerprint_id = int(data['last_fingerprint_id'])
+            index.centroids = centroids
+            index.vectors = data['vectors']
+            index.user_ids = data['user_ids']
+            index.fingerprint_ids = data['fingerprint_ids']
+            index.offsets = data['offsets']
+            if quantization:
+                index.quantized = QuantizedTemplates(quantization, data['codes'],
+                                                     data['scales'], data['residuals'])
+        return index
+
+
+def _load_rows(db, processor, after_id):
+    """Read fingerprint rows newer than after_id as (ids, user_ids, vectors)"""
+    fingerprint_ids, user_ids, vectors = [], [], []
+    for rows in db.iter_fingerprints(after_id=after_id):
+        for fingerprint_id, user_id, feature_vector in rows:
+            fingerprint_ids.append(fingerprint_id)
+            user_ids.append(user_id)
+            vectors.append(processor.extract_features(feature_vector))
+    if not vectors:
+        vectors = np.zeros((0, processor.feature_dimension), dtype=TEMPLATE_DTYPE)
+    return (np.asarray(fingerprint_ids, dtype=np.int64),
+            np.asarray(user_ids, dtype=np.int64),
+            normalize_templates(vectors))
+
+
+def _nearest_centroid(vectors, centroids, block_size=65536):
+    """Assign each vector to its most similar centroid in bounded-memory blocks"""
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block_size):
+        block = vectors[start:start + block_size]
+        assignments[start:start + block_size] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def _spherical_kmeans(sample, n_lists, iterations, rng, dimension):
+    """Cluster unit vectors by cosine similarity"""
+    if len(sample) == 0:
+        return np.zeros((0, dimension), dtype=TEMPLATE_DTYPE)
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _nearest_centroid(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        empty = ~sums.any(axis=1)
+        # Re-seed empty lists with random templates
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = normalize_templates(sums)
+    return centroids
+
+
+def _top_users(scores, user_ids, top_k):
+    """Collapse template scores to the best score per user and keep the top k"""
+    if len(scores) == 0:
+        return []
+    # Only the best rows can hold the top k users: once the m best rows cover
+    # k distinct users, every other user's best score is no higher
+    candidates = top_k * 4
+    while candidates < len(scores):
+        rows = np.argpartition(-scores, candidates - 1)[:candidates]
+        if len(np.unique(user_ids[rows])) >= top_k:
+            scores, user_ids = scores[rows], user_ids[rows]
+            break
+        candidates *= 4
+    order = np.argsort(-scores, kind='stable')
+    _, first = np.unique(user_ids[order], return_index=True)
+    best_rows = order[np.sort(first)][:top_k]
+    return [(int(user_ids[row]), float(scores[row])) for row in best_rows]
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import FingerprintDatabase
+    from fingerprint_processor import FingerprintProcessor
+
+    parser = argparse.ArgumentParser(description="Build or evaluate the identification index")
+    parser.add_argument("--db", default="fingerprint_db.sqlite", help="database file")
+    parser.add_argument("--index", default="fingerprint_db_index.npz", help="index file")
+    parser.add_argument("--n-lists", type=int, default=None, help="inverted lists")
+    parser.add_argument("--evaluate", type=int, default=0, metavar="QUERIES",
+                        help="measure recall/latency with this many noisy probes")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--quantization", choices=("int8", "float16"), default=None,
+                        help="store compact codes and rescore top candidates")
+    parser.add_argument("--snapshot", default=None,
+                        help="build from this gallery snapshot instead of SELECTing every row")
+    args = parser.parse_args()
+
+    processor = FingerprintProcessor()
+    database = FingerprintDatabase(args.db)
+    if args.snapshot:
+        from gallery_snapshot import GallerySnapshot
+        index = IVFIndex.build_from_snapshot(GallerySnapshot(args.snapshot), database,
+                                             processor, n_lists=args.n_lists,
+                                             quantization=args.quantization)
+    else:
+        index = IVFIndex.build_from_database(database, processor, n_lists=args.n_lists,
+                                             quantization=args.quantization)
+    index.save(args.index)
+    print(f"Indexed {len(index)} templates in {len(index.centroids)} lists -> {args.index}")
+
+    if args.evaluate and len(index):
+        rng = np.random.default_rng(1)
+        picks = rng.choice(len(index.user_ids), args.evaluate)
+        rows = (index.quantized.dequantize(picks) if index.quantized is not None
+                else index.vectors[picks])
+        queries = rows + 0.05 * rng.standard_normal(
+            (args.evaluate, index.dimension)).astype(TEMPLATE_DTYPE)
+        for row in index.evaluate_recall(queries, args.top_k):
+            print(f"n_probe={row['n_probe']:>3}  recall@{args.top_k}={row['recall_at_k']:.3f}  "
+                  f"latency={row['latency_ms']:.3f} ms  (exact {row['exact_latency_ms']:.3f} ms)")
@@ -0,0 +1,132 @@
+"""
+Batch Matching Engine
+Vectorized cosine scoring of live fingerprints against stacked templates
+"""
+
+import numpy as np
+from typing import Iterable, Tuple
+from template_codec import TEMPLATE_DTYPE
+
+
+def normalize_templates(templates: Iterable[np.ndarray]) -> np.ndarray:
+    """
+    Stack feature vectors into a pre-normalized template matrix
+
+    Args:
+        templates: Feature vectors (or an existing 2-D array)
+
+    Returns:
+        (N, D) float32 matrix with unit-length rows; zero vectors stay zero
+    """
+    matrix = np.array(templates, dtype=TEMPLATE_DTYPE, ndmin=2)
+    if matrix.size == 0:
+        return np.zeros((0, matrix.shape[-1]), dtype=TEMPLATE_DTYPE)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def normalize_probe(features: np.ndarray) -> np.ndarray:
+    """Return a unit-length float32 copy of a single feature vector"""
+    probe = np.asarray(features, dtype=TEMPLATE_DTYPE).ravel()
+    norm = np.linalg.norm(probe)
+    if norm == 0:
+        return np.zeros_like(probe)
+    return probe / norm
+
+
+def cosine_to_score(cosines: np.ndarray, rows=None, cols=None) -> np.ndarray:
+    """
+    Map cosine similarities from [-1, 1] to scores in [0, 1]
+
+    Pairs involving a zero-norm vector (a zero row of normalize_templates)
+    score 0.0 just like FingerprintProcessor.calculate_similarity, while
+    orthogonal nonzero vectors score 0.5. Both have a cosine of exactly 0,
+    so the operands are only checked for zero vectors when one occurs.
+
+    Args:
+        cosines: rows @ cols.T, or rows @ cols for a single vector cols
+        rows: Normalized vectors along the first axis of cosines, or a
+            callable returning them (only called when needed)
+        cols: Normalized vectors along the last axis of cosines, or one vector
+    """
+    scores = (cosines + 1.0) * 0.5
+    np.clip(scores, 0.0, 1.0, out=scores)
+    if (rows is not None or cols is not None) and (cosines == 0.0).any():
+        if cols is not None:
+            cols = np.asarray(cols)
+            if cols.ndim == 1:
+                if not cols.any():
+                    scores[...] = 0.0
+            else:
+                scores[..., ~cols.any(axis=1)] = 0.0
+        if rows is not None:
+            rows = rows() if callable(rows) else rows
+            scores[~np.asarray(rows).any(axis=1)] = 0.0
+    return scores
+
+
+class BatchMatcher:
+    """Scores probes against pre-normalized template matrices in one product"""
+
+    def __init__(self, match_threshold: float = 0.85):
+        """Initialize batch matcher"""
+        self.match_threshold = match_threshold
+
+    def score(self, live_features: np.ndarray,
+              template_matrix: np.ndarray) -> np.ndarray:
+        """
+        Score one live vector against every template
+
+        Args:
+            live_features: Raw feature vector from the current scan
+            template_matrix: (N, D) matrix from normalize_templates
+
+        Returns:
+            (N,) array of similarity scores in [0, 1]
+        """
+        probe = normalize_probe(live_features)
+        return cosine_to_score(template_matrix @ probe, template_matrix, probe)
+
+    def score_many(self, live_matrix: np.ndarray,
+                   template_matrix: np.ndarray) -> np.ndarray:
+        """
+        Score M live vectors against N templates
+
+        Args:
+            live_matrix: (M, D) raw feature vectors
+            template_matrix: (N, D) matrix from normalize_templates
+
+        Returns:
+            (M, N) array of similarity scores in [0, 1]
+        """
+        probes = normalize_templates(live_matrix)
+        return cosine_to_score(probes @ template_matrix.T, probes, template_matrix)
+
+    def best_match(self, live_features: np.ndarray,
+                   template_matrix: np.ndarray) -> Tuple[bool, float]:
+        """
+        Match one live vector against a template matrix
+
+        Returns:
+            Tuple of (match_success, best_match_percentage)
+        """
+        if len(template_matrix) == 0:
+            return False, 0.0
+        best = float(self.score(live_features, template_matrix).max())
+        return best >= self.match_threshold, best * 100
+
+    def best_matches(self, live_matrix: np.ndarray,
+                     template_matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Match many live vectors against the same template matrix
+
+        Returns:
+            Tuple of (match_success array, best_match_percentage array)
+        """
+        live_matrix = np.asarray(live_matrix)
+        if len(template_matrix) == 0:
+            count = len(live_matrix)
+            return np.zeros(count, dtype=bool), np.zeros(count)
+        best = self.score_many(live_matrix, template_matrix).max(axis=1)
+        return best >= self.match_threshold, best.astype(np.float64) * 100
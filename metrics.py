@@ -0,0 +1,250 @@
+"""
+Metrics Module
+Lightweight counters and latency histograms with Prometheus and JSON export
+"""
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# Latency bucket upper bounds in seconds (5 us .. 10 s)
+DEFAULT_BUCKETS = (0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+
+
+class _NullTimer:
+    """Timer returned while metrics are disabled"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    """Context manager observing elapsed time into a histogram"""
+
+    __slots__ = ('registry', 'key', 'start')
+
+    def __init__(self, registry, key):
+        self.registry = registry
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry._observe(self.key, time.perf_counter() - self.start)
+        return False
+
+
+class MetricsRegistry:
+    """
+    Process-wide counters and histograms keyed by name and labels
+
+    Every recording method checks the enabled flag first and returns
+    immediately when it is off, so instrumented hot paths cost one attribute
+    lookup (plus argument passing) when metrics are disabled.
+    """
+
+    def __init__(self, enabled: bool = False, buckets=DEFAULT_BUCKETS):
+        """
+        Initialize registry
+
+        Args:
+            enabled: Start recording immediately
+            buckets: Histogram bucket upper bounds in seconds
+        """
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._dumper = None
+
+    def enable(self):
+        """Start recording"""
+        self.enabled = True
+
+    def disable(self):
+        """Stop recording (collected values are kept)"""
+        self.enabled = False
+
+    def reset(self):
+        """Drop every collected value"""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    # ------------------------------------------------------------------
+    # Recording
+    # ------------------------------------------------------------------
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        """Add to a counter"""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels):
+        """Record a value (in seconds for latencies) in a histogram"""
+        if not self.enabled:
+            return
+        self._observe((name, tuple(sorted(labels.items()))), value)
+
+    def timer(self, name: str, **labels):
+        """
+        Time a block into a histogram
+
+        Usage:
+            with metrics.timer('auth_stage_seconds', stage='match'):
+                ...
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, (name, tuple(sorted(labels.items()))))
+
+    def _observe(self, key, value):
+        """Record a value under a prepared key"""
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    # ------------------------------------------------------------------
+    # Export
+    # ------------------------------------------------------------------
+
+    def snapshot(self) -> dict:
+        """
+        Get every metric as a JSON-serializable dictionary
+
+        Histograms include count, sum, mean and bucket-estimated percentiles.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(value[0]), value[1], value[2])
+                          for key, value in self._histograms.items()}
+        result = {'timestamp': time.time(), 'counters': [], 'histograms': []}
+        for (name, labels), value in sorted(counters.items()):
+            result['counters'].append({'name': name, 'labels': dict(labels), 'value': value})
+        for (name, labels), (counts, total, count) in sorted(histograms.items()):
+            result['histograms'].append({
+                'name': name,
+                'labels': dict(labels),
+                'count': count,
+                'sum': total,
+                'mean': total / count if count else 0.0,
+                'p50': self._percentile(counts, count, 0.50),
+                'p95': self._percentile(counts, count, 0.95),
+                'p99': self._percentile(counts, count, 0.99),
+                'buckets': {_format_bound(bound): cumulative for bound, cumulative
+                            in zip(self.buckets + (float('inf'),), _cumulative(counts))}
+            })
+        return result
+
+    def _percentile(self, counts, count, q):
+        """Upper bound of the bucket holding the q-th quantile"""
+        if not count:
+            return 0.0
+        target = q * count
+        for bound, cumulative in zip(self.buckets, _cumulative(counts)):
+            if cumulative >= target:
+                return bound
+        return float('inf')
+
+    def render_prometheus(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(value[0]), value[1], value[2])
+                          for key, value in self._histograms.items()}
+        lines = []
+        declared = set()
+        for (name, labels), value in sorted(counters.items()):
+            if name not in declared:
+                lines.append(f'# TYPE {name} counter')
+                declared.add(name)
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+        for (name, labels), (counts, total, count) in sorted(histograms.items()):
+            if name not in declared:
+                lines.append(f'# TYPE {name} histogram')
+                declared.add(name)
+            for bound, cumulative in zip(self.buckets + (float('inf'),), _cumulative(counts)):
+                bucket_labels = labels + (('le', _format_bound(bound)),)
+                lines.append(f'{name}_bucket{_format_labels(bucket_labels)} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {total}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, path: str):
+        """Atomically write a JSON snapshot to a file"""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp_path, path)
+
+    def start_json_dump(self, path: str, interval: float = 60.0):
+        """Write a JSON snapshot every interval seconds until stop_json_dump"""
+        self.stop_json_dump()
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                self.write_json(path)
+            self.write_json(path)
+
+        thread = threading.Thread(target=run, name='metrics-json-dump', daemon=True)
+        thread.start()
+        self._dumper = (thread, stop)
+
+    def stop_json_dump(self):
+        """Stop periodic dumps, writing one final snapshot"""
+        if self._dumper is not None:
+            thread, stop = self._dumper
+            stop.set()
+            thread.join()
+            self._dumper = None
+
+
+def _cumulative(counts):
+    """Running totals of per-bucket counts"""
+    total = 0
+    for count in counts:
+        total += count
+        yield total
+
+
+def _format_bound(bound):
+    """Bucket bound as Prometheus writes it"""
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def _format_labels(labels):
+    """Render a label tuple as {a="x",b="y"}"""
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"'
+                          for (name, _), value in zip(labels, escaped)) + '}'
+
+
+# Shared registry; set FINGERPRINT_METRICS=1 to enable at import time
+metrics = MetricsRegistry(enabled=os.environ.get('FINGERPRINT_METRICS') == '1')
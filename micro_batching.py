@@ -0,0 +1,154 @@
+"""
+Micro-Batching Module
+Coalesces concurrent verification probes into one batched matrix multiplication
+"""
+
+import threading
+import time
+import numpy as np
+from collections import deque
+from concurrent.futures import Future
+from typing import Tuple
+from matcher import cosine_to_score, normalize_templates
+
+
+class VerificationBatcher:
+    """
+    Collects verification requests over a short window and scores them together
+
+    Each request pairs one live vector with the template matrix of the user
+    being verified. A batch stacks the template matrices into one zero-padded
+    (M, Tmax, D) block and scores it against the M probes in a single batched
+    product, so every probe is scored against its own user's templates only
+    and the work stays linear in the batch size; padding is masked out and
+    each caller gets the best score within its templates.
+    """
+
+    def __init__(self, matcher, max_batch: int = 64,
+                 max_wait_ms: float = 2.0, metrics_window: int = 10000):
+        """
+        Initialize and start the batching thread
+
+        Args:
+            matcher: Object providing match_threshold (e.g. FingerprintProcessor)
+            max_batch: Requests scored together at most
+            max_wait_ms: Longest a request waits for the batch to fill
+            metrics_window: Recent requests kept for latency percentiles
+        """
+        self.matcher = matcher
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._waits = deque(maxlen=metrics_window)
+        self._started = time.perf_counter()
+        self.requests = 0
+        self.batches = 0
+        self._thread = threading.Thread(target=self._run, name='verification-batcher',
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, live_features: np.ndarray, template_matrix: np.ndarray) -> Future:
+        """
+        Queue a probe for batched matching
+
+        Args:
+            live_features: Raw feature vector of the probe
+            template_matrix: Pre-normalized templates of the claimed user
+
+        Returns:
+            Future resolving to (match_success, best_match_percentage)
+        """
+        future = Future()
+        if len(template_matrix) == 0:
+            future.set_result((False, 0.0))
+            return future
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('VerificationBatcher is closed')
+            self._pending.append((live_features, template_matrix, future,
+                                  time.perf_counter()))
+            if len(self._pending) >= self.max_batch or len(self._pending) == 1:
+                self._condition.notify()
+        return future
+
+    def match(self, live_features: np.ndarray,
+              template_matrix: np.ndarray) -> Tuple[bool, float]:
+        """Blocking form of submit"""
+        return self.submit(live_features, template_matrix).result()
+
+    def close(self):
+        """Score remaining requests and stop the batching thread"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def metrics(self) -> dict:
+        """Get batching throughput and queueing latency"""
+        waits = np.array(self._waits) * 1000 if self._waits else np.zeros(1)
+        elapsed = time.perf_counter() - self._started
+        return {
+            'requests': self.requests,
+            'batches': self.batches,
+            'mean_batch_size': self.requests / self.batches if self.batches else 0.0,
+            'requests_per_sec': self.requests / elapsed if elapsed else 0.0,
+            'queue_wait_p50_ms': float(np.percentile(waits, 50)),
+            'queue_wait_p95_ms': float(np.percentile(waits, 95)),
+            'queue_wait_p99_ms': float(np.percentile(waits, 99)),
+            'max_batch': self.max_batch,
+            'max_wait_ms': self.max_wait * 1000
+        }
+
+    def _run(self):
+        """Wait for requests, fill a batch until full or timed out, score it"""
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending and self._closed:
+                    return
+                deadline = self._pending[0][3] + self.max_wait
+                while len(self._pending) < self.max_batch and not self._closed:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                count = min(self.max_batch, len(self._pending))
+                batch = [self._pending.popleft() for _ in range(count)]
+            self._score(batch)
+
+    def _score(self, batch):
+        """Score one batch with one padded batched product and resolve futures"""
+        started = time.perf_counter()
+        try:
+            probes = normalize_templates([request[0] for request in batch])
+
+            # Stack each request's templates, zero-padded to the longest
+            counts = np.array([len(request[1]) for request in batch])
+            padded = np.zeros((len(batch), counts.max(), probes.shape[1]), dtype=probes.dtype)
+            for row, (_, templates, _, _) in enumerate(batch):
+                padded[row, :len(templates)] = templates
+            mask = np.arange(padded.shape[1]) < counts[:, None]
+
+            cosines = np.einsum('mtd,md->mt', padded, probes)
+            scores = cosine_to_score(cosines)
+            # Padding scores 0.0, below any real score; so do zero-norm
+            # templates and probes, which only show up as exact zero cosines
+            scores[~mask] = 0.0
+            if (cosines[mask] == 0.0).any():
+                scores[~padded.any(axis=2)] = 0.0
+                scores[~probes.any(axis=1)] = 0.0
+            best = scores.max(axis=1)
+
+            for row, (_, _, future, queued) in enumerate(batch):
+                self._waits.append(started - queued)
+                score = float(best[row])
+                future.set_result((score >= self.matcher.match_threshold, score * 100))
+        except Exception as e:
+            for _, _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        self.requests += len(batch)
+        self.batches += 1
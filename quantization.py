@@ -0,0 +1,226 @@
+"""
+Template Quantization Module
+Compact int8/float16 template codes with exact two-stage rescoring
+"""
+
+import numpy as np
+from matcher import TEMPLATE_DTYPE, cosine_to_score, normalize_probe, normalize_templates
+
+QUANTIZATION_MODES = ('int8', 'float16')
+
+
+class QuantizedTemplates:
+    """
+    Reduced-precision copy of a pre-normalized template matrix
+
+    Besides the codes, each row stores the L2 norm of its quantization
+    residual. For a unit-length probe q the exact cosine satisfies
+    |q.t - q.t_hat| <= residual, so the approximate scores give bounds that
+    let a matcher pick out every row that could still be the best match and
+    rescore only those in full precision.
+    """
+
+    def __init__(self, mode, codes, scales, residuals):
+        """Wrap existing codes; use quantize() to build from a matrix"""
+        self.mode = mode
+        self.codes = codes
+        self.scales = scales
+        self.residuals = residuals
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        """Resident bytes of codes and per-row metadata"""
+        return self.codes.nbytes + self.scales.nbytes + self.residuals.nbytes
+
+    def dequantize(self, rows=None) -> np.ndarray:
+        """Reconstruct approximate float32 rows"""
+        codes = self.codes if rows is None else self.codes[rows]
+        scales = self.scales if rows is None else self.scales[rows]
+        return codes.astype(TEMPLATE_DTYPE) * scales[:, None]
+
+    def approximate_cosines(self, probe: np.ndarray, block_size: int = 65536) -> np.ndarray:
+        """
+        First-pass cosines of a unit-length probe against every row
+
+        Codes are widened to float32 one block at a time, so the transient
+        memory stays bounded regardless of gallery size.
+        """
+        cosines = np.empty(len(self.codes), dtype=TEMPLATE_DTYPE)
+        for start in range(0, len(self.codes), block_size):
+            block = self.codes[start:start + block_size].astype(TEMPLATE_DTYPE)
+            cosines[start:start + block_size] = block @ probe
+        if self.mode == 'int8':
+            cosines *= self.scales
+        return cosines
+
+    def take(self, rows) -> 'QuantizedTemplates':
+        """Select rows (e.g. to reorder into inverted lists)"""
+        return QuantizedTemplates(self.mode, self.codes[rows], self.scales[rows],
+                                  self.residuals[rows])
+
+    @staticmethod
+    def concatenate(parts) -> 'QuantizedTemplates':
+        """Join quantized matrices that share a mode"""
+        parts = [part for part in parts if len(part)]
+        mode = parts[0].mode
+        return QuantizedTemplates(
+            mode,
+            np.concatenate([part.codes for part in parts]),
+            np.concatenate([part.scales for part in parts]),
+            np.concatenate([part.residuals for part in parts])
+        )
+
+
+def quantize(matrix: np.ndarray, mode: str = 'int8') -> QuantizedTemplates:
+    """
+    Quantize a pre-normalized template matrix
+
+    Args:
+        matrix: (N, D) unit-length rows from normalize_templates
+        mode: 'int8' (per-row symmetric scale) or 'float16'
+
+    Returns:
+        QuantizedTemplates with residual norms for exact rescoring
+    """
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode: {mode}")
+    matrix = np.asarray(matrix, dtype=TEMPLATE_DTYPE)
+    if mode == 'int8':
+        scales = np.abs(matrix).max(axis=1) / 127 if len(matrix) else np.zeros(0)
+        scales = np.where(scales > 0, scales, 1).astype(TEMPLATE_DTYPE)
+        codes = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    else:
+        scales = np.ones(len(matrix), dtype=TEMPLATE_DTYPE)
+        codes = matrix.astype(np.float16)
+    quantized = QuantizedTemplates(mode, codes, scales, np.zeros(len(matrix), TEMPLATE_DTYPE))
+    residual = np.linalg.norm(matrix - quantized.dequantize(), axis=1)
+    # Round the bound up so float32 rounding can never make it too tight
+    quantized.residuals = (residual * (1 + 1e-3) + 1e-6).astype(TEMPLATE_DTYPE)
+    return quantized
+
+
+def candidate_rows(approximate: np.ndarray, residuals: np.ndarray, k: int = 1,
+                   groups: np.ndarray = None) -> np.ndarray:
+    """
+    Rows whose exact cosine could rank in the top k
+
+    Args:
+        approximate: First-pass cosines
+        residuals: Per-row error bounds
+        k: Number of results (rows, or distinct groups if given) needed
+        groups: Optional owner per row (e.g. user_id) when ranking owners
+
+    Returns:
+        Indices of rows that must be rescored in full precision
+    """
+    if len(approximate) == 0:
+        return np.zeros(0, dtype=np.int64)
+    lower = approximate - residuals
+    upper = approximate + residuals
+    if groups is None:
+        best_lower = lower
+    else:
+        # Best guaranteed score per owner
+        order = np.argsort(-lower, kind='stable')
+        _, first = np.unique(groups[order], return_index=True)
+        best_lower = lower[order[first]]
+    if len(best_lower) <= k:
+        return np.arange(len(approximate))
+    kth = np.partition(best_lower, len(best_lower) - k)[len(best_lower) - k]
+    return np.flatnonzero(upper >= kth)
+
+
+def two_stage_best_match(probe_features: np.ndarray, quantized: QuantizedTemplates,
+                         fetch_full) -> tuple:
+    """
+    Best-matching row found on codes first, confirmed in full precision
+
+    Args:
+        probe_features: Raw probe vector
+        quantized: Quantized template matrix
+        fetch_full: Callable(rows) returning the pre-normalized float32 rows
+
+    Returns:
+        Tuple of (best_row, best_score, rows_rescored); the result is the same
+        as an exhaustive full-precision scan
+    """
+    if len(quantized) == 0:
+        return None, 0.0, 0
+    probe = normalize_probe(probe_features)
+    approximate = quantized.approximate_cosines(probe)
+    rows = candidate_rows(approximate, quantized.residuals)
+    full_rows = fetch_full(rows)
+    scores = cosine_to_score(full_rows @ probe, full_rows, probe)
+    best = int(np.argmax(scores))
+    return int(rows[best]), float(scores[best]), len(rows)
+
+
+def accuracy_report(matrix: np.ndarray, probes: np.ndarray, processor,
+                    mode: str = 'int8') -> dict:
+    """
+    Compare quantized scoring with FingerprintProcessor.calculate_similarity
+
+    Args:
+        matrix: (N, D) gallery templates
+        probes: (M, D) probe vectors
+        processor: FingerprintProcessor supplying the reference metric and
+            match_threshold
+        mode: Quantization mode
+
+    Returns:
+        Dictionary with memory savings, first-pass error and whether the
+        two-stage decisions and best scores match the reference
+    """
+    full = normalize_templates(matrix)
+    quantized = quantize(full, mode)
+    max_first_pass_error = 0.0
+    decision_mismatches = 0
+    max_best_score_error = 0.0
+    rescored = 0
+    for probe in probes:
+        reference = np.array([processor.calculate_similarity(probe, row) for row in matrix])
+        unit_probe = normalize_probe(probe)
+        first_pass = cosine_to_score(quantized.approximate_cosines(unit_probe),
+                                     quantized.dequantize, unit_probe)
+        max_first_pass_error = max(max_first_pass_error,
+                                   float(np.abs(first_pass - reference).max()))
+        _, best, count = two_stage_best_match(probe, quantized, lambda rows: full[rows])
+        rescored += count
+        max_best_score_error = max(max_best_score_error, abs(best - reference.max()))
+        if (best >= processor.match_threshold) != (reference.max() >= processor.match_threshold):
+            decision_mismatches += 1
+    return {
+        'mode': mode,
+        'templates': len(full),
+        'bytes_per_template_float64': matrix.shape[1] * 8,
+        'bytes_per_template_full': full.nbytes / max(len(full), 1),
+        'bytes_per_template_quantized': quantized.nbytes / max(len(full), 1),
+        'compression_ratio': full.nbytes / max(quantized.nbytes, 1),
+        'compression_ratio_vs_float64': matrix.shape[1] * 8 * len(full) / max(quantized.nbytes, 1),
+        'max_first_pass_score_error': max_first_pass_error,
+        'max_best_score_error': max_best_score_error,
+        'decision_mismatches': decision_mismatches,
+        'mean_rows_rescored': rescored / max(len(probes), 1)
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from fingerprint_processor import FingerprintProcessor
+
+    parser = argparse.ArgumentParser(description="Quantization accuracy report")
+    parser.add_argument("--templates", type=int, default=2000)
+    parser.add_argument("--probes", type=int, default=50)
+    parser.add_argument("--mode", choices=QUANTIZATION_MODES, default='int8')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    gallery = rng.standard_normal((args.templates, 128))
+    picks = rng.choice(args.templates, args.probes)
+    probes = gallery[picks] + 0.3 * rng.standard_normal((args.probes, 128))
+    print(json.dumps(accuracy_report(gallery, probes, FingerprintProcessor(), args.mode),
+                     indent=2))
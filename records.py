@@ -0,0 +1,147 @@
+"""
+Records Module
+Slotted result and record types with dict-compatible access, and columnar history
+"""
+
+from collections.abc import Mapping
+
+
+class Record(Mapping):
+    """
+    Base for slotted records that read like the dicts they replace
+
+    Fields are the subclass __slots__. A field that was never assigned is
+    absent, exactly like a missing dict key: record['field'] raises
+    KeyError, record.get('field', default) returns the default and the field
+    is left out of keys() and to_dict(). Records compare equal to dicts with
+    the same items.
+    """
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if key in self.__slots__:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def __iter__(self):
+        return (field for field in self.__slots__ if hasattr(self, field))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def to_dict(self) -> dict:
+        """Plain dict copy, e.g. for JSON encoding"""
+        return {field: getattr(self, field) for field in self}
+
+    def __repr__(self):
+        fields = ', '.join(f'{field}={getattr(self, field)!r}' for field in self)
+        return f'{type(self).__name__}({fields})'
+
+
+class AuthResult(Record):
+    """Outcome of AuthenticationManager.authenticate_user"""
+
+    __slots__ = ('success', 'message', 'match_percentage', 'username', 'timestamp',
+                 'probe_scores', 'score_bound', 'genuine_probability')
+
+    def __init__(self, success: bool, message: str, match_percentage: float,
+                 username: str = None, timestamp: str = None, probe_scores: list = None,
+                 score_bound: float = None, genuine_probability: float = None):
+        """
+        Create a result; optional fields passed as None are absent
+
+        probe_scores holds the per-probe match percentages of a multi-finger
+        verification, whose match_percentage is the fused score; under the
+        trained rule that is the best per-probe score, and the decision
+        rests on genuine_probability instead. When
+        centroid verification decided from a bound on the best score without
+        computing it, match_percentage is None and score_bound holds the bound.
+        """
+        self.success = success
+        self.message = message
+        self.match_percentage = match_percentage
+        if score_bound is not None:
+            self.score_bound = score_bound
+        if username is not None:
+            self.username = username
+        if timestamp is not None:
+            self.timestamp = timestamp
+        if probe_scores is not None:
+            self.probe_scores = probe_scores
+        if genuine_probability is not None:
+            self.genuine_probability = genuine_probability
+
+
+class EnrollmentResult(Record):
+    """Outcome of EnrollmentManager.enroll_user"""
+
+    __slots__ = ('success', 'message', 'user_id', 'templates_stored', 'enrollment_time')
+
+    def __init__(self, success: bool, message: str, user_id: int = None,
+                 templates_stored: int = None, enrollment_time: str = None):
+        """Create a result; templates_stored and enrollment_time are absent when None"""
+        self.success = success
+        self.message = message
+        self.user_id = user_id
+        if templates_stored is not None:
+            self.templates_stored = templates_stored
+        if enrollment_time is not None:
+            self.enrollment_time = enrollment_time
+
+
+class AuthRecord(Record):
+    """One authentication attempt from the history"""
+
+    __slots__ = ('timestamp', 'success', 'match_percentage')
+
+    def __init__(self, timestamp: str, success: bool, match_percentage: float = None):
+        """Create a history record"""
+        self.timestamp = timestamp
+        self.success = success
+        self.match_percentage = match_percentage
+
+
+class AuthHistory:
+    """
+    Authentication attempts as parallel numpy columns
+
+    Bulk readers (reports, exports) get four arrays instead of one object
+    per attempt: user_ids (int64), timestamps (datetime64[s], UTC), success
+    (bool) and match_percentage (float64, NaN where none was recorded).
+    """
+
+    __slots__ = ('user_ids', 'timestamps', 'success', 'match_percentage')
+
+    def __init__(self, user_ids, timestamps, success, match_percentage):
+        """Wrap equally long column arrays"""
+        self.user_ids = user_ids
+        self.timestamps = timestamps
+        self.success = success
+        self.match_percentage = match_percentage
+
+    def __len__(self):
+        return len(self.success)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the column arrays"""
+        return (self.user_ids.nbytes + self.timestamps.nbytes + self.success.nbytes
+                + self.match_percentage.nbytes)
+
+    def record(self, index: int) -> AuthRecord:
+        """Row view of one attempt, formatted like get_authentication_history"""
+        score = float(self.match_percentage[index])
+        return AuthRecord(str(self.timestamps[index]).replace('T', ' '),
+                          bool(self.success[index]), None if score != score else score)
+
+    def to_records(self) -> list:
+        """Every attempt as an AuthRecord"""
+        return [self.record(index) for index in range(len(self))]
+
+    def success_rate(self) -> float:
+        """Fraction of successful attempts (None when empty)"""
+        return float(self.success.mean()) if len(self) else None
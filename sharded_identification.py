@@ -0,0 +1,418 @@
+"""
+Sharded Identification Module
+Exact 1:N search with the gallery split across worker processes in shared memory
+"""
+
+import multiprocessing
+import os
+import threading
+import numpy as np
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+from typing import List, Tuple
+from identification import _load_rows, _top_users
+from matcher import TEMPLATE_DTYPE, cosine_to_score, normalize_templates
+
+# Rows scored per matrix product inside a worker
+BLOCK_ROWS = 65536
+
+
+def _shard_arrays(buffer, rows, dimension):
+    """View a shard segment as (user_ids, matrix)"""
+    user_ids = np.ndarray((rows,), dtype=np.int64, buffer=buffer)
+    matrix = np.ndarray((rows, dimension), dtype=TEMPLATE_DTYPE, buffer=buffer,
+                        offset=rows * 8)
+    return user_ids, matrix
+
+
+def _search_rows(matrix, user_ids, probes, top_k):
+    """
+    Top-k users per probe over one block of rows
+
+    Any partition of the gallery can be searched piecewise: a user in the
+    global top k is also in the top k of the part holding its best template.
+    """
+    results = [[] for _ in range(len(probes))]
+    for start in range(0, len(matrix), BLOCK_ROWS):
+        block_users = user_ids[start:start + BLOCK_ROWS]
+        block = matrix[start:start + BLOCK_ROWS]
+        scores = cosine_to_score(block @ probes.T, block, probes)
+        for column, found in enumerate(results):
+            found.extend(_top_users(scores[:, column], block_users, top_k))
+    return [_merge(found, top_k) for found in results]
+
+
+def _merge(found, top_k):
+    """Merge (user_id, score) lists keeping each user's best score"""
+    best = {}
+    for user_id, score in found:
+        if score > best.get(user_id, -1.0):
+            best[user_id] = score
+    return sorted(best.items(), key=lambda item: -item[1])[:top_k]
+
+
+def _attach(name):
+    """Attach to a segment without tracking it; the parent owns and unlinks it"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13 always tracks, so skip registration
+        register = resource_tracker.register
+        resource_tracker.register = lambda *args, **kwargs: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+def _worker(connection):
+    """Shard worker: attach segments on request and answer searches"""
+    segment, user_ids, matrix = None, None, None
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        command = message[0]
+        try:
+            if command == 'attach':
+                _, generation, name, rows, dimension = message
+                user_ids = matrix = None
+                if segment is not None:
+                    segment.close()
+                segment = _attach(name)
+                user_ids, matrix = _shard_arrays(segment.buf, rows, dimension)
+                connection.send(('ok', generation))
+            elif command == 'search':
+                _, probes, top_k = message
+                connection.send(('ok', _search_rows(matrix, user_ids, probes, top_k)))
+        except Exception as e:
+            connection.send(('error', f'{type(e).__name__}: {e}'))
+    user_ids = matrix = None
+    if segment is not None:
+        segment.close()
+
+
+@contextmanager
+def _single_threaded_blas():
+    """Start workers with one BLAS thread each so shards don't oversubscribe cores"""
+    names = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+    saved = {name: os.environ.get(name) for name in names}
+    os.environ.update({name: '1' for name in names})
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+class ShardedIdentifier:
+    """
+    Exhaustive 1:N identification spread over worker processes
+
+    The gallery is partitioned into one shared-memory segment per worker.
+    A query batch is sent to every worker (scatter), each returns its local
+    top k users, and the parent merges them (gather). Templates enrolled
+    after the shards were built live in a delta buffer that the parent
+    searches itself while the workers run. Once the delta exceeds
+    delta_limit it is appended to the smallest shard, which is rebuilt in a
+    new segment and re-attached under a new generation number, so every
+    query sees each template exactly once.
+    """
+
+    def __init__(self, db, processor, shards: int = None, delta_limit: int = 50_000):
+        """
+        Initialize (workers start on first use or via start())
+
+        Args:
+            db: FingerprintDatabase holding the gallery
+            processor: FingerprintProcessor used to decode stored templates
+            shards: Worker processes (defaults to the CPU count)
+            delta_limit: Delta templates that trigger folding into a shard
+        """
+        self.db = db
+        self.processor = processor
+        self.dimension = processor.feature_dimension
+        self.shard_count = max(1, shards or os.cpu_count() or 1)
+        self.delta_limit = delta_limit
+        self.generation = 0
+        self.last_fingerprint_id = 0
+        self._segments = []
+        self._rows = []
+        self._workers = []
+        self._delta_vectors = np.zeros((0, self.dimension), dtype=TEMPLATE_DTYPE)
+        self._delta_user_ids = np.zeros(0, dtype=np.int64)
+        self._stale = False
+        self._check = False
+        self._lock = threading.Lock()
+        db.add_change_listener(self._mark_stale)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+
+    def start(self, snapshot=None) -> 'ShardedIdentifier':
+        """
+        Load the gallery, build shards and start the workers
+
+        Args:
+            snapshot: Optional GallerySnapshot to load from instead of SQLite
+        """
+        with self._lock:
+            if self._workers:
+                return self
+            if snapshot is not None:
+                snapshot.check_source(self.db)
+                fingerprint_ids, user_ids, vectors = snapshot.rows()
+                last_fingerprint_id = snapshot.tail_last_fingerprint_id
+                # The snapshot may miss rows imported below its watermark
+                self._check = True
+            else:
+                fingerprint_ids, user_ids, vectors = _load_rows(self.db, self.processor, 0)
+                last_fingerprint_id = int(fingerprint_ids.max()) if len(fingerprint_ids) else 0
+
+            context = multiprocessing.get_context('spawn')
+            with _single_threaded_blas():
+                for _ in range(self.shard_count):
+                    parent, child = context.Pipe()
+                    process = context.Process(target=_worker, args=(child,), daemon=True,
+                                              name='identification-shard')
+                    process.start()
+                    child.close()
+                    self._workers.append((process, parent))
+
+            self._segments = [None] * self.shard_count
+            self._rows = [0] * self.shard_count
+            self._build_shards(user_ids, vectors)
+            self.last_fingerprint_id = last_fingerprint_id
+        self.sync()
+        return self
+
+    def _build_shards(self, user_ids, vectors):
+        """Partition rows over the shards, replacing their segments and the delta"""
+        # Contiguous user ranges of roughly equal row counts per shard
+        order = np.argsort(user_ids, kind='stable')
+        bounds = np.linspace(0, len(order), self.shard_count + 1).astype(np.int64)
+        old = list(self._segments)
+        for shard in range(self.shard_count):
+            rows = order[bounds[shard]:bounds[shard + 1]]
+            self._publish(shard, user_ids[rows], vectors[rows])
+        self._collect_acks()
+        for segment in old:
+            if segment is not None:
+                segment.close()
+                segment.unlink()
+        self._delta_vectors = self._delta_vectors[:0]
+        self._delta_user_ids = self._delta_user_ids[:0]
+
+    def close(self):
+        """Stop workers and release shared memory"""
+        with self._lock:
+            for process, connection in self._workers:
+                try:
+                    connection.send(None)
+                except (BrokenPipeError, OSError):
+                    pass
+            for process, connection in self._workers:
+                process.join(timeout=5)
+                connection.close()
+            self._workers = []
+            for segment in self._segments:
+                if segment is not None:
+                    segment.close()
+                    segment.unlink()
+            self._segments = []
+
+    def _mark_stale(self, user_id=None):
+        """
+        Database change listener: pick up new rows before the next query
+
+        A bulk change (user_id None), such as an import keeping its source
+        IDs, may add rows at or below last_fingerprint_id, so the next sync
+        also checks the row count.
+        """
+        if user_id is None:
+            self._check = True
+        self._stale = True
+
+    # ------------------------------------------------------------------
+    # Consistency with new enrollments
+    # ------------------------------------------------------------------
+
+    def sync(self) -> int:
+        """
+        Add templates enrolled since the last sync to the delta buffer
+
+        After a bulk change the rows at or below last_fingerprint_id are
+        counted too, and every shard is rebuilt when they differ from the
+        rows held, mirroring IVFIndex.sync(check_watermark=True).
+
+        Returns:
+            Number of templates added (all of them after a rebuild)
+        """
+        with self._lock:
+            return self._sync()
+
+    def _sync(self):
+        """sync body; caller must hold _lock"""
+        self._stale = False
+        check, self._check = self._check, False
+        if check and (self.db.count_fingerprints_through(self.last_fingerprint_id)
+                      != sum(self._rows) + len(self._delta_user_ids)):
+            # Rows appeared below the watermark: rebuild every shard
+            fingerprint_ids, user_ids, vectors = _load_rows(self.db, self.processor, 0)
+            self._build_shards(user_ids, vectors)
+            self.last_fingerprint_id = (int(fingerprint_ids.max()) if len(fingerprint_ids)
+                                        else 0)
+            return len(fingerprint_ids)
+        fingerprint_ids, user_ids, vectors = _load_rows(self.db, self.processor,
+                                                        self.last_fingerprint_id)
+        if len(fingerprint_ids) == 0:
+            return 0
+        self.last_fingerprint_id = int(fingerprint_ids.max())
+        self._delta_vectors = np.concatenate([self._delta_vectors, vectors])
+        self._delta_user_ids = np.concatenate([self._delta_user_ids, user_ids])
+        if len(self._delta_user_ids) > self.delta_limit:
+            self._fold_delta()
+        return len(fingerprint_ids)
+
+    def _fold_delta(self):
+        """Append the delta to the smallest shard under a new generation"""
+        shard = int(np.argmin(self._rows))
+        user_ids, matrix = _shard_arrays(self._segments[shard].buf, self._rows[shard],
+                                         self.dimension)
+        old = self._segments[shard]
+        self._publish(shard, np.concatenate([user_ids, self._delta_user_ids]),
+                      np.concatenate([matrix, self._delta_vectors]))
+        del user_ids, matrix
+        self._collect_acks([shard])
+        old.close()
+        old.unlink()
+        self._delta_vectors = self._delta_vectors[:0]
+        self._delta_user_ids = self._delta_user_ids[:0]
+
+    def _publish(self, shard, user_ids, vectors):
+        """Copy rows into a new segment and ask the shard's worker to attach"""
+        self.generation += 1
+        rows = len(user_ids)
+        segment = shared_memory.SharedMemory(
+            create=True, size=max(1, rows * (8 + self.dimension * TEMPLATE_DTYPE.itemsize))
+        )
+        shard_user_ids, matrix = _shard_arrays(segment.buf, rows, self.dimension)
+        shard_user_ids[:] = user_ids
+        matrix[:] = normalize_templates(vectors) if rows else vectors
+        del shard_user_ids, matrix
+        self._segments[shard] = segment
+        self._rows[shard] = rows
+        self._workers[shard][1].send(('attach', self.generation, segment.name, rows,
+                                      self.dimension))
+
+    def _collect_acks(self, shards=None):
+        """Wait for workers to confirm their new segments"""
+        for shard in (range(len(self._workers)) if shards is None else shards):
+            status, detail = self._workers[shard][1].recv()
+            if status != 'ok':
+                raise RuntimeError(f'Shard {shard} failed to attach: {detail}')
+
+    # ------------------------------------------------------------------
+    # Searching
+    # ------------------------------------------------------------------
+
+    def search(self, features: np.ndarray, top_k: int = 5) -> List[Tuple[int, float]]:
+        """
+        Find the users whose templates best match a probe
+
+        Returns:
+            List of (user_id, score) pairs, best first, scores in [0, 1]
+        """
+        return self.search_many(np.asarray(features)[None, :], top_k)[0]
+
+    def search_many(self, probes: np.ndarray, top_k: int = 5) -> List[List[Tuple[int, float]]]:
+        """
+        Search a batch of probes; batching amortizes the scatter/gather cost
+
+        Args:
+            probes: (M, D) raw feature vectors
+            top_k: Number of candidate users per probe
+
+        Returns:
+            One (user_id, score) list per probe
+        """
+        probes = normalize_templates(probes).reshape(-1, self.dimension)
+        if not self._workers:
+            self.start()
+        with self._lock:
+            if self._stale:
+                self._sync()
+            for _, connection in self._workers:
+                connection.send(('search', probes, top_k))
+            found = _search_rows(self._delta_vectors, self._delta_user_ids, probes, top_k)
+            errors = []
+            for shard, (_, connection) in enumerate(self._workers):
+                status, results = connection.recv()
+                if status != 'ok':
+                    errors.append(f'shard {shard}: {results}')
+                    continue
+                for merged, partial in zip(found, results):
+                    merged.extend(partial)
+        if errors:
+            raise RuntimeError('; '.join(errors))
+        return [_merge(merged, top_k) for merged in found]
+
+    def stats(self) -> dict:
+        """Get shard sizes and delta occupancy"""
+        with self._lock:
+            return {
+                'shards': len(self._workers),
+                'rows_per_shard': list(self._rows),
+                'delta_templates': len(self._delta_user_ids),
+                'generation': self.generation,
+                'last_fingerprint_id': self.last_fingerprint_id
+            }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import time
+    from database import FingerprintDatabase
+    from fingerprint_processor import FingerprintProcessor
+
+    parser = argparse.ArgumentParser(description="Measure sharded identification throughput")
+    parser.add_argument("--db", default="fingerprint_db.sqlite", help="database file")
+    parser.add_argument("--shards", default=None,
+                        help="comma-separated worker counts to compare (default: 1..CPU count)")
+    parser.add_argument("--queries", type=int, default=256)
+    parser.add_argument("--batch", type=int, default=32, help="probes per scatter/gather")
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+
+    cpus = os.cpu_count() or 1
+    counts = ([int(count) for count in args.shards.split(',')] if args.shards
+              else sorted({1, 2, 4, 8, cpus} & set(range(1, cpus + 1))))
+    database = FingerprintDatabase(args.db)
+    processor = FingerprintProcessor()
+    queries = np.random.default_rng(0).standard_normal((args.queries, processor.feature_dimension))
+    reference = None
+    report = []
+    for count in counts:
+        with ShardedIdentifier(database, processor, shards=count) as identifier:
+            start = time.perf_counter()
+            results = []
+            for first in range(0, len(queries), args.batch):
+                results.extend(identifier.search_many(queries[first:first + args.batch],
+                                                      args.top_k))
+            elapsed = time.perf_counter() - start
+        users = [[user_id for user_id, _ in found] for found in results]
+        reference = reference or users
+        report.append({'shards': count, 'queries_per_sec': len(queries) / elapsed,
+                       'matches_first_run': users == reference})
+    print(json.dumps(report, indent=2))
+    database.close()
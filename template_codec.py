@@ -0,0 +1,64 @@
+"""
+Template Codec Module
+Compact binary encoding of fingerprint feature vectors for BLOB storage
+"""
+
+import json
+import struct
+import numpy as np
+from typing import Union
+
+# Header: 4-byte magic, format version, vector dimension (little-endian)
+TEMPLATE_MAGIC = b'FPTV'
+TEMPLATE_VERSION = 1
+HEADER_FORMAT = '<4sHH'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+TEMPLATE_DTYPE = np.dtype('<f4')
+
+StoredTemplate = Union[bytes, bytearray, memoryview, str]
+
+
+def encode_template(features) -> bytes:
+    """
+    Encode a feature vector as a versioned float32 little-endian blob
+
+    Args:
+        features: Feature vector (numpy array, list or JSON string)
+
+    Returns:
+        Binary template: header followed by the raw float32 values
+    """
+    if isinstance(features, str):
+        features = json.loads(features)
+    vector = np.ascontiguousarray(features, dtype=TEMPLATE_DTYPE).ravel()
+    header = struct.pack(HEADER_FORMAT, TEMPLATE_MAGIC, TEMPLATE_VERSION, len(vector))
+    return header + vector.tobytes()
+
+
+def is_binary_template(data: StoredTemplate) -> bool:
+    """Check whether stored template data uses the binary format"""
+    return (isinstance(data, (bytes, bytearray, memoryview))
+            and bytes(data[:len(TEMPLATE_MAGIC)]) == TEMPLATE_MAGIC)
+
+
+def decode_template(data: StoredTemplate) -> np.ndarray:
+    """
+    Decode stored template data in either binary or legacy JSON format
+
+    Binary templates are returned as a zero-copy read-only view of the blob.
+
+    Args:
+        data: BLOB written by encode_template or legacy JSON text
+
+    Returns:
+        Feature vector as a numpy array
+    """
+    if is_binary_template(data):
+        _, version, dimension = struct.unpack_from(HEADER_FORMAT, data)
+        if version != TEMPLATE_VERSION:
+            raise ValueError(f"Unsupported template version: {version}")
+        return np.frombuffer(data, dtype=TEMPLATE_DTYPE, count=dimension,
+                             offset=HEADER_SIZE)
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = bytes(data).decode()
+    return np.array(json.loads(data))
@@ -0,0 +1,78 @@
+"""
+Differential tests of centroid early-exit verification against the exhaustive scan
+"""
+
+import hashlib
+import os
+import tempfile
+import numpy as np
+from authentication import AuthenticationManager
+from centroid_verification import differential_check, scores_consistent, synthetic_users
+from database import FingerprintDatabase
+from template_codec import encode_template
+
+
+def test_differential_check_matches_exhaustive():
+    """Clustered users: identical decisions, consistent scores, fewer dot products"""
+    report = differential_check(synthetic_users(100), probes_per_user=6)
+    assert report['decision_mismatches'] == 0
+    assert report['score_mismatches'] == 0
+    assert report['early_accepts'] > 0 and report['early_rejects'] > 0
+    assert report['mean_dot_products'] < report['exhaustive_mean_dot_products']
+
+
+def test_differential_check_unclustered_users():
+    """Random templates decide nothing early but still agree exactly"""
+    rng = np.random.default_rng(1)
+    users = [rng.standard_normal((5, 128)).astype(np.float32) for _ in range(50)]
+    users = [matrix / np.linalg.norm(matrix, axis=1, keepdims=True) for matrix in users]
+    report = differential_check(users)
+    assert report['decision_mismatches'] == 0
+    assert report['score_mismatches'] == 0
+
+
+def test_authenticate_user_centroid_matches_exhaustive():
+    """authenticate_user with and without centroid verification on one database"""
+    rng = np.random.default_rng(2)
+    users = synthetic_users(30, seed=3)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = FingerprintDatabase(os.path.join(tmp, 'centroid.sqlite'))
+        for number, matrix in enumerate(users):
+            user_id = db.add_user(f'user_{number}', f'user_{number}@example.com')
+            for row in matrix:
+                blob = encode_template(row)
+                db.store_fingerprint(user_id, hashlib.sha256(blob).hexdigest(), blob)
+
+        attempts = []
+        for number, matrix in enumerate(users):
+            for source in (matrix[0], users[(number + 1) % len(users)][0]):
+                probe = source + 0.6 * rng.standard_normal(128) / np.sqrt(128)
+                attempts.append((f'user_{number}', encode_template(probe)))
+
+        auth = AuthenticationManager(db)
+        try:
+            expected = [auth.authenticate_user(name, sample) for name, sample in attempts]
+            auth.enable_centroid_verification()
+            actual = [auth.authenticate_user(name, sample) for name, sample in attempts]
+            auth.log_writer.flush()
+            stats = auth.centroid_verifier.stats()
+        finally:
+            auth.close()
+
+        early = 0
+        for result, exhaustive in zip(actual, expected):
+            assert result['success'] == exhaustive['success']
+            if result['match_percentage'] is None:
+                early += 1
+                assert scores_consistent(result['success'], None, result['score_bound'],
+                                         exhaustive['match_percentage'], tolerance=0.01)
+            else:
+                assert 'score_bound' not in result
+                assert abs(result['match_percentage'] - exhaustive['match_percentage']) <= 0.01
+        assert early == stats['early_accepts'] + stats['early_rejects'] > 0
+
+        # Early decisions are logged without a score rather than re-scanned
+        _, _, _, logged = db.get_authentication_history_columns()
+        assert len(logged) == 2 * len(attempts)
+        assert int(np.isnan(logged).sum()) == early
+        db.close()
@@ -0,0 +1,329 @@
+"""
+Verification Service
+Long-running asyncio HTTP server exposing enrollment, verification,
+identification and history over TCP or a Unix socket
+"""
+
+import asyncio
+import json
+import os
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+from analytics import AuthAnalytics
+from authentication import AuthenticationManager
+from database import FingerprintDatabase
+from enrollment import EnrollmentManager
+from fusion import FUSION_RULES, TrainedFusion
+from metrics import metrics
+from records import Record
+
+MAX_BODY_BYTES = 1024 * 1024
+# Fingerprint samples one request may enroll or verify at most
+MAX_SAMPLES = 10
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 413: 'Payload Too Large',
+           500: 'Internal Server Error'}
+
+
+class HTTPError(Exception):
+    """Request error mapped to an HTTP status"""
+
+    def __init__(self, status: int, message: str):
+        """Initialize error with an HTTP status"""
+        super().__init__(message)
+        self.status = status
+
+
+class VerificationService:
+    """Keeps one warm engine (caches, index, DB pool) shared by all requests"""
+
+    def __init__(self, db_path: str = "fingerprint_db.sqlite", workers: int = None,
+                 batch_window_ms: float = 0.0, max_batch: int = 64):
+        """
+        Initialize service
+
+        Args:
+            db_path: SQLite database file
+            workers: Threads running engine calls (numpy releases the GIL
+                while matching, so these overlap)
+            batch_window_ms: Micro-batching window for verifications (0 disables)
+            max_batch: Verifications scored together at most
+        """
+        workers = workers or min(32, (os.cpu_count() or 1) * 4)
+        self.db = FingerprintDatabase(db_path, max_connections=workers + 2)
+        self.auth_mgr = AuthenticationManager(self.db)
+        self.enrollment_mgr = EnrollmentManager(self.db)
+        self.analytics = AuthAnalytics(self.db)
+        if batch_window_ms > 0:
+            self.auth_mgr.enable_micro_batching(max_batch, batch_window_ms)
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='verify-worker')
+        self.routes = {
+            ('POST', '/enroll'): self.handle_enroll,
+            ('POST', '/verify'): self.handle_verify,
+            ('POST', '/identify'): self.handle_identify,
+            ('GET', '/history'): self.handle_history,
+            ('GET', '/analytics'): self.handle_analytics,
+            ('GET', '/health'): self.handle_health,
+            ('GET', '/metrics'): self.handle_metrics,
+        }
+
+    async def run_blocking(self, func, *args):
+        """Run an engine call on the worker pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    # ------------------------------------------------------------------
+    # Handlers
+    # ------------------------------------------------------------------
+
+    async def handle_enroll(self, body, query):
+        """POST /enroll {username, email, samples?}"""
+        username, email = _require(body, 'username'), _require(body, 'email')
+        samples = int(body.get('samples', 3))
+        if not 1 <= samples <= MAX_SAMPLES:
+            raise HTTPError(400, f'samples must be between 1 and {MAX_SAMPLES}')
+        return await self.run_blocking(self.enrollment_mgr.enroll_user,
+                                       username, email, samples)
+
+    async def handle_verify(self, body, query):
+        """POST /verify {username, fingerprint_sample? | fingerprint_samples}"""
+        username = _require(body, 'username')
+        if 'fingerprint_samples' in body:
+            samples = body['fingerprint_samples']
+            if not isinstance(samples, list):
+                raise HTTPError(400, 'fingerprint_samples must be a list')
+            if len(samples) > MAX_SAMPLES:
+                raise HTTPError(400, f'At most {MAX_SAMPLES} fingerprint_samples per request')
+            sample = [_sample({'fingerprint_sample': s}) for s in samples]
+        else:
+            sample = _sample(body)
+        return await self.run_blocking(self.auth_mgr.authenticate_user, username, sample)
+
+    async def handle_identify(self, body, query):
+        """POST /identify {fingerprint_sample?, top_k?}"""
+        sample = _sample(body)
+        top_k = int(body.get('top_k', 5))
+        return await self.run_blocking(self.auth_mgr.identify, sample, top_k)
+
+    async def handle_history(self, body, query):
+        """GET /history?username=...&limit=..."""
+        username = _require(query, 'username')
+        limit = int(query.get('limit', 10))
+        history = await self.run_blocking(self.auth_mgr.get_authentication_history,
+                                          username, limit)
+        return {'username': username, 'history': history}
+
+    async def handle_analytics(self, body, query):
+        """GET /analytics?hours=...|username=...: dashboard or one user's stats"""
+        username = query.get('username')
+        if username:
+            user_id = await self.run_blocking(self.auth_mgr.gallery.get_user_id, username)
+            if user_id is None:
+                raise HTTPError(404, f'Unknown user: {username}')
+            report = await self.run_blocking(self.analytics.user_summary, user_id)
+            report['username'] = username
+            return report
+        return await self.run_blocking(self.analytics.dashboard,
+                                       int(query.get('hours', 24)))
+
+    async def handle_health(self, body, query):
+        """GET /health: cache and log writer statistics"""
+        health = {'status': 'ok', 'gallery_cache': self.auth_mgr.gallery.stats(),
+                  'log_writer': self.auth_mgr.log_writer.stats()}
+        if self.auth_mgr.batcher is not None:
+            health['micro_batching'] = self.auth_mgr.batcher.metrics()
+        if self.auth_mgr.centroid_verifier is not None:
+            health['centroid_verification'] = self.auth_mgr.centroid_verifier.stats()
+        return health
+
+    async def handle_metrics(self, body, query):
+        """GET /metrics[?format=json]: Prometheus text, or a JSON snapshot"""
+        if query.get('format') == 'json':
+            return metrics.snapshot()
+        return metrics.render_prometheus()
+
+    # ------------------------------------------------------------------
+    # HTTP plumbing
+    # ------------------------------------------------------------------
+
+    async def handle_connection(self, reader, writer):
+        """Serve requests on one keep-alive connection"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await _respond(writer, 400, {'error': 'Malformed request line'}, False)
+                    break
+                headers = await _read_headers(reader)
+                keep_alive = (headers.get('connection', '').lower() != 'close'
+                              and version == 'HTTP/1.1')
+                status, payload = await self.dispatch(method, target, headers, reader)
+                await _respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, target, headers, reader):
+        """Route one request and return (status, payload)"""
+        try:
+            url = urlsplit(target)
+            length = int(headers.get('content-length', 0) or 0)
+            if length > MAX_BODY_BYTES:
+                raise HTTPError(413, 'Request body too large')
+            raw = await reader.readexactly(length) if length else b''
+            handler = self.routes.get((method, url.path))
+            if handler is None:
+                allowed = [m for m, path in self.routes if path == url.path]
+                if allowed:
+                    raise HTTPError(405, f'Use {", ".join(allowed)} for {url.path}')
+                raise HTTPError(404, 'No such endpoint')
+            try:
+                body = json.loads(raw) if raw else {}
+            except json.JSONDecodeError:
+                raise HTTPError(400, 'Body must be JSON')
+            if not isinstance(body, dict):
+                raise HTTPError(400, 'Body must be a JSON object')
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            return 200, await handler(body, query)
+        except HTTPError as e:
+            return e.status, {'error': str(e)}
+        except (TypeError, ValueError) as e:
+            return 400, {'error': str(e)}
+        except Exception as e:
+            return 500, {'error': f'{type(e).__name__}: {e}'}
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8765,
+                    unix_socket: str = None):
+        """Serve until SIGINT/SIGTERM, then drain workers and flush logs"""
+        if unix_socket:
+            server = await asyncio.start_unix_server(self.handle_connection, unix_socket)
+            where = unix_socket
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+            where = f'http://{host}:{port}'
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:  # Windows
+                pass
+
+        print(f"Verification service listening on {where}")
+        async with server:
+            await stop.wait()
+        self.close()
+
+    def close(self):
+        """Release workers, flush logs and persist the index"""
+        self.executor.shutdown(wait=True)
+        self.auth_mgr.close()
+        self.db.close()
+        metrics.stop_json_dump()
+
+
+def _require(mapping, key):
+    """Get a required request field"""
+    value = mapping.get(key)
+    if value in (None, ''):
+        raise HTTPError(400, f'Missing field: {key}')
+    return value
+
+
+def _sample(body):
+    """Get an optional fingerprint sample as a list or JSON string"""
+    sample = body.get('fingerprint_sample')
+    if isinstance(sample, list):
+        return json.dumps(sample)
+    return sample
+
+
+async def _read_headers(reader):
+    """Read HTTP headers into a lower-cased dict"""
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            return headers
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+
+def _json_default(value):
+    """Encode slotted records as objects and anything else as its string"""
+    if isinstance(value, Record):
+        return value.to_dict()
+    return str(value)
+
+
+async def _respond(writer, status, payload, keep_alive):
+    """Write a JSON response, or plain text when the payload is a string"""
+    if isinstance(payload, str):
+        body, content_type = payload.encode(), 'text/plain; version=0.0.4'
+    else:
+        body, content_type = json.dumps(payload, default=_json_default).encode(), 'application/json'
+    head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(head.encode('latin-1') + body)
+    await writer.drain()
+
+
+def main():
+    """Command-line entry point"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fingerprint verification service")
+    parser.add_argument("--db", default="fingerprint_db.sqlite", help="database file")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix-socket", default=None, help="serve on a Unix socket instead")
+    parser.add_argument("--workers", type=int, default=None, help="engine worker threads")
+    parser.add_argument("--batch-window-ms", type=float, default=0.0,
+                        help="micro-batch verifications over this window (0 disables)")
+    parser.add_argument("--max-batch", type=int, default=64,
+                        help="verifications scored together at most")
+    parser.add_argument("--centroid-verification", action="store_true",
+                        help="decide clear verifications from per-user centroids")
+    parser.add_argument("--fusion-rule", default="max", choices=FUSION_RULES,
+                        help="how multi-sample verifications fuse per-probe scores")
+    parser.add_argument("--fusion-weights", default=None,
+                        help="comma-separated per-probe weights for --fusion-rule weighted")
+    parser.add_argument("--fusion-model", default=None, metavar="PATH",
+                        help="TrainedFusion JSON for --fusion-rule trained")
+    parser.add_argument("--metrics", action="store_true",
+                        help="record stage timings and counters (served at /metrics)")
+    parser.add_argument("--metrics-json", default=None, metavar="PATH",
+                        help="also dump metrics to this JSON file periodically")
+    parser.add_argument("--metrics-interval", type=float, default=60.0,
+                        help="seconds between JSON metric dumps")
+    args = parser.parse_args()
+
+    if args.metrics or args.metrics_json:
+        metrics.enable()
+    if args.metrics_json:
+        metrics.start_json_dump(args.metrics_json, args.metrics_interval)
+
+    service = VerificationService(args.db, args.workers, args.batch_window_ms,
+                                  args.max_batch)
+    if args.centroid_verification:
+        service.auth_mgr.enable_centroid_verification()
+    weights = [float(w) for w in args.fusion_weights.split(',')] if args.fusion_weights else None
+    model = TrainedFusion.load(args.fusion_model) if args.fusion_model else None
+    service.auth_mgr.enable_fusion(args.fusion_rule, weights, model)
+    asyncio.run(service.serve(args.host, args.port, args.unix_socket))
+
+
+if __name__ == "__main__":
+    main()